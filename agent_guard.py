@@ -0,0 +1,136 @@
+"""
+Loop and repetition guard for the ReAct agent
+Wraps LangChain's AgentExecutor so runs that stop making progress end early
+instead of burning LLM round trips until max_iterations:
+- the same tool input producing the same observation again, consecutive parse
+  failures or reaching the iteration budget end the run with the latest
+  successful observation (as the final answer when it is a JSON result)
+Ordinary multi-step runs (exploring columns, then computing) are left alone.
+"""
+
+import logging
+import re
+import threading
+import time
+
+from langchain.agents import AgentExecutor
+from langchain.schema import AgentFinish
+
+import metrics
+from config import AI_CONFIG
+from html_responses import error_html, is_tool_error, parse_observation, render_result_html
+from tool_cache import strip_annotations
+
+logger = logging.getLogger(__name__)
+
+_state = threading.local()
+
+
+def _normalize(text):
+    return re.sub(r'\s+', ' ', str(text)).strip()
+
+
+def is_final_observation(observation):
+    """A successful observation carrying a JSON object or list of records"""
+    if is_tool_error(observation):
+        return False
+    value = parse_observation(observation)
+    return isinstance(value, (dict, list)) and bool(value)
+
+
+def last_run_stats():
+    """Iterations, parse failures and guard outcome of this thread's latest run"""
+    return dict(getattr(_state, 'stats', {}))
+
+
+class GuardedAgentExecutor(AgentExecutor):
+    """AgentExecutor that short-circuits ReAct loops which stopped making progress"""
+
+    max_repeated_actions: int = 2
+    max_parse_failures: int = 2
+    force_final_answer: bool = True
+
+    def _call(self, inputs, run_manager=None):
+        _state.steps = []
+        _state.parse_failures = 0
+        _state.stats = {'iterations': 0, 'parse_failures': 0, 'guard': None}
+        started = time.time()
+        try:
+            return super()._call(inputs, run_manager=run_manager)
+        finally:
+            metrics.increment('react.runs')
+            metrics.observe('react.iterations', _state.stats['iterations'])
+            metrics.observe('react.seconds', time.time() - started)
+
+    def _get_tool_return(self, next_step_output):
+        finish = super()._get_tool_return(next_step_output)
+        if finish is not None:
+            return finish
+        agent_action, observation = next_step_output
+        return self._check_progress(agent_action, observation)
+
+    def _finish(self, output, reason):
+        return_value_key = self.agent.return_values[0] if self.agent.return_values else "output"
+        _state.stats['guard'] = reason
+        metrics.increment(f'react.loop_guard.{reason}')
+        logger.warning(f"Loop guard stopped agent after {_state.stats['iterations']} iterations: {reason}")
+        return AgentFinish({return_value_key: output}, f"Loop guard: {reason}")
+
+    def _best_partial(self, reason):
+        """Finish with the latest successful observation, or an error card if there is none"""
+        for kind, _, observation in reversed(_state.steps):
+            if kind == 'tool' and not is_tool_error(observation):
+                final = self.force_final_answer and is_final_observation(observation)
+                return self._finish(render_result_html("Analysis Result" if final else "Partial Result", observation), reason)
+        return self._finish(
+            error_html(
+                "Processing Error",
+                "I couldn't complete this analysis. Please try rephrasing your question or ask about a different aspect of the loan portfolio."
+            ),
+            reason
+        )
+
+    def _check_progress(self, agent_action, observation):
+        _state.stats['iterations'] += 1
+        observation = strip_annotations(observation)
+
+        if agent_action.tool == '_Exception':
+            _state.parse_failures += 1
+            _state.stats['parse_failures'] += 1
+            metrics.increment('react.parse_failures')
+            _state.steps.append(('parse_error', None, _normalize(observation)))
+            if _state.parse_failures >= self.max_parse_failures:
+                return self._best_partial('parse_stall')
+            return self._check_budget()
+
+        _state.parse_failures = 0
+        metrics.increment('react.tool_calls')
+        tool_input = _normalize(agent_action.tool_input)
+        normalized_observation = _normalize(observation)
+        # Only the same input giving the same result is a loop; different code may well print "Code executed"
+        repeats = sum(
+            1 for kind, i, o in _state.steps
+            if kind == 'tool' and i == tool_input and _normalize(o) == normalized_observation
+        )
+        _state.steps.append(('tool', tool_input, observation))
+        if repeats + 1 >= self.max_repeated_actions:
+            return self._best_partial('repeated_action')
+        return self._check_budget()
+
+    def _check_budget(self):
+        """On the last allowed iteration, answer from the latest observation instead of another LLM call"""
+        if self.force_final_answer and self.max_iterations and _state.stats['iterations'] >= self.max_iterations:
+            return self._best_partial('iteration_budget')
+        return None
+
+
+def build_guarded_executor(agent, tools, **kwargs):
+    """Create a GuardedAgentExecutor configured from AI_CONFIG"""
+    return GuardedAgentExecutor.from_agent_and_tools(
+        agent=agent,
+        tools=tools,
+        max_repeated_actions=AI_CONFIG['LOOP_GUARD_MAX_REPEATS'],
+        max_parse_failures=AI_CONFIG['LOOP_GUARD_MAX_PARSE_FAILURES'],
+        force_final_answer=AI_CONFIG['LOOP_GUARD_FORCE_FINAL'],
+        **kwargs
+    )
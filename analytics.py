@@ -0,0 +1,252 @@
+"""
+LLM-free analytics over the loan datasets
+Plain pandas aggregates behind the /api/portfolio, /api/managers, /api/products,
+/api/arrears and /api/ledger endpoints, for dashboards and other machine
+clients. Results are memoized per data version, so repeated calls cost a dict
+lookup until the CSVs change. Per-manager and per-product views run on the
+encoded group-by kernels instead of one pandas pass per group.
+"""
+
+import functools
+import logging
+import threading
+from collections import OrderedDict
+from datetime import date
+
+import numpy as np
+
+import ledger_store
+from config import PERFORMANCE_CONFIG
+from datasets import get_data_version, load_dataset
+from groupby_kernels import grouped_sums
+
+logger = logging.getLogger(__name__)
+
+_memo = OrderedDict()
+_memo_version = {'version': None}
+_lock = threading.Lock()
+
+
+def memoized(func):
+    """Cache func(*args) until the data version changes (LRU of ANALYTICS_MEMO_SIZE entries)"""
+    @functools.wraps(func)
+    def wrapper(*args):
+        version = get_data_version()
+        key = (func.__name__, args)
+        with _lock:
+            if _memo_version['version'] != version:
+                _memo.clear()
+                _memo_version['version'] = version
+            if key in _memo:
+                _memo.move_to_end(key)
+                return _memo[key]
+        result = func(*args)
+        with _lock:
+            _memo[key] = result
+            while len(_memo) > PERFORMANCE_CONFIG['ANALYTICS_MEMO_SIZE']:
+                _memo.popitem(last=False)
+        return result
+    return wrapper
+
+
+def _money(value):
+    return round(float(value), 2)
+
+
+def _rate(paid, expected):
+    return round(float(paid) / float(expected) * 100, 1) if expected else None
+
+
+def _totals(frame):
+    """Headline numbers shared by the portfolio, manager and product views"""
+    active = frame[frame['Status'] == 'Active']
+    expected = active['Expected_Before_Today'].sum()
+    paid = active['Total_Paid'].sum()
+    return {
+        'loans': int(len(frame)),
+        'active_loans': int(len(active)),
+        'clients': int(frame['Client_Code'].nunique()),
+        'amount_disbursed': _money(frame['Amount_Disbursed'].sum()),
+        'total_charged': _money(frame['Total_Charged'].sum()),
+        'total_paid': _money(frame['Total_Paid'].sum()),
+        'expected_before_today': _money(expected),
+        'collection_rate': _rate(paid, expected),
+        'arrears': _money(frame['Arrears'].sum()),
+        'loans_in_arrears': int((frame['Arrears'] > 0).sum()),
+        'due_today': _money(frame['Due_Today'].sum()),
+        'loans_due_today': int((frame['Due_Today'] > 0).sum()),
+    }
+
+
+def _grouped_totals(df, by, mask=None):
+    """_totals() for every value of `by` in one kernel pass: {label: totals}"""
+    active = (df['Status'] == 'Active').to_numpy()
+    sums = grouped_sums('processed_data', by, {
+        'active_loans': active,
+        'amount_disbursed': 'Amount_Disbursed',
+        'total_charged': 'Total_Charged',
+        'total_paid': 'Total_Paid',
+        'active_paid': np.where(active, df['Total_Paid'], 0),
+        'expected_before_today': np.where(active, df['Expected_Before_Today'], 0),
+        'arrears': 'Arrears',
+        'loans_in_arrears': (df['Arrears'] > 0).to_numpy(),
+        'due_today': 'Due_Today',
+        'loans_due_today': (df['Due_Today'] > 0).to_numpy(),
+    }, distinct=['Client_Code'], mask=mask)
+    return {
+        label: {
+            'loans': int(g['rows']),
+            'active_loans': int(g['active_loans']),
+            'clients': int(g['Client_Code']),
+            'amount_disbursed': _money(g['amount_disbursed']),
+            'total_charged': _money(g['total_charged']),
+            'total_paid': _money(g['total_paid']),
+            'expected_before_today': _money(g['expected_before_today']),
+            'collection_rate': _rate(g['active_paid'], g['expected_before_today']),
+            'arrears': _money(g['arrears']),
+            'loans_in_arrears': int(g['loans_in_arrears']),
+            'due_today': _money(g['due_today']),
+            'loans_due_today': int(g['loans_due_today']),
+        }
+        for label, g in sums.items()
+    }
+
+
+@memoized
+def portfolio_summary():
+    """Whole-portfolio totals; collection_rate compares Total_Paid to Expected_Before_Today on active loans"""
+    df = load_dataset('processed_data')
+    return {
+        **_totals(df),
+        'managers': int(df['Managed_By'].nunique()),
+        'products': int(df['Loan_Product_Type'].nunique()),
+        'first_issued': str(df['Issued_Date'].min()),
+        'last_issued': str(df['Issued_Date'].max()),
+    }
+
+
+@memoized
+def managers():
+    """Headline numbers for every manager"""
+    df = load_dataset('processed_data')
+    return _grouped_totals(df, 'Managed_By')
+
+
+@memoized
+def resolve_manager(name):
+    """Canonical manager name for a full or unique first name (case-insensitive), else None"""
+    names = load_dataset('processed_data')['Managed_By'].dropna().unique()
+    wanted = name.strip().lower()
+    for manager in names:
+        if manager.lower() == wanted:
+            return manager
+    matches = [m for m in names if m.split()[0].lower() == wanted]
+    return matches[0] if len(matches) == 1 else None
+
+
+@memoized
+def manager_performance(name):
+    """A manager's totals with a per-product breakdown; KeyError for an unknown manager"""
+    manager = resolve_manager(name)
+    if manager is None:
+        raise KeyError(f"Unknown manager '{name}'")
+    df = load_dataset('processed_data')
+    frame = df[df['Managed_By'] == manager]
+    return {
+        'manager': manager,
+        **_totals(frame),
+        'products': _grouped_totals(df, 'Loan_Product_Type', mask=(df['Managed_By'] == manager).to_numpy()),
+    }
+
+
+@memoized
+def products():
+    """Totals per loan product, with the average loan size"""
+    df = load_dataset('processed_data')
+    return {
+        product: {**totals, 'average_loan': _money(totals['amount_disbursed'] / totals['loans'])}
+        for product, totals in _grouped_totals(df, 'Loan_Product_Type').items()
+    }
+
+
+@memoized
+def top_arrears(top):
+    """The `top` loans with the largest arrears"""
+    if top < 1:
+        raise ValueError("top must be a positive number")
+    df = load_dataset('processed_data')
+    rows = df[df['Arrears'] > 0].nlargest(top, 'Arrears')
+    return {
+        'total_arrears': _money(df['Arrears'].sum()),
+        'loans_in_arrears': int((df['Arrears'] > 0).sum()),
+        'loans': [
+            {
+                'loan_no': row['Loan_No'],
+                'client_code': row['Client_Code'],
+                'client_name': row['Client_Name'],
+                'manager': row['Managed_By'],
+                'product': row['Loan_Product_Type'],
+                'issued_date': row['Issued_Date'],
+                'amount_disbursed': _money(row['Amount_Disbursed']),
+                'total_paid': _money(row['Total_Paid']),
+                'arrears': _money(row['Arrears']),
+                'phone': str(row['Mobile_Phone_No']),
+            }
+            for _, row in rows.iterrows()
+        ],
+    }
+
+
+def _parse_date(value, name):
+    try:
+        return date.fromisoformat(value).isoformat()
+    except (TypeError, ValueError):
+        raise ValueError(f"'{name}' must be a date in YYYY-MM-DD format")
+
+
+@memoized
+def ledger_daily(date_from=None, date_to=None):
+    """Collections per posting day (inclusive range; open ends default to the whole ledger)"""
+    date_from = _parse_date(date_from, 'from') if date_from else None
+    date_to = _parse_date(date_to, 'to') if date_to else None
+    if date_from and date_to and date_from > date_to:
+        raise ValueError("'from' must not be after 'to'")
+    if ledger_store.enabled():
+        # Only the partitions in the range are read
+        daily = ledger_store.get_store().summarize(
+            'Posting_Date', ['Interest_Paid', 'Principle_Paid', 'Total_Paid'], date_from, date_to
+        ).rename(columns={
+            'rows': 'transactions', 'Interest_Paid': 'interest_paid',
+            'Principle_Paid': 'principal_paid', 'Total_Paid': 'total_paid'
+        })
+    else:
+        ledger = load_dataset('ledger')
+        # ISO dates compare correctly as strings
+        mask = True
+        if date_from:
+            mask = ledger['Posting_Date'] >= date_from
+        if date_to:
+            mask = mask & (ledger['Posting_Date'] <= date_to)
+        frame = ledger[mask] if mask is not True else ledger
+        daily = frame.groupby('Posting_Date', sort=True).agg(
+            transactions=('Loan_No', 'size'),
+            interest_paid=('Interest_Paid', 'sum'),
+            principal_paid=('Principle_Paid', 'sum'),
+            total_paid=('Total_Paid', 'sum'),
+        )
+    return {
+        'from': date_from,
+        'to': date_to,
+        'days': [
+            {
+                'date': day,
+                'transactions': int(row['transactions']),
+                'interest_paid': _money(row['interest_paid']),
+                'principal_paid': _money(row['principal_paid']),
+                'total_paid': _money(row['total_paid']),
+            }
+            for day, row in daily.iterrows()
+        ],
+        'total_paid': _money(daily['total_paid'].sum()),
+        'transactions': int(daily['transactions'].sum()),
+    }
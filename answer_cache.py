@@ -0,0 +1,110 @@
+"""
+Answer cache for /chat
+Stores finished answers keyed like single-flight requests (normalized prompt,
+data version, mode and history), in a SQLite table shared by all workers.
+Entries expire after PERFORMANCE_CONFIG['CACHE_TIMEOUT'] seconds and are
+dropped when the data version changes. Failed answers (error cards) are never
+cached.
+"""
+
+import logging
+import os
+import sqlite3
+import time
+
+import metrics
+from config import PERFORMANCE_CONFIG
+from datasets import get_data_version
+from html_responses import is_error_response
+
+logger = logging.getLogger(__name__)
+
+
+def _db_path():
+    return PERFORMANCE_CONFIG['ANSWER_CACHE_DB']
+
+
+def _connect():
+    path = _db_path()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS answers ("
+        "key TEXT PRIMARY KEY, data_version TEXT, response TEXT, created REAL, hits INTEGER DEFAULT 0)"
+    )
+    return conn
+
+
+def get(key):
+    """The cached answer for a request key, or None"""
+    if not PERFORMANCE_CONFIG['CACHE_ENABLED'] or not _db_path():
+        return None
+    try:
+        conn = _connect()
+        with conn:
+            row = conn.execute(
+                "SELECT response FROM answers WHERE key = ? AND created > ?",
+                (key, time.time() - PERFORMANCE_CONFIG['CACHE_TIMEOUT'])
+            ).fetchone()
+            if row:
+                conn.execute("UPDATE answers SET hits = hits + 1 WHERE key = ?", (key,))
+        conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"Answer cache lookup failed: {e}")
+        return None
+    metrics.increment('answer_cache.hits' if row else 'answer_cache.misses')
+    return row[0] if row else None
+
+
+def put(key, response):
+    """Store a successful answer; error cards and empty answers are skipped"""
+    if not PERFORMANCE_CONFIG['CACHE_ENABLED'] or not _db_path():
+        return
+    # promt_llm returns every failure as an error card
+    if is_error_response(response):
+        metrics.increment('answer_cache.rejected_errors')
+        return
+    try:
+        version = get_data_version()
+        conn = _connect()
+        with conn:
+            conn.execute(
+                "INSERT OR REPLACE INTO answers (key, data_version, response, created) VALUES (?, ?, ?, ?)",
+                (key, version, response, time.time())
+            )
+            # Answers for older data or past their timeout can never be served
+            conn.execute(
+                "DELETE FROM answers WHERE data_version != ? OR created <= ?",
+                (version, time.time() - PERFORMANCE_CONFIG['CACHE_TIMEOUT'])
+            )
+            conn.execute(
+                "DELETE FROM answers WHERE key NOT IN (SELECT key FROM answers ORDER BY created DESC LIMIT ?)",
+                (PERFORMANCE_CONFIG['ANSWER_CACHE_MAX_ROWS'],)
+            )
+        conn.close()
+    except sqlite3.Error as e:
+        logger.warning(f"Answer cache store failed: {e}")
+
+
+def clear():
+    if _db_path() and os.path.exists(_db_path()):
+        conn = _connect()
+        with conn:
+            conn.execute("DELETE FROM answers")
+        conn.close()
+
+
+def stats():
+    """Entry count and total hits of the current data version"""
+    if not _db_path() or not os.path.exists(_db_path()):
+        return {'entries': 0, 'hits': 0}
+    try:
+        conn = _connect()
+        entries, hits = conn.execute(
+            "SELECT COUNT(*), COALESCE(SUM(hits), 0) FROM answers WHERE data_version = ?", (get_data_version(),)
+        ).fetchone()
+        conn.close()
+    except sqlite3.Error:
+        return {'entries': 0, 'hits': 0}
+    return {'entries': entries, 'hits': hits}
@@ -1,11 +1,10 @@
-from flask import Flask, request, jsonify, render_template
+from flask import Flask, Response, request, jsonify, render_template
 import requests
-from utils_simple import promt_llm, clear_conversation_memory, get_conversation_memory
 import asyncio
 import logging
 import time
 from datetime import datetime
-from config import FLASK_CONFIG, AI_CONFIG, ERROR_MESSAGES, SUCCESS_MESSAGES, LOGGING_CONFIG, PERFORMANCE_CONFIG, SECURITY_CONFIG
+from config import FLASK_CONFIG, AI_CONFIG, DATA_CONFIG, ERROR_MESSAGES, SUCCESS_MESSAGES, LOGGING_CONFIG, PERFORMANCE_CONFIG, SECURITY_CONFIG
 import re
 
 # Configure logging with rotation
@@ -33,6 +32,10 @@ logger = logging.getLogger(__name__)
 app = Flask(__name__)
 app.secret_key = FLASK_CONFIG['SECRET_KEY']
 
+# The agent stack (LangChain, pandas, the datasets) is imported by the routes that use it,
+# so /health, /api/info and static files answer as soon as Flask is up. Gunicorn preloads
+# it in the master before forking (see startup.py).
+
 
 
 def validate_sql_query(query):
@@ -78,6 +81,7 @@ def index():
 @app.route("/home/", methods=['GET'])
 async def home():
     try:
+        from utils_simple import promt_llm
         response = await promt_llm(query="Hello, How are you")
         return jsonify({
             "response": response,
@@ -118,6 +122,8 @@ async def chat():
 
         prompt = data.get("promt")
         history = data.get("history", [])
+        mode = data.get("mode")  # None lets the router pick the pool
+        session_id = data.get("session_id")
         
         # Sanitize and validate input
         if not prompt or not prompt.strip():
@@ -127,20 +133,60 @@ async def chat():
                 "timestamp": datetime.now().isoformat()
             }), 400
         
+        if mode is not None and mode not in AI_CONFIG['AGENT_MODES']:
+            return jsonify({
+                "error": "Invalid mode",
+                "message": f"Mode must be one of: {', '.join(AI_CONFIG['AGENT_MODES'])}",
+                "timestamp": datetime.now().isoformat()
+            }), 400
+        
         prompt = sanitize_input(prompt)
 
         # Log the request
-        logger.info(f"Processing chat request from {client_ip}: {prompt[:100]}...")
+        logger.info(f"Processing chat request from {client_ip} ({mode or 'auto'}): {prompt[:100]}...")
         
         # Process the request with timeout
         try:
             # Use a more generous timeout for AI processing
-            response = await asyncio.wait_for(
-                promt_llm(query=prompt, conversation_history=history), 
-                timeout=AI_CONFIG['REQUEST_TIMEOUT']
+            # Chats get interactive priority for LLM/tool slots, shared fairly per session (or IP)
+            import scheduler
+            scheduler.set_context('interactive', session_id or client_ip)
+            import answer_cache
+            import query_log
+            import singleflight
+            from utils_simple import promt_llm
+            key = singleflight.make_key(prompt, mode, history)
+            turn_token = query_log.begin_turn()
+            response = answer_cache.get(key)
+            cached = response is not None
+            coalesced = False
+            if cached:
+                query_log.note(outcome='answer_cache')
+            else:
+                # Identical questions already being answered (in any worker) share that run
+                response, coalesced = await asyncio.wait_for(
+                    singleflight.coalesce(
+                        key,
+                        lambda: promt_llm(query=prompt, conversation_history=history, mode=mode, session_id=session_id)
+                    ),
+                    timeout=AI_CONFIG['REQUEST_TIMEOUT']
+                )
+                if coalesced:
+                    query_log.note(outcome='coalesced')
+                else:
+                    answer_cache.put(key, response)
+            from html_responses import is_error_response
+            # Failed answers are kept out of the popular questions that get replayed
+            query_log.record(
+                prompt, time.time() - start_time, mode=mode, has_history=bool(history),
+                status='error' if is_error_response(response) else 'ok', **query_log.end_turn(turn_token)
             )
         except asyncio.TimeoutError:
             logger.warning(f"Request timeout for client {client_ip} after {AI_CONFIG['REQUEST_TIMEOUT']}s")
+            query_log.record(
+                prompt, time.time() - start_time, mode=mode, has_history=bool(history), status='timeout',
+                **query_log.end_turn(turn_token)
+            )
             return jsonify({
                 "error": "Request timeout",
                 "message": ERROR_MESSAGES['TIMEOUT'],
@@ -150,12 +196,16 @@ async def chat():
         
         # Log response time
         response_time = time.time() - start_time
-        logger.info(f"Chat response generated successfully in {response_time:.2f}s")
+        served = ' (cached)' if cached else ' (coalesced)' if coalesced else ''
+        logger.info(f"Chat response generated successfully in {response_time:.2f}s{served}")
         
         return jsonify({
             "response": response,
             "timestamp": datetime.now().isoformat(),
             "status": "success",
+            "mode": mode or "auto",
+            "cached": cached,
+            "coalesced": coalesced,
             "response_time": round(response_time, 2)
         })
 
@@ -192,6 +242,32 @@ def health_check():
             "error": str(e)
         }), 500
 
+@app.route("/api/metrics", methods=['GET'])
+def get_metrics():
+    """Per-worker counters and latency/iteration summaries"""
+    import metrics
+    return jsonify({
+        **metrics.snapshot(),
+        "rates": {
+            # Parse failures per ReAct run vs per JSON-protocol LLM call
+            "react_parse_failures_per_run": metrics.ratio('react.parse_failures', 'react.runs'),
+            "react_fatal_parse_errors_per_run": metrics.ratio('react.fatal_parse_errors', 'react.runs'),
+            "json_parse_failures_per_call": metrics.ratio('json.parse_failures', 'json.llm_calls'),
+            "json_fallbacks_per_run": metrics.ratio('json.fallbacks', 'json.runs')
+        },
+        "pid": os.getpid(),
+        "timestamp": datetime.now().isoformat()
+    })
+
+@app.route("/api/memory/report", methods=['GET'])
+def memory_report_view():
+    """This worker's RSS broken down by DataFrames, conversation memory and (when tracing) Python allocations per package"""
+    import memory_report
+    return jsonify({
+        **memory_report.report(request.args.get('top', 15, type=int)),
+        "timestamp": datetime.now().isoformat()
+    })
+
 @app.route("/api/info", methods=['GET'])
 def api_info():
     """API information endpoint"""
@@ -210,7 +286,9 @@ def api_info():
         "config": {
             "max_query_length": AI_CONFIG['MAX_QUERY_LENGTH'],
             "max_sql_length": AI_CONFIG['MAX_SQL_LENGTH'],
-            "timeout_seconds": AI_CONFIG['TIMEOUT_SECONDS']
+            "timeout_seconds": AI_CONFIG['TIMEOUT_SECONDS'],
+            "agent_mode": AI_CONFIG['AGENT_MODE'],
+            "agent_modes": AI_CONFIG['AGENT_MODES']
         },
         "timestamp": datetime.now().isoformat()
     })
@@ -219,6 +297,7 @@ def api_info():
 def clear_memory():
     """Clear conversation memory"""
     try:
+        from utils_simple import clear_conversation_memory
         result = clear_conversation_memory()
         logger.info("Memory cleared successfully")
         return jsonify({
@@ -238,6 +317,7 @@ def clear_memory():
 def get_memory():
     """Get current conversation memory"""
     try:
+        from utils_simple import get_conversation_memory
         memory_messages = get_conversation_memory()
         return jsonify({
             "memory": [{"role": msg.type, "content": msg.content} for msg in memory_messages],
@@ -257,6 +337,7 @@ def get_memory():
 def debug_memory():
     """Debug endpoint to check memory status"""
     try:
+        from utils_simple import get_conversation_memory
         memory_messages = get_conversation_memory()
         return jsonify({
             "memory_exists": True,
@@ -274,6 +355,411 @@ def debug_memory():
             "timestamp": datetime.now().isoformat()
         }), 500
 
+@app.route("/api/cache/programs", methods=['GET', 'DELETE'])
+def program_cache_info():
+    """Inspect or clear the stored question-template programs"""
+    try:
+        import program_cache
+        if request.method == 'DELETE':
+            program_cache.clear()
+            logger.info("Program cache cleared")
+        return jsonify({
+            **program_cache.stats(),
+            "timestamp": datetime.now().isoformat(),
+            "status": "success"
+        })
+    except Exception as e:
+        logger.error(f"Error accessing program cache: {e}")
+        return jsonify({
+            "error": "Program cache unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route("/api/cache/tools", methods=['GET', 'DELETE'])
+def tool_cache_info():
+    """Inspect or clear the python_calculator result cache"""
+    try:
+        import tool_cache
+        if request.method == 'DELETE':
+            tool_cache.clear()
+            logger.info("Tool result cache cleared")
+        return jsonify({
+            **tool_cache.stats(),
+            "timestamp": datetime.now().isoformat(),
+            "status": "success"
+        })
+    except Exception as e:
+        logger.error(f"Error accessing tool cache: {e}")
+        return jsonify({
+            "error": "Tool cache unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route("/api/querylog")
+def query_log_info():
+    """Request/latency/outcome stats, the most asked questions (?top=N) and answer cache size"""
+    try:
+        import answer_cache
+        import query_log
+        top = min(max(request.args.get('top', 20, type=int), 1), 200)
+        return jsonify({
+            "stats": query_log.stats(),
+            "popular": query_log.popular(top),
+            "answer_cache": answer_cache.stats(),
+            "timestamp": datetime.now().isoformat(),
+            "status": "success"
+        })
+    except Exception as e:
+        logger.error(f"Error reading query log: {e}")
+        return jsonify({
+            "error": "Query log unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route("/api/jobs", methods=['POST'])
+def submit_job():
+    """Queue a question for job_worker.py and return its job id immediately"""
+    try:
+        data = request.get_json(silent=True) or {}
+        prompt = data.get("promt")
+        mode = data.get("mode")
+        callback_url = data.get("callback_url")
+        priority = data.get("priority", "batch")
+
+        if not prompt or not str(prompt).strip():
+            return jsonify({
+                "error": "Missing or empty prompt",
+                "message": "Please provide a question about your loan data",
+                "timestamp": datetime.now().isoformat()
+            }), 400
+        if mode is not None and mode not in AI_CONFIG['AGENT_MODES']:
+            return jsonify({
+                "error": "Invalid mode",
+                "message": f"Mode must be one of: {', '.join(AI_CONFIG['AGENT_MODES'])}",
+                "timestamp": datetime.now().isoformat()
+            }), 400
+        if priority not in PERFORMANCE_CONFIG['SCHEDULER_CLASSES']:
+            return jsonify({
+                "error": "Invalid priority",
+                "message": f"Priority must be one of: {', '.join(PERFORMANCE_CONFIG['SCHEDULER_CLASSES'])}",
+                "timestamp": datetime.now().isoformat()
+            }), 400
+        import jobs
+        problem = jobs.callback_url_problem(callback_url) if callback_url else None
+        if problem:
+            return jsonify({
+                "error": "Invalid callback_url",
+                "message": problem,
+                "timestamp": datetime.now().isoformat()
+            }), 400
+
+        job_id = jobs.create_job(
+            sanitize_input(prompt),
+            mode=mode,
+            history=data.get("history", []),
+            session_id=data.get("session_id"),
+            callback_url=callback_url,
+            priority=priority,
+            client=data.get("session_id") or request.remote_addr
+        )
+        logger.info(f"Queued job {job_id} from {request.remote_addr}: {prompt[:100]}")
+        return jsonify({
+            "job_id": job_id,
+            "status": "queued",
+            "priority": priority,
+            "status_url": f"/api/jobs/{job_id}",
+            "timestamp": datetime.now().isoformat()
+        }), 202
+    except Exception as e:
+        logger.error(f"Error queueing job: {e}")
+        return jsonify({
+            "error": "Could not queue job",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route("/api/jobs/<job_id>")
+def job_status(job_id):
+    """Job status, progress and (when done) the answer; ?wait=N long-polls until it finishes"""
+    try:
+        import jobs
+        wait = min(max(request.args.get('wait', 0, type=float), 0), PERFORMANCE_CONFIG['JOB_MAX_WAIT_SECONDS'])
+        job = jobs.wait_for(job_id, wait) if wait else jobs.get_job(job_id)
+        if job is None:
+            return jsonify({
+                "error": "Unknown job",
+                "message": f"Job '{job_id}' does not exist or has expired",
+                "timestamp": datetime.now().isoformat()
+            }), 404
+        return jsonify({
+            **jobs.public_view(job),
+            "timestamp": datetime.now().isoformat()
+        })
+    except Exception as e:
+        logger.error(f"Error reading job {job_id}: {e}")
+        return jsonify({
+            "error": "Job status unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+def _analytics_response(compute, *args):
+    """
+    JSON for an analytics endpoint. The ETag is the data version, so clients
+    revalidating with If-None-Match get a 304 until the CSVs change.
+    """
+    try:
+        from datasets import get_data_version
+        version = get_data_version()
+        if request.if_none_match.contains_weak(version):
+            # The client's copy is current: answer before computing anything
+            # (only a 200 for this URL handed out the ETag, so the arguments were valid then)
+            response = Response(status=304)
+        else:
+            payload = compute(*args)
+            response = jsonify({
+                **payload,
+                "data_version": version,
+                "timestamp": datetime.now().isoformat(),
+                "status": "success"
+            })
+        # Weak: the body carries a timestamp, but the data behind it is the same
+        response.set_etag(version, weak=True)
+        response.headers['Cache-Control'] = 'no-cache'
+        return response
+    except KeyError as e:
+        return jsonify({
+            "error": "Not found",
+            "message": e.args[0] if e.args else "Not found",
+            "timestamp": datetime.now().isoformat()
+        }), 404
+    except ValueError as e:
+        return jsonify({
+            "error": "Invalid parameter",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 400
+    except Exception as e:
+        logger.error(f"Error computing {compute.__name__}: {e}")
+        return jsonify({
+            "error": "Analytics unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route("/api/portfolio/summary")
+def portfolio_summary():
+    """Portfolio totals: loans, disbursed, paid vs expected, arrears, due today"""
+    import analytics
+    return _analytics_response(analytics.portfolio_summary)
+
+@app.route("/api/managers")
+def managers_overview():
+    """Headline numbers for every manager"""
+    import analytics
+    return _analytics_response(lambda: {"managers": analytics.managers()})
+
+@app.route("/api/managers/<name>/performance")
+def manager_performance(name):
+    """A manager's totals with a per-product breakdown (full or unique first name)"""
+    import analytics
+    return _analytics_response(analytics.manager_performance, name)
+
+@app.route("/api/products")
+def products_overview():
+    """Totals per loan product"""
+    import analytics
+    return _analytics_response(lambda: {"products": analytics.products()})
+
+@app.route("/api/arrears")
+def arrears_overview():
+    """The ?top=N (default 10, max 500) loans with the largest arrears"""
+    import analytics
+    top = min(request.args.get('top', 10, type=int), 500)
+    return _analytics_response(analytics.top_arrears, top)
+
+@app.route("/api/ledger/daily")
+def ledger_daily():
+    """Collections per posting day between ?from= and ?to= (YYYY-MM-DD, inclusive)"""
+    import analytics
+    return _analytics_response(analytics.ledger_daily, request.args.get('from'), request.args.get('to'))
+
+@app.route("/api/clients/<query>")
+def client_profile(query):
+    """Client 360 profile(s) by Client_Code, mobile number or name"""
+    import client_profiles
+    return _analytics_response(client_profiles.lookup, query)
+
+@app.route("/api/installments/due")
+def installments_due():
+    """Installments due on ?date= (YYYY-MM-DD, today, tomorrow or a weekday; default today)"""
+    import installment_calendar
+    return _analytics_response(
+        installment_calendar.due_on, request.args.get('date', 'today'), request.args.get('outstanding') == '1'
+    )
+
+@app.route("/api/installments/expected")
+def installments_expected():
+    """Scheduled and outstanding installments from ?from= to ?to=, optionally ?by=manager|product|status"""
+    import installment_calendar
+    return _analytics_response(
+        installment_calendar.expected_collections,
+        request.args.get('from', 'today'), request.args.get('to'), request.args.get('by')
+    )
+
+@app.route("/api/par")
+def portfolio_at_risk():
+    """PAR1/PAR7/PAR30 and days-past-due buckets by manager and product as of ?as_of= (default: data date)"""
+    import par_engine
+    return _analytics_response(par_engine.par_report, request.args.get('as_of', 'today'))
+
+@app.route("/api/par/loans")
+def par_loans():
+    """Open loans with days past due as of ?as_of=, at least ?min_dpd= days (default 1)"""
+    import par_engine
+    return _analytics_response(par_engine.overdue_loans, request.args.get('as_of', 'today'), request.args.get('min_dpd', 1, type=int))
+
+@app.route("/api/data/profile")
+def data_profile_view():
+    """Dtypes, null counts, categorical values and ranges of every dataset (the prompt's data dictionary)"""
+    import data_profile
+    return _analytics_response(data_profile.get_profile)
+
+@app.route("/api/briefings")
+def briefings_index():
+    """Portfolio-wide briefing and the managers with stored briefings; ?refresh=1 regenerates them"""
+    try:
+        import briefings
+        document = briefings.ensure(force=request.args.get('refresh') == '1')
+        return jsonify({
+            "portfolio": document['portfolio'],
+            "managers": {
+                name: {
+                    "due_today": b['due_today']['count'],
+                    "in_arrears": b['arrears']['count'],
+                    "collection_rate": b['collections']['collection_rate'],
+                    "url": f"/api/briefings/{name}"
+                }
+                for name, b in document['managers'].items()
+            },
+            "version": document['version'],
+            "generated_at": document['generated_at'],
+            "timestamp": datetime.now().isoformat(),
+            "status": "success"
+        })
+    except Exception as e:
+        logger.error(f"Error reading briefings: {e}")
+        return jsonify({
+            "error": "Briefings unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route("/api/briefings/<manager>")
+def manager_briefing(manager):
+    """A manager's briefing: due-today list, top arrears and collections vs expected"""
+    try:
+        import briefings
+        briefing = briefings.get_briefing(manager)
+        if briefing is None:
+            return jsonify({
+                "error": "Unknown manager",
+                "message": f"No briefing for '{manager}'",
+                "timestamp": datetime.now().isoformat()
+            }), 404
+        return jsonify({
+            **briefing,
+            "timestamp": datetime.now().isoformat(),
+            "status": "success"
+        })
+    except Exception as e:
+        logger.error(f"Error reading briefing for {manager}: {e}")
+        return jsonify({
+            "error": "Briefing unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route("/api/scheduler")
+def scheduler_info():
+    """Queued and running LLM/tool slots per priority class, and client fair-share usage"""
+    try:
+        import scheduler
+        return jsonify({
+            **scheduler.snapshot(),
+            "timestamp": datetime.now().isoformat(),
+            "status": "success"
+        })
+    except Exception as e:
+        logger.error(f"Error reading scheduler state: {e}")
+        return jsonify({
+            "error": "Scheduler state unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route("/api/backends")
+def ollama_backends():
+    """Health, load and circuit-breaker state of the Ollama backends"""
+    try:
+        from ollama_client import backend_status
+        backends = backend_status(refresh=request.args.get('refresh') == '1')
+        return jsonify({
+            "backends": backends,
+            "healthy": sum(1 for b in backends if b['healthy'] and b['breaker'] != 'open'),
+            "timestamp": datetime.now().isoformat(),
+            "status": "success"
+        })
+    except Exception as e:
+        logger.error(f"Error checking Ollama backends: {e}")
+        return jsonify({
+            "error": "Backend status unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
+@app.route("/api/results/<handle_id>")
+def result_handle(handle_id):
+    """Fetch a full tool result that was summarized for the LLM (JSON rows or ?format=csv)"""
+    try:
+        import pandas as pd
+        import observations
+        value = observations.fetch_result(handle_id)
+        if value is None:
+            return jsonify({
+                "error": "Unknown result handle",
+                "message": f"Result '{handle_id}' does not exist or has expired",
+                "timestamp": datetime.now().isoformat()
+            }), 404
+
+        if request.args.get('format') == 'csv':
+            frame = value if isinstance(value, (pd.DataFrame, pd.Series)) else pd.DataFrame(observations.to_payload(value)['rows'])
+            return Response(
+                frame.to_csv(),
+                mimetype='text/csv',
+                headers={'Content-Disposition': f'attachment; filename={handle_id}.csv'}
+            )
+
+        offset = max(request.args.get('offset', 0, type=int), 0)
+        limit = request.args.get('limit', DATA_CONFIG['MAX_ROWS_DISPLAY'], type=int)
+        return jsonify({
+            "handle": handle_id,
+            **observations.to_payload(value, offset=offset, limit=limit),
+            "offset": offset,
+            "timestamp": datetime.now().isoformat(),
+            "status": "success"
+        })
+    except Exception as e:
+        logger.error(f"Error fetching result handle {handle_id}: {e}")
+        return jsonify({
+            "error": "Result unavailable",
+            "message": str(e),
+            "timestamp": datetime.now().isoformat()
+        }), 500
+
 @app.route("/api/validate-query", methods=['POST'])
 def validate_query():
     """Validate SQL query endpoint for testing"""
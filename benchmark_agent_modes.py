@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+"""
+Latency benchmark: ReAct agent vs plan-and-execute vs JSON protocol
+Runs the UI suggestion questions through the agent modes against the local
+Ollama instance and reports wall time, LLM calls and parse-failure rates.
+
+Usage: python benchmark_agent_modes.py [--runs N] [--modes react,plan_execute,json]
+"""
+
+import argparse
+import statistics
+import time
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+import metrics
+from config import UI_CONFIG
+from utils_simple import agent, clear_conversation_memory
+from plan_execute import plan_and_execute
+from json_agent import run_json_protocol
+
+
+class LLMCallCounter(BaseCallbackHandler):
+    """Counts LLM round trips made by the ReAct agent"""
+
+    def __init__(self):
+        self.calls = 0
+
+    def on_llm_start(self, serialized, prompts, **kwargs):
+        self.calls += 1
+
+
+def run_react(question):
+    counter = LLMCallCounter()
+    agent.invoke({"input": "Current question: " + question}, config={"callbacks": [counter]})
+    return counter.calls
+
+
+def run_plan_execute(question):
+    return plan_and_execute(question)['llm_calls']
+
+
+def run_json(question):
+    before = metrics.snapshot()['counters'].get('json.llm_calls', 0)
+    if run_json_protocol(question) is None:
+        # Fallback path: the ReAct agent answers instead
+        metrics.increment('json.fallbacks')
+        return metrics.snapshot()['counters'].get('json.llm_calls', 0) - before + run_react(question)
+    return metrics.snapshot()['counters'].get('json.llm_calls', 0) - before
+
+
+RUNNERS = {
+    'react': run_react,
+    'plan_execute': run_plan_execute,
+    'json': run_json,
+}
+
+
+def benchmark(questions, modes, runs):
+    results = {mode: [] for mode in modes}
+    for mode in modes:
+        for question in questions:
+            for _ in range(runs):
+                clear_conversation_memory()
+                started = time.time()
+                try:
+                    calls = RUNNERS[mode](question)
+                    error = None
+                except Exception as e:
+                    calls, error = 0, str(e)
+                elapsed = time.time() - started
+                results[mode].append({'question': question, 'seconds': elapsed, 'llm_calls': calls, 'error': error})
+                status = f"error: {error[:60]}" if error else f"{calls} LLM calls"
+                print(f"[{mode}] {elapsed:7.2f}s  {status}  {question}")
+    return results
+
+
+def summarize(results):
+    print("\n" + "=" * 60)
+    print(f"{'mode':<14}{'mean s':>10}{'median s':>10}{'max s':>10}{'calls/q':>10}{'errors':>8}")
+    for mode, rows in results.items():
+        seconds = [r['seconds'] for r in rows]
+        calls = [r['llm_calls'] for r in rows]
+        errors = sum(1 for r in rows if r['error'])
+        print(
+            f"{mode:<14}{statistics.mean(seconds):>10.2f}{statistics.median(seconds):>10.2f}"
+            f"{max(seconds):>10.2f}{statistics.mean(calls):>10.2f}{errors:>8}"
+        )
+    print("\nParse failures:")
+    print(f"  ReAct: {metrics.ratio('react.parse_failures', 'react.runs')} per run")
+    print(f"  JSON protocol: {metrics.ratio('json.parse_failures', 'json.llm_calls')} per call, "
+          f"{metrics.ratio('json.fallbacks', 'json.runs')} fallbacks per run")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=1, help='runs per question and mode')
+    parser.add_argument('--modes', default='react,plan_execute,json', help='comma-separated agent modes')
+    args = parser.parse_args()
+
+    modes = [m.strip() for m in args.modes.split(',') if m.strip() in RUNNERS]
+    questions = [s['query'] for s in UI_CONFIG['SUGGESTIONS']]
+    summarize(benchmark(questions, modes, args.runs))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+#!/usr/bin/env python3
+"""
+Benchmark: group-by kernels on encoded codes vs pandas object-string group-by
+Builds a processed_data-like frame of N rows (real manager/product/status labels,
+a Loan_No per row group) and times sum/count/mean/max per key column with pandas
+and with groupby_kernels, checking that the results agree. The one-off encoding
+cost is reported separately, since the app pays it once per data version.
+
+Usage: python benchmark_groupby.py [--rows N] [--repeat R]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from groupby_kernels import Encoding, group_count, group_extreme, group_mean, group_sum
+
+MANAGERS = ['Abednego Chamia', 'John Kiio', 'Joseph Mutunga', 'Magdalene Mumbua', 'Ones Mutie']
+PRODUCTS = ['BIASHARA4W', 'BIASHARA6W', 'INUKA 4WKS', 'INUKA6WKS', 'INUKA8WKS']
+
+
+def synthetic_frame(rows, seed=0):
+    rng = np.random.default_rng(seed)
+    return pd.DataFrame({
+        'Managed_By': rng.choice(MANAGERS, rows),
+        'Loan_Product_Type': rng.choice(PRODUCTS, rows),
+        'Status': rng.choice(['Active', 'Inactive'], rows, p=[0.8, 0.2]),
+        'Loan_No': np.char.add('A', (rng.integers(0, max(rows // 6, 1), rows)).astype(str)),
+        'Arrears': np.where(rng.random(rows) < 0.3, rng.random(rows) * 10000, 0.0),
+    })
+
+
+def best_of(func, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        best = min(best, time.perf_counter() - started)
+    return best, result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=1000000)
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement (best is reported)')
+    args = parser.parse_args()
+
+    df = synthetic_frame(args.rows)
+    values = df['Arrears'].to_numpy()
+    print(f"{args.rows:,} rows\n")
+    print(f"{'key':<20}{'agg':<7}{'pandas ms':>11}{'kernel ms':>11}{'speedup':>9}  match")
+    for key in ('Managed_By', 'Loan_Product_Type', 'Status', 'Loan_No'):
+        encode_seconds, encoding = best_of(lambda: Encoding(df[key]), 1)
+        codes, groups = encoding.codes, encoding.groups
+        kernels = {
+            'sum': lambda: group_sum(codes, values, groups),
+            'count': lambda: group_count(codes, groups),
+            'mean': lambda: group_mean(codes, values, groups),
+            'max': lambda: group_extreme(codes, values, groups, np.maximum, encoding.order),
+        }
+        for agg, kernel in kernels.items():
+            pandas_seconds, expected = best_of(lambda: getattr(df.groupby(key)['Arrears'], agg)(), args.repeat)
+            kernel_seconds, result = best_of(kernel, args.repeat)
+            match = np.allclose(expected.to_numpy(), result) and list(expected.index) == list(encoding.labels)
+            print(f"{key:<20}{agg:<7}{pandas_seconds * 1000:>11.1f}{kernel_seconds * 1000:>11.1f}"
+                  f"{pandas_seconds / kernel_seconds:>8.1f}x  {'yes' if match else 'NO'}")
+        print(f"{key:<20}{'encode':<7}{'':>11}{encode_seconds * 1000:>11.1f}  (once per data version)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,121 @@
+#!/usr/bin/env python3
+"""
+Benchmark for the PAR aging engine on a synthetic portfolio
+Generates loans with weekly schedules and a ledger of (sometimes late or
+missed) payments scaled to millions of rows, then times building the engine
+and aging the portfolio at several as-of dates. A per-loan pandas replay on a
+sample of loans checks the DPD values.
+
+Usage: python benchmark_par.py [--loans N] [--seed S] [--check N]
+"""
+
+import argparse
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import PERFORMANCE_CONFIG
+from par_engine import AgingEngine
+
+PRODUCTS = {'BIASHARA4W': 4, 'BIASHARA6W': 6, 'INUKA 4WKS': 4, 'INUKA6WKS': 6, 'INUKA8WKS': 8}
+MANAGERS = ['Abednego Chamia', 'John Kiio', 'Joseph Mutunga', 'Magdalene Mumbua', 'Ones Mutie']
+
+
+def synthetic_portfolio(loans, seed=0):
+    """(processed, ledger) frames with the columns the engine reads"""
+    rng = np.random.default_rng(seed)
+    products = rng.choice(list(PRODUCTS), loans)
+    installments = np.array([PRODUCTS[p] for p in products])
+    disbursed = rng.choice([5000, 7500, 10000], loans).astype(float)
+    charged = disbursed * 1.3
+    issued = np.datetime64('2022-01-01') + rng.integers(0, 3 * 365, loans).astype('timedelta64[D]')
+    processed = pd.DataFrame({
+        'Loan_No': [f"A{i:07d}" for i in range(loans)],
+        'Client_Code': [f"C{i % (loans // 3 + 1):07d}" for i in range(loans)],
+        'Client_Name': 'CLIENT',
+        'Managed_By': rng.choice(MANAGERS, loans),
+        'Loan_Product_Type': products,
+        'Status': 'Active',
+        'Issued_Date': issued.astype(str),
+        'Installments': installments,
+        'Amount_Disbursed': disbursed,
+        'Total_Charged': charged,
+    })
+
+    # Several part-payments per installment, some late, some never made
+    per_installment = charged / installments
+    rows = np.repeat(np.arange(loans), installments)
+    number = np.arange(len(rows)) - np.repeat(np.cumsum(installments) - installments, installments) + 1
+    paid = rng.random(len(rows)) > 0.03
+    rows, number = rows[paid], number[paid]
+    splits = rng.integers(1, 5, len(rows))
+    rows, number = np.repeat(rows, splits), np.repeat(number, splits)
+    amount = per_installment[rows] / np.repeat(splits, splits)
+    delay = np.where(rng.random(len(rows)) < 0.2, rng.integers(1, 60, len(rows)), 0)
+    posted = issued[rows] + (7 * number + delay).astype('timedelta64[D]')
+    ledger = pd.DataFrame({
+        'Posting_Date': posted.astype(str),
+        'Loan_No': processed['Loan_No'].to_numpy()[rows],
+        'Loan_Product_Type': products[rows],
+        'Interest_Paid': (amount * 0.3 / 1.3).round(2),
+        'Principle_Paid': (amount / 1.3).round(2),
+        'Total_Paid': amount.round(2),
+    })
+    return processed, ledger
+
+
+def replay_dpd(loan, payments, as_of):
+    """Reference: walk one loan's installments against its cumulative payments"""
+    day = pd.Timestamp(as_of)
+    paid = payments[pd.to_datetime(payments['Posting_Date']) <= day]['Total_Paid'].sum()
+    if pd.Timestamp(loan['Issued_Date']) > day or paid + 1 >= loan['Total_Charged']:
+        return 0
+    amount = loan['Total_Charged'] / loan['Installments']
+    for number in range(1, int(loan['Installments']) + 1):
+        if paid + 1 < number * amount:
+            due = pd.Timestamp(loan['Issued_Date']) + pd.Timedelta(days=7 * number)
+            return max((day - due).days, 0)
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--loans', type=int, default=300000, help='synthetic loans (about 10 ledger rows each)')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--check', type=int, default=200, help='loans verified against the per-loan replay')
+    args = parser.parse_args()
+
+    started = time.time()
+    processed, ledger = synthetic_portfolio(args.loans, args.seed)
+    print(f"Generated {len(processed):,} loans and {len(ledger):,} ledger rows in {time.time() - started:.1f}s")
+
+    started = time.time()
+    engine = AgingEngine(processed, ledger)
+    print(f"Built engine in {time.time() - started:.2f}s")
+
+    for as_of in ('2023-01-31', '2024-06-30', '2025-01-31'):
+        started = time.time()
+        report = engine.report(as_of, PERFORMANCE_CONFIG['PAR_THRESHOLDS'], PERFORMANCE_CONFIG['PAR_DPD_BUCKETS'])
+        elapsed = time.time() - started
+        par = ', '.join(f"{name} {value['ratio']}%" for name, value in report['par'].items())
+        print(f"as of {as_of}: {elapsed * 1000:7.1f} ms  {report['open_loans']:,} open loans  {par}")
+
+    if args.check:
+        as_of = '2024-06-30'
+        dpd = engine.age(as_of)['dpd']
+        sample = np.random.default_rng(args.seed).choice(len(processed), min(args.check, len(processed)), replace=False)
+        by_loan = ledger[ledger['Loan_No'].isin(processed['Loan_No'].iloc[sample])].groupby('Loan_No')
+        started = time.time()
+        mismatches = 0
+        for index in sample:
+            loan = processed.iloc[index]
+            payments = by_loan.get_group(loan['Loan_No']) if loan['Loan_No'] in by_loan.groups else ledger.iloc[:0]
+            mismatches += replay_dpd(loan, payments, as_of) != dpd[index]
+        per_loan = (time.time() - started) / len(sample)
+        print(f"Per-loan replay: {per_loan * 1000:.2f} ms/loan (~{per_loan * len(processed):.0f}s for the portfolio), "
+              f"{mismatches} DPD mismatches in {len(sample)} loans")
+
+
+if __name__ == "__main__":
+    main()
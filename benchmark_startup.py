@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+Benchmark: application startup and time to first chat
+Starts a fresh interpreter per run and times, from process start, importing
+app.py, the first /health answer and the first and second /chat answers
+(through Flask's test client, with the answer, program and tool caches off).
+Scenarios:
+  lazy       app.py as it is: the agent stack is imported by the first chat
+  eager      utils_simple imported right after app.py (the old import-time cost)
+  preloaded  startup.preload() first, as in a worker forked from the gunicorn
+             master; the preload itself is reported separately
+--warm-up also loads the model on the Ollama backends before the first chat.
+The chats need an Ollama backend (or ollama_stub_server.py via OLLAMA_BACKENDS).
+
+Usage: python benchmark_startup.py [--runs N] [--question TEXT] [--mode MODE] [--warm-up]
+"""
+
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+import time
+
+SCENARIOS = ('lazy', 'eager', 'preloaded')
+MILESTONES = ('import app', 'health', 'preload', 'warm-up', 'first chat', 'second chat')
+
+
+def child(settings):
+    """One cold start; prints {milestone: seconds since the process was spawned} as JSON"""
+    spawned = settings['spawned']
+    marks = {}
+
+    def mark(name):
+        marks[name] = round(time.time() - spawned, 3)
+
+    from config import PERFORMANCE_CONFIG
+    PERFORMANCE_CONFIG.update({
+        'CACHE_ENABLED': False, 'PROGRAM_CACHE_ENABLED': False,
+        'TOOL_CACHE_ENABLED': False, 'QUERY_LOG_ENABLED': False,
+    })
+    import app
+    mark('import app')
+    if settings['scenario'] == 'eager':
+        import utils_simple  # noqa: F401
+        # Counted as part of importing app.py, as it was before the lazy imports
+        mark('import app')
+    client = app.app.test_client()
+    health = client.get('/health')
+    mark('health')
+    if settings['scenario'] == 'preloaded':
+        import startup
+        startup.preload()
+        mark('preload')
+    if settings['warm_up']:
+        from ollama_client import warm_up
+        warm_up()
+        mark('warm-up')
+    statuses = [health.status_code]
+    for name in ('first chat', 'second chat'):
+        payload = {'promt': settings['question']}
+        if settings['mode']:
+            payload['mode'] = settings['mode']
+        statuses.append(client.post('/chat', json=payload).status_code)
+        mark(name)
+    print(json.dumps({'marks': marks, 'statuses': statuses}))
+
+
+def run_once(scenario, args):
+    settings = {
+        'scenario': scenario, 'spawned': time.time(), 'question': args.question,
+        'mode': args.mode, 'warm_up': args.warm_up,
+    }
+    output = subprocess.run(
+        [sys.executable, __file__, '--child', json.dumps(settings)],
+        capture_output=True, text=True, check=True
+    ).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--runs', type=int, default=3, help='cold starts per scenario (medians are reported)')
+    parser.add_argument('--question', default='What is the total arrears for each manager?')
+    parser.add_argument('--mode', default=None, help="agent mode for /chat (default: the router decides)")
+    parser.add_argument('--warm-up', action='store_true', help='load the model on the Ollama backends before chatting')
+    parser.add_argument('--scenarios', nargs='+', default=list(SCENARIOS), choices=SCENARIOS)
+    parser.add_argument('--child', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+    if args.child:
+        child(json.loads(args.child))
+        return
+
+    print(f"seconds since process start (median of {args.runs} runs); the last column is the first chat alone\n")
+    print(f"{'scenario':<11}" + ''.join(f"{m:>13}" for m in MILESTONES) + f"{'chat alone':>12}  HTTP status")
+    for scenario in args.scenarios:
+        runs = [run_once(scenario, args) for _ in range(args.runs)]
+        cells = []
+        for milestone in MILESTONES:
+            values = [r['marks'][milestone] for r in runs if milestone in r['marks']]
+            cells.append(f"{statistics.median(values):>13.2f}" if values else f"{'-':>13}")
+        # What a worker forked from a preloaded, warmed-up master pays on its first chat
+        alone = statistics.median(
+            r['marks']['first chat'] - max(v for m, v in r['marks'].items() if m not in ('first chat', 'second chat'))
+            for r in runs
+        )
+        print(f"{scenario:<11}" + ''.join(cells) + f"{alone:>12.2f}  {runs[-1]['statuses']}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,321 @@
+"""
+Daily manager briefings
+Precomputes, once per data version, a briefing for every loan officer and for
+the whole portfolio: loans due today, the largest arrears, and collections
+against what was expected so far (Total_Paid vs Expected_Before_Today on
+active loans). Briefings are generated at background priority when the data
+refreshes and stored under CACHE_DIR/briefings, so the API and the chat fast
+path serve them without running the agent.
+"""
+
+import json
+import logging
+import os
+import re
+import time
+from datetime import datetime
+
+try:
+    import fcntl
+except ImportError:  # Windows: concurrent workers may each generate once
+    fcntl = None
+
+import metrics
+import scheduler
+from config import PERFORMANCE_CONFIG
+from datasets import get_data_version, load_dataset, on_refresh
+from html_responses import MAX_TEMPLATE_ROWS, TEXT_STYLE, card_html, rows_table
+
+logger = logging.getLogger(__name__)
+
+# Question phrases -> briefing section
+SECTION_PATTERNS = {
+    'due_today': re.compile(r'\b(due today|due for payment today|paying today|pay today|collect(ing)? today)\b'),
+    'arrears': re.compile(r'\b(in arrears|arrears list|top arrears|largest arrears|biggest arrears|defaulters|overdue)\b'),
+    'collections': re.compile(r'\b(collections? (vs|versus|against) expected|collection rate|collections? so far|expected collections?)\b'),
+}
+BRIEFING_PATTERN = re.compile(r'\b(briefing|brief me|daily summary|morning summary)\b')
+# Words that can surround a section phrase without narrowing what is asked
+FILLER_WORDS = set("""
+a an the of for to in on at by is are was were be do does what which who whom whose show list give tell
+get see me my our us i we you please can could would now currently there all any loans loan clients client
+customers customer borrowers manager managers officer officers portfolio today today's daily morning s
+""".split())
+
+_current = {'version': None, 'document': None}
+
+
+def _briefing_dir():
+    return os.path.join(PERFORMANCE_CONFIG['CACHE_DIR'], 'briefings')
+
+
+def _path(version):
+    return os.path.join(_briefing_dir(), f"{version}.json")
+
+
+def _money(value):
+    return round(float(value), 2)
+
+
+def _loans(frame, column, limit):
+    """Loan rows for a list, largest `column` first"""
+    rows = frame.sort_values(column, ascending=False).head(limit)
+    return [
+        {
+            'loan_no': row['Loan_No'],
+            'client_name': row['Client_Name'],
+            'phone': str(row['Mobile_Phone_No']),
+            'product': row['Loan_Product_Type'],
+            'due_today': _money(row['Due_Today']),
+            'arrears': _money(row['Arrears']),
+        }
+        for _, row in rows.iterrows()
+    ]
+
+
+def _summarize(frame, manager=None):
+    """Briefing for one manager's loans (or the whole portfolio when manager is None)"""
+    active = frame[frame['Status'] == 'Active']
+    due = frame[frame['Due_Today'] > 0]
+    arrears = frame[frame['Arrears'] > 0]
+    paid = active['Total_Paid'].sum()
+    expected = active['Expected_Before_Today'].sum()
+    return {
+        'manager': manager,
+        'active_loans': int(len(active)),
+        'due_today': {
+            'count': int(len(due)),
+            'amount': _money(due['Due_Today'].sum()),
+            'loans': _loans(due, 'Due_Today', PERFORMANCE_CONFIG['BRIEFING_DUE_TODAY_LIMIT']),
+        },
+        'arrears': {
+            'count': int(len(arrears)),
+            'amount': _money(arrears['Arrears'].sum()),
+            'top': _loans(arrears, 'Arrears', PERFORMANCE_CONFIG['BRIEFING_TOP_ARREARS']),
+        },
+        'collections': {
+            'total_paid': _money(paid),
+            'expected_before_today': _money(expected),
+            'collection_rate': round(paid / expected * 100, 1) if expected else None,
+            'shortfall': _money(max(expected - paid, 0)),
+        },
+    }
+
+
+def build_briefings(df):
+    """Briefings for every manager in the processed loan data, plus a portfolio-wide one"""
+    return {
+        'portfolio': _summarize(df),
+        'managers': {
+            manager: _summarize(group, manager)
+            for manager, group in df.groupby('Managed_By', sort=True)
+        },
+    }
+
+
+def _write(version, document):
+    os.makedirs(_briefing_dir(), exist_ok=True)
+    path = _path(version)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump(document, f)
+    os.replace(tmp, path)
+    # Briefings of older data versions are never served again
+    for name in os.listdir(_briefing_dir()):
+        if name.endswith('.json') and name != os.path.basename(path):
+            try:
+                os.remove(os.path.join(_briefing_dir(), name))
+            except OSError:
+                pass
+
+
+def _read(version):
+    try:
+        with open(_path(version), encoding='utf-8') as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return None
+
+
+def generate(version=None):
+    """Compute and store the briefings for the current data; returns the stored document"""
+    version = version or get_data_version()
+    started = time.time()
+    # Same tool slots as python_calculator, behind any interactive work
+    token = scheduler.set_context('background', 'briefings')
+    try:
+        with scheduler.slot('tool'):
+            document = build_briefings(load_dataset('processed_data'))
+    finally:
+        scheduler.reset_context(token)
+    document.update({'version': version, 'generated_at': datetime.now().isoformat()})
+    _write(version, document)
+    elapsed = time.time() - started
+    metrics.increment('briefings.generated')
+    metrics.observe('briefings.generate_seconds', elapsed)
+    logger.info(f"Generated briefings for {len(document['managers'])} managers (version {version}) in {elapsed:.2f}s")
+    return document
+
+
+def ensure(version=None, force=False):
+    """
+    The briefings for the current data version, generating them if no process has yet.
+    Generation is serialized across workers with an flock, so it happens once per version.
+    """
+    version = version or get_data_version()
+    if not force and _current['version'] == version:
+        return _current['document']
+
+    document = None if force else _read(version)
+    if document is None:
+        os.makedirs(_briefing_dir(), exist_ok=True)
+        with open(os.path.join(_briefing_dir(), 'generate.lock'), 'a') as lock_file:
+            if fcntl is not None:
+                fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                # Another worker may have finished while this one waited for the lock
+                document = None if force else _read(version)
+                if document is None:
+                    document = generate(version)
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock_file, fcntl.LOCK_UN)
+    _current.update({'version': version, 'document': document})
+    return document
+
+
+@on_refresh
+def _refresh(version):
+    if PERFORMANCE_CONFIG['BRIEFINGS_ENABLED']:
+        ensure(version)
+
+
+def resolve_manager(name, document=None):
+    """Canonical manager name for a full or unique first name (case-insensitive), else None"""
+    managers = (document or ensure())['managers']
+    wanted = name.strip().lower()
+    for manager in managers:
+        if manager.lower() == wanted:
+            return manager
+    matches = [m for m in managers if m.split()[0].lower() == wanted]
+    return matches[0] if len(matches) == 1 else None
+
+
+def get_briefing(manager=None):
+    """A manager's briefing (the portfolio's when manager is None), or None for an unknown manager"""
+    document = ensure()
+    if manager is None:
+        briefing = document['portfolio']
+    else:
+        resolved = resolve_manager(manager, document)
+        if resolved is None:
+            return None
+        briefing = document['managers'][resolved]
+    return {**briefing, 'version': document['version'], 'generated_at': document['generated_at']}
+
+
+def _mentioned_manager(text, document):
+    """Manager named in a lowercase question (full name first, then a unique first name)"""
+    for manager in sorted(document['managers'], key=len, reverse=True):
+        if re.search(rf'\b{re.escape(manager.lower())}\b', text):
+            return manager
+    for word in re.findall(r'[a-z]+', text):
+        resolved = resolve_manager(word, document)
+        if resolved is not None:
+            return resolved
+    return None
+
+
+def _loan_table(loans, amount_key, amount_label):
+    rows = [
+        {'Loan': l['loan_no'], 'Client': l['client_name'], 'Phone': l['phone'], amount_label: l[amount_key]}
+        for l in loans
+    ]
+    more = len(loans) - MAX_TEMPLATE_ROWS
+    note = f'<p style="{TEXT_STYLE}">…and {more} more.</p>' if more > 0 else ''
+    return rows_table(rows) + note
+
+
+def briefing_html(briefing, sections=('due_today', 'arrears', 'collections')):
+    """Brand-styled card for the requested sections of a briefing"""
+    parts = []
+    if 'due_today' in sections:
+        due = briefing['due_today']
+        parts.append(
+            f'<p style="{TEXT_STYLE}"><strong>Due today:</strong> {due["count"]:,} loans, '
+            f'KES {due["amount"]:,.2f}</p>'
+        )
+        if due['loans']:
+            parts.append(_loan_table(due['loans'], 'due_today', 'Due Today'))
+    if 'arrears' in sections:
+        arrears = briefing['arrears']
+        parts.append(
+            f'<p style="{TEXT_STYLE}"><strong>In arrears:</strong> {arrears["count"]:,} loans, '
+            f'KES {arrears["amount"]:,.2f}</p>'
+        )
+        if arrears['top']:
+            parts.append(_loan_table(arrears['top'], 'arrears', 'Arrears'))
+    if 'collections' in sections:
+        c = briefing['collections']
+        rate = f'{c["collection_rate"]:.1f}%' if c['collection_rate'] is not None else 'n/a'
+        parts.append(
+            f'<p style="{TEXT_STYLE}"><strong>Collections vs expected:</strong> KES {c["total_paid"]:,.2f} paid '
+            f'of KES {c["expected_before_today"]:,.2f} expected so far ({rate}) across '
+            f'{briefing["active_loans"]:,} active loans; shortfall KES {c["shortfall"]:,.2f}</p>'
+        )
+    return card_html(f"Daily briefing for {briefing['manager'] or 'the portfolio'}", ''.join(parts))
+
+
+def requested_sections(question):
+    """
+    Briefing sections a question asks for, and the question with those phrases removed
+    (so the router can check whether anything else is being asked).
+    """
+    text = question.lower()
+    sections = tuple(name for name, pattern in SECTION_PATTERNS.items() if pattern.search(text))
+    if BRIEFING_PATTERN.search(text):
+        sections = tuple(SECTION_PATTERNS)
+    remainder = BRIEFING_PATTERN.sub(' ', text)
+    for pattern in SECTION_PATTERNS.values():
+        remainder = pattern.sub(' ', remainder)
+    return sections, remainder
+
+
+def parse_request(question):
+    """
+    (sections, manager) when a question asks for briefing sections and nothing else,
+    optionally for one manager (None: the portfolio); None when it also filters or asks
+    for something the briefings don't hold ('overdue loans for INUKA6WKS').
+    """
+    sections, remainder = requested_sections(question)
+    if not sections:
+        return None
+    words = [w for w in re.findall(r"[a-z0-9']+", remainder) if w not in FILLER_WORDS]
+    if not words:
+        return sections, None
+    # Anything left has to be a manager's name
+    document = ensure()
+    manager = _mentioned_manager(question.lower(), document)
+    if manager is None:
+        return None
+    names = set(manager.lower().split())
+    if any(w not in names for w in words):
+        return None
+    return sections, manager
+
+
+def answer_question(question):
+    """
+    Answer a due-today / arrears-list / collections-vs-expected / briefing question
+    from the stored briefings. Returns HTML, or None if the question isn't one of these.
+    """
+    if not PERFORMANCE_CONFIG['BRIEFINGS_ENABLED']:
+        return None
+    request = parse_request(question)
+    if request is None:
+        return None
+
+    sections, manager = request
+    briefing = get_briefing(manager)
+    metrics.increment('briefings.chat_answers')
+    return briefing_html(briefing, sections)
@@ -0,0 +1,222 @@
+"""
+Client 360 profiles
+One precomputed profile per client, built from processed_data.csv,
+clients.csv and ledger.csv: demographics, every loan with its status, a
+payment history summary and current arrears. Profiles are indexed by
+Client_Code, normalized name and mobile number, so lookups are dict hits
+instead of joins. The store is rebuilt when the data refreshes (or on first
+use after the data version changes). In out-of-core ledger mode the payment
+summaries come from streamed per-loan aggregates of the ledger store.
+"""
+
+import json
+import logging
+import re
+import threading
+
+import ledger_store
+from datasets import get_data_version, load_dataset, on_refresh
+
+logger = logging.getLogger(__name__)
+
+CODE_PATTERN = re.compile(r'^C\d+$', re.IGNORECASE)
+RECENT_PAYMENTS = 5
+
+_store = {'version': None, 'profiles': {}, 'by_name': {}, 'by_phone': {}}
+_lock = threading.Lock()
+
+
+def normalize_name(name):
+    """Uppercase with single spaces, punctuation removed"""
+    return re.sub(r'\s+', ' ', re.sub(r'[^\w\s]', ' ', str(name))).strip().upper()
+
+
+def normalize_phone(phone):
+    """Last 9 digits, so 0712..., 254712... and 712... match"""
+    digits = re.sub(r'\D', '', str(phone))
+    return digits[-9:] if len(digits) >= 9 else None
+
+
+def _money(value):
+    return round(float(value), 2)
+
+
+def _loan(row):
+    return {
+        'loan_no': row['Loan_No'],
+        'product': row['Loan_Product_Type'],
+        'manager': row['Managed_By'],
+        'issued_date': row['Issued_Date'],
+        'amount_disbursed': _money(row['Amount_Disbursed']),
+        'total_charged': _money(row['Total_Charged']),
+        'total_paid': _money(row['Total_Paid']),
+        'arrears': _money(row['Arrears']),
+        'due_today': _money(row['Due_Today']),
+        'status': row['Status'],
+    }
+
+
+def _payment_summary(rows):
+    """rows: the client's ledger records, oldest first"""
+    if not rows:
+        return {
+            'count': 0, 'total_paid': 0.0, 'interest_paid': 0.0, 'principal_paid': 0.0,
+            'first_payment': None, 'last_payment': None, 'recent': []
+        }
+    return {
+        'count': len(rows),
+        'total_paid': _money(sum(r['Total_Paid'] for r in rows)),
+        'interest_paid': _money(sum(r['Interest_Paid'] for r in rows)),
+        'principal_paid': _money(sum(r['Principle_Paid'] for r in rows)),
+        'first_payment': rows[0]['Posting_Date'],
+        'last_payment': rows[-1]['Posting_Date'],
+        'recent': [
+            {'date': r['Posting_Date'], 'loan_no': r['Loan_No'], 'amount': _money(r['Total_Paid'])}
+            for r in reversed(rows[-RECENT_PAYMENTS:])
+        ],
+    }
+
+
+def _store_payment_summaries(loan_client):
+    """_payment_summary() for every client from the ledger store, without loading the ledger"""
+    store = ledger_store.get_store()
+    per_loan = store.summarize('Loan_No', ['Total_Paid', 'Interest_Paid', 'Principle_Paid'], dates=True)
+    per_loan = per_loan[per_loan.index.isin(list(loan_client))]
+    per_client = per_loan.groupby(per_loan.index.map(loan_client)).agg(
+        count=('rows', 'sum'),
+        total_paid=('Total_Paid', 'sum'),
+        interest_paid=('Interest_Paid', 'sum'),
+        principal_paid=('Principle_Paid', 'sum'),
+        first_payment=('first_date', 'min'),
+        last_payment=('last_date', 'max'),
+    )
+    recent = store.recent(loan_client, RECENT_PAYMENTS, expected=per_client['count'].to_dict())
+    return {
+        code: {
+            'count': int(row['count']),
+            'total_paid': _money(row['total_paid']),
+            'interest_paid': _money(row['interest_paid']),
+            'principal_paid': _money(row['principal_paid']),
+            'first_payment': row['first_payment'],
+            'last_payment': row['last_payment'],
+            'recent': [{'date': day, 'loan_no': loan_no, 'amount': _money(amount)} for day, loan_no, amount in recent.get(code, [])],
+        }
+        for code, row in per_client.iterrows()
+    }
+
+
+def build_profiles(processed, clients, ledger=None):
+    """
+    Profiles keyed by Client_Code (one pass over each dataset's records).
+    Without a ledger frame the payment summaries come from the ledger store.
+    """
+    demographics = {r['Client_Code']: r for r in clients.to_dict('records')}
+    loans_by_client = {}
+    for row in processed.sort_values('Issued_Date', kind='stable').to_dict('records'):
+        loans_by_client.setdefault(row['Client_Code'], []).append(row)
+    loan_client = dict(zip(processed['Loan_No'], processed['Client_Code']))
+    if ledger is None:
+        payments = _store_payment_summaries(loan_client)
+    else:
+        payments_by_client = {}
+        for row in ledger.sort_values('Posting_Date', kind='stable').to_dict('records'):
+            code = loan_client.get(row['Loan_No'])
+            if code is not None:
+                payments_by_client.setdefault(code, []).append(row)
+        payments = {code: _payment_summary(rows) for code, rows in payments_by_client.items()}
+
+    profiles = {}
+    for code, loans in loans_by_client.items():
+        latest = loans[-1]
+        person = demographics.get(code)
+        profiles[code] = {
+            'client_code': code,
+            'client_name': latest['Client_Name'],
+            'gender': None if person is None else person['Gender'],
+            'age': None if person is None else int(person['Age']),
+            'phone': str(latest['Mobile_Phone_No']),
+            'client_type': latest['Client_Type'],
+            'client_loan_count': int(latest['Client_Loan_Count']),
+            'managers': sorted({l['Managed_By'] for l in loans if isinstance(l['Managed_By'], str)}),
+            'loans': [_loan(l) for l in loans],
+            'payments': payments.get(code) or _payment_summary([]),
+            'arrears': _money(sum(l['Arrears'] for l in loans)),
+            'due_today': _money(sum(l['Due_Today'] for l in loans)),
+            'active_loans': sum(1 for l in loans if l['Status'] == 'Active'),
+        }
+    return profiles
+
+
+def _ensure():
+    version = get_data_version()
+    if _store['version'] == version:
+        return _store
+    with _lock:
+        if _store['version'] == version:
+            return _store
+        profiles = build_profiles(
+            load_dataset('processed_data'), load_dataset('clients'),
+            None if ledger_store.enabled() else load_dataset('ledger')
+        )
+        by_name, by_phone = {}, {}
+        for code, profile in profiles.items():
+            by_name.setdefault(normalize_name(profile['client_name']), []).append(code)
+            phone = normalize_phone(profile['phone'])
+            if phone:
+                by_phone.setdefault(phone, []).append(code)
+        _store.update({'version': version, 'profiles': profiles, 'by_name': by_name, 'by_phone': by_phone})
+        logger.info(f"Built {len(profiles)} client profiles (version {version})")
+        return _store
+
+
+@on_refresh
+def _refresh(version):
+    _ensure()
+
+
+def get_profile(client_code):
+    """Profile for a Client_Code, or None"""
+    return _ensure()['profiles'].get(str(client_code).strip().upper())
+
+
+def find(query, limit=5):
+    """
+    Profiles matching a Client_Code, mobile number or name. Names match exactly
+    (after normalization) first; otherwise every word of the query must appear in the name.
+    """
+    store = _ensure()
+    text = str(query).strip()
+    if CODE_PATTERN.match(text):
+        profile = store['profiles'].get(text.upper())
+        return [profile] if profile else []
+    phone = normalize_phone(text) if re.fullmatch(r'[\d\s+\-]+', text) else None
+    if phone:
+        return [store['profiles'][code] for code in store['by_phone'].get(phone, [])][:limit]
+
+    name = normalize_name(text)
+    codes = store['by_name'].get(name)
+    if not codes:
+        words = name.split()
+        codes = [
+            code for indexed, indexed_codes in store['by_name'].items()
+            if words and all(w in indexed.split() for w in words)
+            for code in indexed_codes
+        ]
+    return [store['profiles'][code] for code in codes[:limit]]
+
+
+def client_profile_tool(query):
+    """Agent tool: JSON profile(s) for a client code, name or phone number"""
+    query = str(query).strip().strip('"\'')
+    matches = find(query)
+    if not matches:
+        return f"No client found for '{query}'"
+    return json.dumps(matches[0] if len(matches) == 1 else matches, ensure_ascii=False)
+
+
+def lookup(query):
+    """API view of find(): {'count', 'clients'}; KeyError when nothing matches"""
+    matches = find(query, limit=20)
+    if not matches:
+        raise KeyError(f"No client found for '{query}'")
+    return {'count': len(matches), 'clients': matches}
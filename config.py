@@ -20,7 +20,56 @@ AI_CONFIG = {
     'TIMEOUT_SECONDS': 3600,   # 1 hour timeout for testing
     'MAX_ITERATIONS': 10,     # Increased for testing
     'TEMPERATURE': 0.1,       # Lower temperature for more consistent responses
-    'REQUEST_TIMEOUT': 3600    # 1 hour total request timeout for testing
+    'REQUEST_TIMEOUT': 3600,   # 1 hour total request timeout for testing
+    'AGENT_MODE': 'react',     # Default agent: 'react', 'plan_execute' or 'json'
+    'AGENT_MODES': ['react', 'plan_execute', 'json'],
+    # Comma-separated list in OLLAMA_BACKENDS, e.g. "http://gpu1:11434,http://gpu2:11434"
+    'OLLAMA_BACKENDS': [u.strip() for u in os.environ.get('OLLAMA_BACKENDS', 'http://localhost:11434').split(',') if u.strip()],
+    'OLLAMA_CONNECT_TIMEOUT': 3,        # Seconds to connect before failing over to the next backend
+    'OLLAMA_HEALTH_TTL': 15,            # Seconds a backend health probe is cached
+    'OLLAMA_HEALTH_TIMEOUT': 2,
+    'OLLAMA_BREAKER_THRESHOLD': 3,      # Consecutive timeouts/connection errors that open a backend's breaker
+    'OLLAMA_BREAKER_COOLDOWN': 30,      # Seconds a tripped backend is skipped
+    'OLLAMA_STICKY_SESSIONS': 1000,     # Conversations remembered for sticky routing
+    'JSON_SCHEMA_FORMAT': True,  # json mode: pass the action schema as Ollama's format (Ollama >= 0.5), else plain "json"
+    'PLAN_EXECUTE_ANSWER': 'llm',  # Plan-execute answer step: 'llm' (one call) or 'template' (no call)
+    'LOOP_GUARD_MAX_REPEATS': 2,        # Stop when the same tool input gives the same observation this often
+    'LOOP_GUARD_MAX_PARSE_FAILURES': 2, # Stop after this many consecutive parse failures
+    'LOOP_GUARD_FORCE_FINAL': True,     # When the guard or the iteration budget stops a run, answer from the latest observation
+    'OBSERVATION_TOKEN_BUDGET': 600,    # Larger tool results are summarized and parked under a result handle
+    'OBSERVATION_MAX_ROWS': 30,         # DataFrames/Series with more rows are always summarized
+    'KEEP_ALIVE': '30m',                # Keep the model loaded in Ollama between requests
+    'ROUTER_ENABLED': True,             # Route greetings/simple lookups away from the full agent (unless /chat sets a mode)
+    'ROUTER_GREETING_MAX_WORDS': 8,     # Longer messages are never treated as small talk
+    'ROUTER_SIMPLE_MAX_WORDS': 16,      # Longer questions count as one more point of complexity
+    'ROUTER_COMPLEX_THRESHOLD': 2,      # Complexity score at which a question goes to the full agent
+    'ENTITY_RESOLUTION_ENABLED': True,  # Map manager/client/loan mentions to exact values before the LLM runs
+    'ENTITY_FUZZY_THRESHOLD': 0.6,      # Trigram similarity for a misspelt name word to match (capitalised or beside another name word)
+    'ENTITY_MAX_CANDIDATES': 5,         # Candidates listed for an ambiguous mention
+    'DATA_PROFILE_TOKEN_BUDGET': 600,   # Data dictionary appended to the code-writing system prompts (0 disables)
+    'DATA_PROFILE_MAX_VALUES': 12,      # Text columns with at most this many distinct values list them
+    'MODEL_POOLS': {
+        # While 'model' is the same 'mistral' as the full pool, the fast route only skips the ReAct
+        # loop (one plan_execute program, template answer); it gets faster per call once 'model' points
+        # at a smaller local model (e.g. 'phi3:mini'). Failures fall back to the full agent
+        'fast': {'model': 'mistral', 'mode': 'plan_execute', 'answer_style': 'template'},
+        'full': {'mode': None}   # The agent on AI_CONFIG['MODEL_NAME']; mode None: AI_CONFIG['AGENT_MODE']
+    },
+    # Per-stage generation settings: 'action' writes code / tool calls, 'final' writes the HTML answer
+    'GENERATION_PROFILES': {
+        'action': {
+            'temperature': 0.0,
+            'num_predict': 512,    # Thought + one line of code (or a short direct answer)
+            'num_ctx': 8192,       # The ReAct system prompt alone is ~4k tokens
+            'stop': ['\nObservation:', '\n\tObservation:', '\nObservation']
+        },
+        'final': {
+            'temperature': 0.1,
+            'num_predict': 1536,   # Room for an HTML card or table
+            'num_ctx': 8192,
+            'stop': ['\nObservation:', '\nQuestion:', '\nHuman:']
+        }
+    }
 }
 
 # Data Configuration
@@ -115,7 +164,77 @@ PERFORMANCE_CONFIG = {
     'MAX_CONCURRENT_REQUESTS': 5,
     'REQUEST_TIMEOUT': 3600,  # 1 hour for testing
     'RETRY_ATTEMPTS': 3,
-    'RETRY_DELAY': 1
+    'RETRY_DELAY': 1,
+    'CACHE_DIR': 'cache',            # On-disk caches shared by all workers
+    'PROGRAM_CACHE_ENABLED': True,   # Reuse verified analysis programs for recurring question templates
+    'PROGRAM_CACHE_SIZE': 500,       # Max stored question templates
+    'TOOL_CACHE_ENABLED': True,      # Memoize deterministic python_calculator snippets
+    'TOOL_CACHE_SIZE': 256,          # In-memory LRU entries per worker
+    'TOOL_CACHE_DB': 'cache/tool_cache.sqlite3',  # Shared on-disk tier; '' disables it
+    'TOOL_CACHE_DB_MAX_ROWS': 5000,
+    'TOOL_CACHE_MAX_RESULT_CHARS': 100000,  # Larger results are not cached
+    'KERNEL_SCOPE': 'turn',          # python_calculator variables persist per 'turn', per 'session', or 'off'
+    'KERNEL_MAX_BYTES': 256 * 1024 * 1024,       # Total kernel namespace budget
+    'KERNEL_MAX_VALUE_BYTES': 64 * 1024 * 1024,  # Larger intermediates are evicted immediately
+    'KERNEL_SESSION_TTL': 1800,      # Idle session kernels are torn down after this many seconds
+    'KERNEL_MAX_SESSIONS': 50,
+    'SINGLEFLIGHT_ENABLED': True,    # Identical concurrent /chat questions share one agent run (across workers)
+    'SINGLEFLIGHT_POLL_SECONDS': 0.5,
+    'JOBS_DB': 'cache/jobs.sqlite3',  # Job table shared by the web app and job_worker.py
+    'JOB_WORKERS': 1,                # job_worker.py processes (one Ollama instance rarely benefits from more)
+    'JOB_POLL_SECONDS': 1,
+    'JOB_HEARTBEAT_SECONDS': 10,
+    'JOB_STALE_SECONDS': 120,        # Running jobs without a heartbeat for this long are requeued
+    'JOB_MAX_ATTEMPTS': 2,
+    'JOB_MAX_WAIT_SECONDS': 10,      # Longest long-poll GET /api/jobs/<id>?wait=N (it holds a sync web worker)
+    'JOB_RETENTION_SECONDS': 86400,  # Finished jobs are deleted after a day
+    'JOB_CALLBACK_TIMEOUT': 10,
+    'JOB_CALLBACK_ALLOWED_HOSTS': [],  # Hosts callback_url may name; empty allows any host with public addresses only
+    'SCHEDULER_ENABLED': True,       # Priority slots for LLM calls and tool runs, shared by all processes
+    'SCHEDULER_DB': 'cache/scheduler.sqlite3',
+    # priority: lower is served first; weight: fair-share weight of a client in that class
+    'SCHEDULER_CLASSES': {
+        'interactive': {'priority': 0, 'weight': 4},   # /chat
+        'batch': {'priority': 1, 'weight': 2},         # /api/jobs (default)
+        'background': {'priority': 2, 'weight': 1}     # warmups, cache refreshes
+    },
+    'SCHEDULER_LLM_SLOTS_PER_BACKEND': 1,  # Concurrent generations per Ollama backend
+    'SCHEDULER_TOOL_SLOTS': 0,       # Concurrent python_calculator runs; 0 = CPU count
+    'SCHEDULER_AGING_SECONDS': 300,  # Waiters move up one class per this many seconds (no starvation)
+    'SCHEDULER_USAGE_HALF_LIFE': 600,  # Seconds for a client's usage to count half in fair sharing
+    'SCHEDULER_POLL_SECONDS': 0.1,
+    'RESULT_HANDLE_MEMORY_SIZE': 64, # Full results kept in memory per worker (all are also pickled under CACHE_DIR/results)
+    'RESULT_HANDLE_TTL': 3600,       # Seconds a result handle stays fetchable
+    'BRIEFINGS_ENABLED': True,       # Precompute manager briefings per data version; serve them to chat
+    'DATA_REFRESH_POLL_SECONDS': 30, # How often job_worker.py checks the CSVs for a new data version
+    'BRIEFING_DUE_TODAY_LIMIT': 200, # Loans listed in a briefing's due-today list
+    'BRIEFING_TOP_ARREARS': 10,      # Largest arrears listed per briefing
+    'ANSWER_CACHE_DB': 'cache/answers.sqlite3',  # Finished /chat answers (CACHE_ENABLED, CACHE_TIMEOUT); '' disables
+    'ANSWER_CACHE_MAX_ROWS': 2000,
+    'QUERY_LOG_ENABLED': True,       # Record every /chat request for analysis and cache warming
+    'QUERY_LOG_DB': 'cache/query_log.sqlite3',
+    'QUERY_LOG_QUEUE_SIZE': 10000,   # Rows waiting for the writer thread; more are dropped
+    'QUERY_LOG_RETENTION_SECONDS': 30 * 86400,
+    'QUERY_LOG_REPLAY_TOP': 20,      # Popular questions replayed after a data refresh; 0 disables
+    'QUERY_LOG_REPLAY_MIN_COUNT': 2, # Asked at least this often in the window
+    'QUERY_LOG_REPLAY_WINDOW_SECONDS': 7 * 86400,
+    'QUERY_LOG_REPLAY_MAX_SECONDS': 1800, # Time budget for one replay round
+    'ANALYTICS_MEMO_SIZE': 256,      # Memoized analytics results per worker (cleared on data refresh)
+    'PAR_THRESHOLDS': [1, 7, 30],    # PARx: share of outstanding principal at least x days past due
+    'PAR_DPD_BUCKETS': [1, 7, 30, 60, 90],  # Days-past-due bucket edges: current, 1-6, 7-29, 30-59, 60-89, 90+
+    'PAR_CACHE_SIZE': 32,            # PAR reports (one per as-of date) cached per worker
+    'LEDGER_OUT_OF_CORE': False,     # Serve ledger.csv from month-partitioned columnar files instead of RAM
+    'LEDGER_STORE_DIR': 'cache/ledger_store',
+    'LEDGER_CHUNK_ROWS': 500000,     # Rows per conversion chunk (bounds memory while converting)
+    'LEDGER_MAX_FRAME_ROWS': 1000000,  # Out-of-core: largest whole-ledger DataFrame load_dataset('ledger') builds
+    'COMPACT_DATASETS': False,       # Load CSVs with int32 whole numbers, categorical low-cardinality text and shared strings
+                                     # (python_calculator still sees plain text columns: a categorical's value_counts/groupby
+                                     # would also list categories a filter removed, with zeros)
+    'COMPACT_CATEGORY_MAX_RATIO': 0.2,  # Text columns with at most this share of distinct values become categorical
+    'WORKER_MAX_RSS_MB': 1536,       # Gunicorn recycles a worker whose RSS passes this after a request; 0 disables
+    'WORKER_RSS_CHECK_EVERY': 10,    # Requests between a worker's RSS checks
+    'STARTUP_PRELOAD': True,         # Gunicorn master imports the agent and loads the datasets before forking workers
+    'STARTUP_WARM_UP': True          # Gunicorn master starts `startup.py --warm-up` to load the model on every Ollama backend
 }
 
 # Security Configuration
@@ -0,0 +1,161 @@
+"""
+Data profile for the agent prompts
+Profiles all four datasets once per data version: row counts, dtypes, null
+counts, the values of low-cardinality columns (Loan_Product_Type, Status,
+Client_Type, ...) and min/max of numeric and date columns. A compact text
+rendering within AI_CONFIG['DATA_PROFILE_TOKEN_BUDGET'] is appended to the
+system prompt of the code-writing LLMs, so the agent doesn't spend round trips
+on df.columns, .unique() or date-range exploration. In out-of-core ledger mode
+the ledger is profiled from the store's manifest instead of a loaded frame.
+"""
+
+import logging
+import re
+import threading
+
+import ledger_store
+from config import AI_CONFIG
+from datasets import DATASET_FILES, get_data_version, load_dataset, on_refresh
+from observations import estimate_tokens
+
+logger = logging.getLogger(__name__)
+
+DATE_PATTERN = re.compile(r'^\d{4}-\d{2}-\d{2}')
+
+_cache = {'version': None, 'profile': None, 'text': {}}
+_lock = threading.Lock()
+
+
+def _number(value):
+    value = float(value)
+    return f"{int(value)}" if value.is_integer() else f"{value:.2f}"
+
+
+def profile_column(series):
+    """dtype, nulls and distinct count, plus values (low cardinality) or min/max"""
+    non_null = series.dropna()
+    info = {
+        'dtype': str(series.dtype),
+        'nulls': int(series.isna().sum()),
+        'distinct': int(non_null.nunique()),
+    }
+    if series.dtype == bool:
+        info['kind'] = 'bool'
+        info['values'] = sorted(str(v) for v in non_null.unique())
+    elif series.dtype.kind in 'iuf':
+        info['kind'] = 'number'
+        if len(non_null):
+            info['min'], info['max'] = _number(non_null.min()), _number(non_null.max())
+    elif len(non_null) and non_null.astype(str).str.match(DATE_PATTERN).all():
+        info['kind'] = 'date'
+        info['min'], info['max'] = str(non_null.min()), str(non_null.max())
+    else:
+        info['kind'] = 'text'
+        if info['distinct'] <= AI_CONFIG['DATA_PROFILE_MAX_VALUES']:
+            info['values'] = sorted(str(v) for v in non_null.unique())
+        elif len(non_null):
+            info['example'] = str(non_null.iloc[0])
+    return info
+
+
+def profile_store(store):
+    """profile_column()-style info for the out-of-core ledger store"""
+    columns = {}
+    for column, stats in store.column_stats().items():
+        if column == 'Posting_Date':
+            info = {'dtype': 'object', 'nulls': 0, 'kind': 'date', 'min': stats['min'], 'max': stats['max']}
+        elif 'labels' in stats:
+            # Missing values are not counted per column in the store
+            info = {'dtype': 'object', 'nulls': 0, 'distinct': stats['distinct'], 'kind': 'text'}
+            if stats['distinct'] <= AI_CONFIG['DATA_PROFILE_MAX_VALUES']:
+                info['values'] = stats['labels']
+            elif stats['labels']:
+                info['example'] = stats['labels'][0]
+        else:
+            info = {'dtype': 'float64', 'nulls': stats['nulls'], 'kind': 'number'}
+            if stats['min'] is not None:
+                info['min'], info['max'] = _number(stats['min']), _number(stats['max'])
+        info.setdefault('distinct', None)
+        columns[column] = info
+    header = store.manifest['header'] or list(columns)
+    return {'rows': store.rows, 'columns': {c: columns[c] for c in header if c in columns}}
+
+
+def build_profile():
+    """Profile of every dataset: {'<name>.csv': {'rows', 'columns': {column: info}}}"""
+    profile = {}
+    for name, path in DATASET_FILES.items():
+        if name == 'ledger' and ledger_store.enabled():
+            profile[path] = profile_store(ledger_store.get_store())
+            continue
+        df = load_dataset(name)
+        profile[path] = {
+            'rows': int(len(df)),
+            'columns': {column: profile_column(df[column]) for column in df.columns},
+        }
+    return profile
+
+
+def get_profile():
+    """The profile for the current data version"""
+    version = get_data_version()
+    if _cache['version'] != version:
+        with _lock:
+            if _cache['version'] != version:
+                _cache.update({'version': version, 'profile': build_profile(), 'text': {}})
+                logger.info(f"Profiled {len(_cache['profile'])} datasets (version {version})")
+    return _cache['profile']
+
+
+@on_refresh
+def _refresh(version):
+    get_profile()
+
+
+def _column_line(column, info):
+    """(priority, text) for one column; lower priorities are kept first under the budget"""
+    nulls = f", {info['nulls']} nulls" if info['nulls'] else ""
+    if 'values' in info:
+        return 0, f"  {column} ({info['kind']}{nulls}): {', '.join(info['values'])}"
+    if info['kind'] == 'date' and 'min' in info:
+        return 0, f"  {column} (date{nulls}): {info['min']} to {info['max']}"
+    if info['kind'] == 'number' and 'min' in info:
+        return 1, f"  {column} ({info['dtype']}{nulls}): {info['min']} to {info['max']}"
+    example = f", e.g. {info['example']}" if 'example' in info else ""
+    return 2, f"  {column} ({info['kind']}, {info['distinct']} distinct{nulls}{example})"
+
+
+def render(profile, budget):
+    """
+    Text rendering within `budget` estimated tokens. Dataset headers, categorical values
+    and date ranges come first, then numeric ranges, then identifier/free-text columns.
+    """
+    lines = [(0, "DATA PROFILE (exact column names and values in the current data):")]
+    for path, dataset in profile.items():
+        lines.append((0, f"{path}: {dataset['rows']} rows"))
+        lines.extend(_column_line(column, info) for column, info in dataset['columns'].items())
+
+    kept = set()
+    used = 0
+    for priority in (0, 1, 2):
+        for index, (line_priority, text) in enumerate(lines):
+            if line_priority != priority:
+                continue
+            cost = estimate_tokens(text)
+            if used + cost > budget:
+                continue
+            kept.add(index)
+            used += cost
+    return "\n".join(text for index, (_, text) in enumerate(lines) if index in kept)
+
+
+def prompt_block():
+    """Rendered profile to append to a system prompt ('' when disabled)"""
+    budget = AI_CONFIG['DATA_PROFILE_TOKEN_BUDGET']
+    if not budget:
+        return ""
+    profile = get_profile()
+    text = _cache['text'].get(budget)
+    if text is None:
+        text = _cache['text'][budget] = "\n\n" + render(profile, budget) + "\n"
+    return text
@@ -0,0 +1,167 @@
+"""
+Shared access to the loan CSV datasets
+Loads each CSV once per data version so every module works on the same frames,
+and exposes the data version used to key caches. Modules that precompute
+from the data register refresh hooks, fired when the version changes.
+"""
+
+import hashlib
+import logging
+import os
+import threading
+
+import numpy as np
+import pandas as pd
+
+from config import DATA_CONFIG, PERFORMANCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+# Dataset name -> CSV file
+DATASET_FILES = {
+    'processed_data': DATA_CONFIG['CSV_FILE_PATH'],
+    'loans': 'loans.csv',
+    'ledger': 'ledger.csv',
+    'clients': 'clients.csv'
+}
+
+_frames = {}
+_lock = threading.Lock()
+
+# Callbacks run once per new data version (see check_for_refresh)
+_refresh_hooks = []
+_last_refresh_version = None
+
+
+def get_data_version():
+    """
+    Short fingerprint of the dataset files (name, size, mtime).
+    Changes whenever any CSV is re-exported, so caches keyed on it go stale automatically.
+    """
+    digest = hashlib.sha1()
+    for name, path in sorted(DATASET_FILES.items()):
+        try:
+            stat = os.stat(path)
+            digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns};".encode())
+        except OSError:
+            digest.update(f"{name}:missing;".encode())
+    return digest.hexdigest()[:12]
+
+
+def dataset_name_for_path(path):
+    """Map a CSV path used in analysis code back to its dataset name"""
+    base = os.path.basename(str(path))
+    for name, file_path in DATASET_FILES.items():
+        if os.path.basename(file_path) == base:
+            return name
+    return None
+
+
+def compact_frame(df, category_max_ratio=None):
+    """
+    Same values in less memory: whole-number columns as int32 (when they fit),
+    low-cardinality text without missing values as category, and every other text
+    column with repeated values sharing one string object.
+    ISO date columns stay text, since categoricals do not support < and >.
+    python_calculator code gets plain_frame() copies, so its value_counts/groupby
+    results are the same as without compaction.
+    """
+    if category_max_ratio is None:
+        category_max_ratio = PERFORMANCE_CONFIG['COMPACT_CATEGORY_MAX_RATIO']
+    limits = np.iinfo(np.int32)
+    columns = {}
+    for column in df.columns:
+        series = df[column]
+        if series.dtype.kind in 'iuf':
+            values = series.to_numpy()
+            # int32 rather than the smallest type, so arithmetic in analysis code does not overflow
+            if (len(values) and not np.isnan(values.astype(np.float64)).any()
+                    and (values % 1 == 0).all() and limits.min <= values.min() and values.max() <= limits.max):
+                series = series.astype(np.int32)
+        elif series.dtype.kind == 'O' or pd.api.types.is_string_dtype(series):
+            codes, uniques = pd.factorize(series)
+            dates = len(uniques) and uniques.astype(str).str.match(r'^\d{4}-\d{2}-\d{2}').all()
+            if not dates and (codes >= 0).all() and len(uniques) <= category_max_ratio * len(series):
+                series = series.astype('category')
+            else:
+                series = pd.Series(uniques.take(codes, allow_fill=True), index=series.index, name=column)
+        columns[column] = series
+    return pd.DataFrame(columns, index=df.index)
+
+
+def plain_frame(df, copy=False):
+    """
+    df with categorical columns turned back into text, for analysis code: on a categorical,
+    value_counts() and groupby() also list the categories a filtered frame no longer has.
+    Returns a new frame when something changed (or copy is set), else df itself.
+    """
+    categorical = [c for c in df.columns if isinstance(df[c].dtype, pd.CategoricalDtype)]
+    if not categorical:
+        return df.copy() if copy else df
+    return df.assign(**{c: df[c].astype(df[c].cat.categories.dtype) for c in categorical})
+
+
+def loaded_frames():
+    """{name: DataFrame} of the datasets this process currently holds"""
+    return {name: frame for name, (_, frame) in list(_frames.items())}
+
+
+def load_dataset(name):
+    """
+    Return the DataFrame for a dataset, reloading only when the data version changes.
+    The frame is shared between callers: treat it as read-only (copy before mutating).
+    """
+    if name not in DATASET_FILES:
+        raise KeyError(f"Unknown dataset: {name}")
+    if name == 'ledger' and PERFORMANCE_CONFIG['LEDGER_OUT_OF_CORE']:
+        # Out-of-core mode: materialized from the partitioned store on demand, never kept per worker,
+        # and refused once the whole ledger would no longer fit comfortably
+        import ledger_store
+        store = ledger_store.get_store()
+        if store.rows > PERFORMANCE_CONFIG['LEDGER_MAX_FRAME_ROWS']:
+            raise ValueError(
+                f"ledger.csv has {store.rows:,} rows, too many to load at once (LEDGER_MAX_FRAME_ROWS); "
+                "use ledger_query(date_from, date_to, loan_no=None) for a date range or group_agg(..., dataset='ledger')"
+            )
+        return store.frame()
+    version = get_data_version()
+    cached = _frames.get(name)
+    if cached and cached[0] == version:
+        return cached[1]
+    with _lock:
+        cached = _frames.get(name)
+        if cached and cached[0] == version:
+            return cached[1]
+        df = pd.read_csv(DATASET_FILES[name], encoding=DATA_CONFIG['ENCODING'])
+        if PERFORMANCE_CONFIG['COMPACT_DATASETS']:
+            df = compact_frame(df)
+        _frames[name] = (version, df)
+        logger.info(f"Loaded dataset {name} ({len(df)} rows, version {version})")
+        return df
+
+
+def on_refresh(callback):
+    """Register callback(version) to run whenever check_for_refresh sees a new data version"""
+    if callback not in _refresh_hooks:
+        _refresh_hooks.append(callback)
+    return callback
+
+
+def check_for_refresh():
+    """
+    Run the refresh hooks if the data version changed since the last check
+    (the first check in a process always fires). Returns True if hooks ran.
+    Hook failures are logged and do not stop the other hooks.
+    """
+    global _last_refresh_version
+    version = get_data_version()
+    if version == _last_refresh_version:
+        return False
+    _last_refresh_version = version
+    logger.info(f"Data version {version}: running {len(_refresh_hooks)} refresh hook(s)")
+    for hook in list(_refresh_hooks):
+        try:
+            hook(version)
+        except Exception as e:
+            logger.error(f"Refresh hook {getattr(hook, '__name__', hook)} failed: {e}")
+    return True
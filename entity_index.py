@@ -0,0 +1,205 @@
+"""
+Entity resolution for questions
+Users write "Joseph", "magdalene", "lucia mutave" or a misspelt name, while the
+data holds "Joseph Mutunga" and "LUCIA ESTHER MUTAVE NZAU". This module keeps a
+per-data-version index over the words of every Managed_By and Client_Name
+(exact word lookup plus a trigram index for typos) and the Loan_No /
+Client_Code identifiers, and resolves the mentions in a question to canonical
+values before the LLM runs, so the agent does not spend iterations searching.
+Exact name words always match; a misspelt one only when it is capitalised or
+part of a longer name, so everyday words are not taken for similar names.
+"""
+
+import logging
+import re
+import threading
+from collections import defaultdict
+
+import metrics
+from config import AI_CONFIG
+from datasets import get_data_version, load_dataset, on_refresh
+
+logger = logging.getLogger(__name__)
+
+ID_PATTERN = re.compile(r'\b([ac]\d{5})\b', re.IGNORECASE)
+WORD_PATTERN = re.compile(r"[A-Za-z]+")
+
+# Question words never treated as (misspelt) names
+STOPWORDS = set("""
+a an and or the of for to in on at by with from about is are was were be been has have had do does did
+how many much what which who whom whose when where why show list give tell me my our their his her its
+all any each per top bottom most least highest lowest total sum count number average mean rate ratio
+loan loans client clients customer customers manager managers officer officers product products
+paid pay payment payments paying collected collections collection expected due today yesterday week weeks
+month months day days year arrears amount amounts balance disbursed issued active inactive status new repeat
+portfolio performance performing best worst compare versus trend trends latest last first since between
+name names phone number code details profile info information about than more less over under still
+share percentage proportion will can could should would please
+january february march april may june july august september october november december
+""".split())
+
+
+def _trigrams(word):
+    padded = f"  {word} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+def _similarity(a, b):
+    """Dice coefficient of the two words' trigram sets"""
+    ta, tb = _trigrams(a), _trigrams(b)
+    return 2 * len(ta & tb) / (len(ta) + len(tb))
+
+
+class EntityIndex:
+    """Word and trigram index over manager and client names, plus loan/client ids"""
+
+    def __init__(self, processed):
+        self.entities = []                      # id -> {'type', 'canonical', 'client_code'}
+        self.word_entities = defaultdict(set)   # lowercase name word -> entity ids
+        self.word_trigrams = defaultdict(set)   # trigram -> name words
+        self.ids = {}                           # 'A00892' / 'C00530' -> entity dict
+
+        for manager in sorted(processed['Managed_By'].dropna().unique()):
+            self._add({'type': 'manager', 'canonical': manager})
+        clients = processed.drop_duplicates('Client_Code')[['Client_Code', 'Client_Name']].dropna()
+        for code, name in clients.itertuples(index=False):
+            entity = {'type': 'client', 'canonical': name, 'client_code': code}
+            self._add(entity)
+            self.ids[code.upper()] = entity
+        for loan_no, code, name in processed[['Loan_No', 'Client_Code', 'Client_Name']].itertuples(index=False):
+            self.ids[loan_no.upper()] = {'type': 'loan', 'canonical': loan_no, 'client_code': code, 'client_name': name}
+
+    def _add(self, entity):
+        entity_id = len(self.entities)
+        self.entities.append(entity)
+        for word in WORD_PATTERN.findall(entity['canonical'].lower()):
+            if len(word) < 3:
+                continue
+            if word not in self.word_entities:
+                for gram in _trigrams(word):
+                    self.word_trigrams[gram].add(word)
+            self.word_entities[word].add(entity_id)
+
+    def match_word(self, word):
+        """(name word, similarity) for a question word, or None"""
+        if word in STOPWORDS or len(word) < 3:
+            return None
+        if word in self.word_entities:
+            return word, 1.0
+        if len(word) < 4:
+            return None
+        candidates = set()
+        for gram in _trigrams(word):
+            candidates |= self.word_trigrams.get(gram, set())
+        scored = [(_similarity(word, c), c) for c in candidates]
+        if not scored:
+            return None
+        score, best = max(scored)
+        return (best, score) if score >= AI_CONFIG['ENTITY_FUZZY_THRESHOLD'] else None
+
+    def resolve(self, question):
+        """
+        Mentions in the question, in order. Each is a dict with 'mention', 'type',
+        'score' and either 'canonical' (plus 'client_code' for clients and loans)
+        or 'candidates' when the mention fits several entities.
+        """
+        mentions = []
+        for match in ID_PATTERN.finditer(question):
+            entity = self.ids.get(match.group(1).upper())
+            if entity:
+                mentions.append({'mention': match.group(1), **entity, 'score': 1.0})
+
+        tokens = WORD_PATTERN.findall(ID_PATTERN.sub(' ', question))
+        words = [t.lower() for t in tokens]
+        matched = [self.match_word(w) for w in words]
+        # A misspelt word is only taken for a name when it is written like one (capitalised,
+        # not just starting the question) or stands next to another name word: "share" is not SHARON
+        fuzzy_ok = [
+            k > 0 and tokens[k][0].isupper()
+            or any(0 <= n < len(words) and matched[n] is not None for n in (k - 1, k + 1))
+            for k in range(len(words))
+        ]
+        matched = [m if m is None or m[1] == 1.0 or fuzzy_ok[k] else None for k, m in enumerate(matched)]
+        i = 0
+        while i < len(words):
+            if matched[i] is None:
+                i += 1
+                continue
+            # Extend the mention while consecutive words still fit a common entity
+            ids = set(self.word_entities[matched[i][0]])
+            j = i + 1
+            while j < len(words) and matched[j] is not None:
+                narrowed = ids & self.word_entities[matched[j][0]]
+                if not narrowed:
+                    break
+                ids = narrowed
+                j += 1
+            entities = [self.entities[k] for k in sorted(ids)]
+            # People talk about their managers by first name; prefer a manager over namesake clients
+            managers = [e for e in entities if e['type'] == 'manager']
+            if managers:
+                entities = managers
+            score = round(min(m[1] for m in matched[i:j]), 2)
+            mention = {'mention': ' '.join(words[i:j]), 'type': entities[0]['type'], 'score': score}
+            if len(entities) == 1:
+                mention.update(entities[0])
+            else:
+                mention['candidates'] = entities[:AI_CONFIG['ENTITY_MAX_CANDIDATES']]
+                mention['matches'] = len(entities)
+            mentions.append(mention)
+            i = j
+        return mentions
+
+
+_index = {'version': None, 'index': None}
+_lock = threading.Lock()
+
+
+def get_index():
+    """The entity index for the current data version"""
+    version = get_data_version()
+    if _index['version'] != version:
+        with _lock:
+            if _index['version'] != version:
+                _index.update({'version': version, 'index': EntityIndex(load_dataset('processed_data'))})
+                logger.info(f"Built entity index ({len(_index['index'].entities)} names, version {version})")
+    return _index['index']
+
+
+@on_refresh
+def _refresh(version):
+    get_index()
+
+
+def resolve(question):
+    """Resolve the entity mentions in a question (see EntityIndex.resolve)"""
+    if not AI_CONFIG['ENTITY_RESOLUTION_ENABLED']:
+        return []
+    mentions = get_index().resolve(question)
+    for mention in mentions:
+        metrics.increment('entities.ambiguous' if 'candidates' in mention else 'entities.resolved')
+    return mentions
+
+
+def _describe(entity):
+    if entity['type'] == 'manager':
+        return f"Managed_By == '{entity['canonical']}'"
+    if entity['type'] == 'client':
+        return f"Client_Name == '{entity['canonical']}' (Client_Code {entity['client_code']})"
+    return f"Loan_No == '{entity['canonical']}' (client {entity['client_name']}, Client_Code {entity['client_code']})"
+
+
+def entity_hints(question):
+    """Prompt lines mapping the question's name mentions to exact column values ('' if none)"""
+    mentions = resolve(question)
+    if not mentions:
+        return ""
+    lines = []
+    for mention in mentions:
+        if 'candidates' in mention:
+            options = '; '.join(_describe(c) for c in mention['candidates'])
+            more = f" (and {mention['matches'] - len(mention['candidates'])} more)" if mention['matches'] > len(mention['candidates']) else ""
+            lines.append(f"- \"{mention['mention']}\" is ambiguous, one of: {options}{more}")
+        else:
+            lines.append(f"- \"{mention['mention']}\" means {_describe(mention)}")
+    return "Resolved names (use these exact values in code):\n" + "\n".join(lines) + "\n\n"
@@ -0,0 +1,101 @@
+"""
+Generation profiles for the Ollama calls made by the agents
+Each agent stage (writing an action vs. writing the final answer) gets its own
+stop sequences, num_predict, num_ctx and temperature from
+AI_CONFIG['GENERATION_PROFILES'], and every call logs its generated-token count
+so the effect of a profile change is measurable in /api/metrics.
+"""
+
+import logging
+from typing import Any, List, Optional
+
+from langchain.callbacks.manager import CallbackManagerForLLMRun
+from langchain.llms.base import LLM
+
+import metrics
+from config import AI_CONFIG
+from ollama_client import generate
+
+logger = logging.getLogger(__name__)
+
+OPTION_KEYS = ('temperature', 'num_predict', 'num_ctx', 'top_p', 'top_k', 'repeat_penalty')
+
+
+def get_profile(stage):
+    """Profile for a stage; unknown stages use the 'action' profile"""
+    profiles = AI_CONFIG['GENERATION_PROFILES']
+    return profiles.get(stage) or profiles['action']
+
+
+def profile_options(stage, stop=None, include_stop=True):
+    """Ollama request options for a stage, merged with caller-supplied stop sequences"""
+    profile = get_profile(stage)
+    options = {key: profile[key] for key in OPTION_KEYS if key in profile}
+    options.setdefault('temperature', AI_CONFIG['TEMPERATURE'])
+    if include_stop:
+        # Keep order, drop duplicates: profile stops first, then the caller's
+        stops = list(dict.fromkeys(list(profile.get('stop', [])) + list(stop or [])))
+        if stops:
+            options['stop'] = stops
+    return options
+
+
+def record_usage(stage, result):
+    """Log and aggregate the token counts of one generation"""
+    metrics.increment(f'generation.{stage}.calls')
+    metrics.observe(f'generation.{stage}.eval_tokens', result['eval_count'])
+    metrics.observe(f'generation.{stage}.prompt_tokens', result['prompt_eval_count'])
+    metrics.observe(f'generation.{stage}.seconds', result['total_duration'])
+    logger.info(
+        f"LLM {stage} step: {result['eval_count']} generated / {result['prompt_eval_count']} prompt tokens "
+        f"in {result['total_duration']:.2f}s"
+    )
+
+
+def react_stage(prompt):
+    """
+    Stage of a ReAct completion: 'action' until a tool has run, then 'final'.
+    The last "Question:" in the prompt is the user's; observations follow it.
+    """
+    tail = prompt[prompt.rfind('Question:'):]
+    return 'final' if '\nObservation:' in tail else 'action'
+
+
+class ProfiledOllama(LLM):
+    """Ollama LLM that applies the generation profile of the current stage"""
+
+    model: str = AI_CONFIG['MODEL_NAME']
+    system: Optional[str] = None
+    stage: str = 'react'  # 'react' picks action/final per call, otherwise a fixed profile name
+    format: Optional[str] = None
+    data_profile: bool = False  # append the current data profile to the system prompt
+
+    @property
+    def _llm_type(self) -> str:
+        return "ollama-profiled"
+
+    @property
+    def _identifying_params(self):
+        return {'model': self.model, 'stage': self.stage}
+
+    def _call(
+        self,
+        prompt: str,
+        stop: Optional[List[str]] = None,
+        run_manager: Optional[CallbackManagerForLLMRun] = None,
+        **kwargs: Any,
+    ) -> str:
+        stage = react_stage(prompt) if self.stage == 'react' else self.stage
+        system = self.system
+        if self.data_profile:
+            from data_profile import prompt_block
+            system = (system or "") + prompt_block()
+        result = generate(
+            prompt,
+            system=system,
+            format=self.format,
+            options=profile_options(stage, stop=stop),
+            model=kwargs.get('model') or self.model
+        )
+        record_usage(stage, result)
+        return result['text']
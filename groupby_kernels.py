@@ -0,0 +1,236 @@
+"""
+Group-by kernels on dictionary-encoded columns
+Most analyses group by Managed_By, Loan_Product_Type, Status or Loan_No, and
+pandas spends most of an object-string group-by hashing the strings. The
+categorical columns of each dataset are encoded to int32 codes once per data
+version (sorted labels, -1 for missing), and sum/count/mean/min/max run as
+np.bincount or ufunc.reduceat over those codes. group_agg() is the
+python_calculator helper; analytics.py uses grouped_sums() for its per-manager
+and per-product views. In out-of-core ledger mode the ledger is not encoded in
+memory and group_agg(dataset='ledger') streams the ledger store instead.
+"""
+
+import logging
+import threading
+
+import numpy as np
+import pandas as pd
+
+from datasets import get_data_version, load_dataset, on_refresh
+
+logger = logging.getLogger(__name__)
+
+# Columns encoded when the data refreshes (others are encoded on first use)
+ENCODED_COLUMNS = {
+    'processed_data': ['Managed_By', 'Loan_Product_Type', 'Status', 'Client_Type', 'Loan_No', 'Client_Code'],
+    'loans': ['Loan_Product_Type', 'Manager', 'Recruiter', 'Loan_No', 'Client_Code'],
+    'ledger': ['Loan_No', 'Loan_Product_Type', 'Posting_Date'],
+    'clients': ['Gender'],
+}
+AGGREGATIONS = ('sum', 'count', 'size', 'mean', 'min', 'max')
+
+_encoded = {'version': None, 'columns': {}}
+_lock = threading.Lock()
+
+
+class Encoding:
+    """int32 codes of a column with its sorted labels; the stable sort order is built on demand"""
+
+    def __init__(self, values):
+        codes, labels = pd.factorize(values, sort=True)
+        if isinstance(labels, (pd.Categorical, pd.CategoricalIndex)):
+            # Compact datasets: results are indexed by plain labels, as with text columns
+            labels = pd.Index(labels.astype(labels.categories.dtype))
+        self.codes = codes.astype(np.int32)
+        self.labels = labels
+        self._order = None
+
+    @property
+    def groups(self):
+        return len(self.labels)
+
+    @property
+    def order(self):
+        """Row positions sorted by code (missing keys first), for reduceat-based kernels"""
+        if self._order is None:
+            self._order = np.argsort(self.codes, kind='stable')
+        return self._order
+
+
+def encode(dataset, column):
+    """Encoding of a dataset column for the current data version (built once, then shared)"""
+    version = get_data_version()
+    with _lock:
+        if _encoded['version'] != version:
+            _encoded.update({'version': version, 'columns': {}})
+        encoding = _encoded['columns'].get((dataset, column))
+    if encoding is None:
+        encoding = Encoding(load_dataset(dataset)[column])
+        with _lock:
+            if _encoded['version'] == version:
+                _encoded['columns'][(dataset, column)] = encoding
+    return encoding
+
+
+def _out_of_core(dataset):
+    # ledger_store builds on these kernels, so it is imported here rather than at the top
+    import ledger_store
+    return dataset == 'ledger' and ledger_store.enabled()
+
+
+@on_refresh
+def _refresh(version):
+    datasets = [dataset for dataset in ENCODED_COLUMNS if not _out_of_core(dataset)]
+    for dataset in datasets:
+        for column in ENCODED_COLUMNS[dataset]:
+            encode(dataset, column)
+    logger.info(f"Encoded {sum(len(ENCODED_COLUMNS[d]) for d in datasets)} categorical columns (version {version})")
+
+
+def group_count(codes, groups):
+    """Rows per group; codes of -1 (missing key) are ignored"""
+    return np.bincount(codes[codes >= 0], minlength=groups)
+
+
+def group_sum(codes, values, groups):
+    """Sum per group, skipping missing keys and NaN values (like pandas)"""
+    keep = (codes >= 0) & ~np.isnan(values)
+    return np.bincount(codes[keep], weights=values[keep], minlength=groups)
+
+
+def group_mean(codes, values, groups):
+    """Mean of the non-NaN values per group (NaN for empty groups)"""
+    keep = (codes >= 0) & ~np.isnan(values)
+    counts = np.bincount(codes[keep], minlength=groups)
+    sums = np.bincount(codes[keep], weights=values[keep], minlength=groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / counts, np.nan)
+
+
+def group_extreme(codes, values, groups, ufunc, order=None):
+    """ufunc.reduceat (np.maximum / np.minimum) per group over code-sorted values; NaN for empty groups"""
+    order = np.argsort(codes, kind='stable') if order is None else order
+    sorted_codes = codes[order]
+    sorted_values = values[order]
+    keep = (sorted_codes >= 0) & ~np.isnan(sorted_values)
+    sorted_codes, sorted_values = sorted_codes[keep], sorted_values[keep]
+    result = np.full(groups, np.nan)
+    if len(sorted_codes):
+        starts = np.flatnonzero(np.r_[True, sorted_codes[1:] != sorted_codes[:-1]])
+        result[sorted_codes[starts]] = ufunc.reduceat(sorted_values, starts)
+    return result
+
+
+def _combine(encodings, mask):
+    """
+    Codes of one or more key columns combined into a single group index, restricted to mask.
+    Returns (codes, groups, key_codes): -1 marks rows with a missing key or outside mask, and
+    key_codes[i][g] is group g's code in encodings[i]. Several columns are numbered over the
+    combinations that occur, not their full product, so high-cardinality keys stay small.
+    """
+    valid = np.ones(len(encodings[0].codes), dtype=bool) if mask is None else mask.copy()
+    for encoding in encodings:
+        valid &= encoding.codes >= 0
+    codes = encodings[0].codes[valid].astype(np.int64)
+    groups = encodings[0].groups
+    key_codes = [np.arange(groups)]
+    for encoding in encodings[1:]:
+        # Each step stays below (combinations so far) * (this column's labels)
+        pairs = codes * encoding.groups + encoding.codes[valid]
+        combinations, codes = np.unique(pairs, return_inverse=True)
+        key_codes = [keys[combinations // encoding.groups] for keys in key_codes]
+        key_codes.append(combinations % encoding.groups)
+        groups = len(combinations)
+    combined = np.full(len(valid), -1, dtype=np.int64)
+    combined[valid] = codes
+    return combined, groups, key_codes
+
+
+def group_agg(by, value=None, agg='sum', dataset='processed_data', where=None):
+    """
+    pandas-style group-by on the cached codes of a dataset:
+    group_agg('Managed_By', 'Arrears') == df.groupby('Managed_By')['Arrears'].sum().
+    by is a column or a list of columns, agg one of sum, count, size, mean, min, max,
+    and where an optional boolean mask over the dataset's rows (e.g. df['Status'] == 'Active').
+    Returns a Series indexed by the group labels (a MultiIndex for several columns),
+    sorted by label, with empty groups dropped.
+    """
+    if agg not in AGGREGATIONS:
+        raise ValueError(f"agg must be one of: {', '.join(AGGREGATIONS)}")
+    columns = [by] if isinstance(by, str) else list(by)
+    if len(columns) == 1 and not isinstance(columns[0], str):
+        # python_calculator rewrites ['a', 'b'] to [['a', 'b']]
+        columns = list(columns[0])
+    if _out_of_core(dataset):
+        if len(columns) != 1 or where is not None:
+            raise ValueError("the out-of-core ledger supports one group column and no where mask")
+        import ledger_store
+        return ledger_store.get_store().aggregate(columns[0], value, agg)
+    encodings = [encode(dataset, column) for column in columns]
+    mask = None if where is None else np.asarray(where, dtype=bool)
+    if mask is not None and len(mask) != len(encodings[0].codes):
+        raise ValueError(f"where has {len(mask)} rows, {dataset} has {len(encodings[0].codes)}")
+    if len(encodings) > 1 or mask is not None:
+        codes, groups, key_codes = _combine(encodings, mask)
+    else:
+        codes, groups = encodings[0].codes, encodings[0].groups
+
+    if agg in ('size', 'count') and value is None:
+        result, present = group_count(codes, groups), None
+    else:
+        if value is None:
+            raise ValueError(f"agg '{agg}' needs a value column")
+        values = load_dataset(dataset)[value].to_numpy(dtype=np.float64)
+        present = group_count(codes, groups) if agg != 'count' else None
+        if agg == 'count':
+            result = np.bincount(codes[(codes >= 0) & ~np.isnan(values)], minlength=groups)
+        elif agg == 'size':
+            result = present
+        elif agg == 'sum':
+            result = group_sum(codes, values, groups)
+        elif agg == 'mean':
+            result = group_mean(codes, values, groups)
+        else:
+            order = encodings[0].order if codes is encodings[0].codes else None
+            result = group_extreme(codes, values, groups, np.maximum if agg == 'max' else np.minimum, order)
+    present = group_count(codes, groups) > 0 if present is None else present > 0
+
+    if len(encodings) == 1:
+        index = pd.Index(encodings[0].labels, name=columns[0])
+    else:
+        # Only the combinations that occur, already in label order
+        index = pd.MultiIndex.from_arrays(
+            [e.labels.take(keys) for e, keys in zip(encodings, key_codes)], names=columns
+        )
+    series = pd.Series(result, index=index, name=value or agg)
+    return series[present]
+
+
+def group_nunique(codes, groups, other_codes, other_groups):
+    """Distinct non-missing values of another encoded column per group"""
+    keep = (codes >= 0) & (other_codes >= 0)
+    pairs = np.unique(codes[keep].astype(np.int64) * other_groups + other_codes[keep])
+    return np.bincount(pairs // other_groups, minlength=groups)
+
+
+def grouped_sums(dataset, by, values, distinct=(), mask=None):
+    """
+    One pass per column of the analytics building block:
+    {label: {'rows': n, <name>: sum, ..., <distinct column>: distinct count}} for the key column `by`.
+    values maps output names to a column name or an array aligned with the dataset's rows;
+    mask optionally restricts the rows.
+    """
+    encoding = encode(dataset, by)
+    codes = encoding.codes if mask is None else _combine([encoding], np.asarray(mask, dtype=bool))[0]
+    frame = load_dataset(dataset)
+    columns = {'rows': group_count(codes, encoding.groups)}
+    for name, column in values.items():
+        array = frame[column] if isinstance(column, str) else column
+        columns[name] = group_sum(codes, np.asarray(array, dtype=np.float64), encoding.groups)
+    for column in distinct:
+        other = encode(dataset, column)
+        columns[column] = group_nunique(codes, encoding.groups, other.codes, other.groups)
+    return {
+        label: {name: column[i].item() for name, column in columns.items()}
+        for i, label in enumerate(encoding.labels) if columns['rows'][i]
+    }
@@ -7,6 +7,8 @@ Optimized for AI/LLM workloads with longer processing times
 import multiprocessing
 import os
 
+from config import PERFORMANCE_CONFIG
+
 # Server socket
 bind = "0.0.0.0:5500"
 backlog = 2048
@@ -15,8 +17,9 @@ backlog = 2048
 workers = multiprocessing.cpu_count() * 2 + 1
 worker_class = "sync"
 worker_connections = 1000
-max_requests = 1000
-max_requests_jitter = 50
+# Workers are recycled when their RSS passes PERFORMANCE_CONFIG['WORKER_MAX_RSS_MB'] (see post_request)
+# instead of after a fixed number of requests
+max_requests = 0
 
 # Timeout settings - Critical for AI workloads
 timeout = 3600  # 1 hour - increased for testing
@@ -56,7 +59,17 @@ raw_env = [
 ]
 
 def when_ready(server):
-    """Called just after the server is started"""
+    """Called just after the server is started; preloads the app before the workers are forked"""
+    import startup
+    if PERFORMANCE_CONFIG['STARTUP_PRELOAD']:
+        try:
+            server.log.info("Preloaded agent and data (seconds per stage): %s", startup.preload())
+        except Exception as e:
+            # Workers still load everything on first use
+            server.log.error("Preload failed: %s", e)
+    if PERFORMANCE_CONFIG['STARTUP_WARM_UP']:
+        # A child process, not a thread: the master must stay single-threaded to fork cleanly
+        startup.warm_up_in_subprocess()
     server.log.info("Server is ready. Spawning workers")
 
 def worker_int(worker):
@@ -121,5 +134,16 @@ def pre_request(worker, req):
     worker.log.info("Processing request: %s", req.uri)
 
 def post_request(worker, req, environ, resp):
-    """Called after a worker processes the request"""
-    worker.log.info("Request processed: %s", req.uri) 
\ No newline at end of file
+    """Called after a worker processes the request; recycles the worker once its RSS is over budget"""
+    worker.log.info("Request processed: %s", req.uri)
+    budget = PERFORMANCE_CONFIG['WORKER_MAX_RSS_MB']
+    worker.requests_handled = getattr(worker, 'requests_handled', 0) + 1
+    if not budget or worker.requests_handled % PERFORMANCE_CONFIG['WORKER_RSS_CHECK_EVERY']:
+        return
+    from memory_report import rss_mb
+    rss = rss_mb()
+    if rss is not None and rss > budget:
+        # Finishes this request, exits gracefully, and the arbiter forks a fresh worker
+        worker.log.warning("Worker %s RSS %.0f MB over the %s MB budget after %s requests; recycling it",
+                           worker.pid, rss, budget, worker.requests_handled)
+        worker.alive = False 
\ No newline at end of file
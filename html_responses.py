@@ -0,0 +1,122 @@
+"""
+HTML response helpers for the Brightcom Loan Assistant
+Builds the brand-styled response cards used when an answer is rendered
+without asking the LLM to write the HTML.
+"""
+
+import ast
+import html
+import json
+import re
+
+from tool_cache import strip_annotations
+
+SUCCESS_CARD_STYLE = "background: linear-gradient(135deg, #82BF45 0%, #19593B 100%); color: white; padding: 20px; border-radius: 8px; margin: 10px 0; box-shadow: 0 4px 15px rgba(130, 191, 69, 0.3); border-left: 5px solid #19593B;"
+ERROR_CARD_STYLE = "background: linear-gradient(135deg, #F25D27 0%, #19593B 100%); color: white; padding: 20px; border-radius: 8px; margin: 10px 0; box-shadow: 0 4px 15px rgba(242, 93, 39, 0.3); border-left: 5px solid #19593B;"
+TITLE_STYLE = "margin: 0 0 10px 0; font-size: 1.3rem; font-weight: 700;"
+TEXT_STYLE = "margin: 0; line-height: 1.6; font-size: 1rem;"
+TABLE_STYLE = "width: 100%; border-collapse: collapse; margin-top: 8px;"
+CELL_STYLE = "padding: 4px 8px; border-bottom: 1px solid rgba(255, 255, 255, 0.3); text-align: left;"
+
+MAX_TEMPLATE_ROWS = 20
+
+# Prefixes python_calculator uses when the snippet failed
+TOOL_ERROR_PREFIXES = (
+    "Error",
+    "Syntax error",
+    "Name error",
+    "No code provided",
+)
+
+
+def card_html(title, body_html, error=False):
+    """Wrap body HTML in a brand-styled response card"""
+    style = ERROR_CARD_STYLE if error else SUCCESS_CARD_STYLE
+    return (
+        '<div class="response-container">'
+        f'<div style="{style}">'
+        f'<h3 style="{TITLE_STYLE}">{html.escape(title)}</h3>'
+        f'{body_html}'
+        '</div>'
+        '</div>'
+    )
+
+
+def error_html(title, message):
+    """Brand-styled error card with a single paragraph"""
+    return card_html(title, f'<p style="{TEXT_STYLE}">{html.escape(message)}</p>', error=True)
+
+
+def is_error_response(response):
+    """Whether a chat answer is a failure (error card, empty or not text) rather than an answer"""
+    return not isinstance(response, str) or not response.strip() or ERROR_CARD_STYLE in response
+
+
+def error_text(response):
+    """Plain text of an error card, for logs and job errors"""
+    text = re.sub(r'<[^>]+>', ' ', (response or '').replace('</h3>', ':</h3>'))
+    return html.unescape(re.sub(r'\s+', ' ', text)).strip()
+
+
+def is_tool_error(observation):
+    """Whether a python_calculator observation reports a failure"""
+    return not isinstance(observation, str) or observation.strip().startswith(TOOL_ERROR_PREFIXES)
+
+
+def parse_observation(observation):
+    """Turn a tool observation string back into a Python value where possible"""
+    if not isinstance(observation, str):
+        return observation
+    text = strip_annotations(observation).strip()
+    for parser in (json.loads, ast.literal_eval):
+        try:
+            return parser(text)
+        except Exception:
+            continue
+    return text
+
+
+def _format_value(value):
+    if isinstance(value, float):
+        return f"{value:,.2f}"
+    if isinstance(value, int) and not isinstance(value, bool):
+        return f"{value:,}"
+    return html.escape(str(value))
+
+
+def rows_table(rows):
+    """Brand-styled table of row dicts (first MAX_TEMPLATE_ROWS rows)"""
+    columns = []
+    for row in rows:
+        for key in row:
+            if key not in columns:
+                columns.append(key)
+    header = "".join(f'<th style="{CELL_STYLE}">{html.escape(str(c))}</th>' for c in columns)
+    body = "".join(
+        "<tr>" + "".join(f'<td style="{CELL_STYLE}">{_format_value(row.get(c, ""))}</td>' for c in columns) + "</tr>"
+        for row in rows[:MAX_TEMPLATE_ROWS]
+    )
+    return f'<table style="{TABLE_STYLE}"><tr>{header}</tr>{body}</table>'
+
+
+def render_result_html(title, observation):
+    """Render a tool observation as a brand-styled answer card without an LLM call"""
+    value = parse_observation(observation)
+
+    if isinstance(value, dict) and value:
+        items = list(value.items())[:MAX_TEMPLATE_ROWS]
+        li_items = "".join(
+            f"<li><strong>{html.escape(str(k))}:</strong> {_format_value(v)}</li>" for k, v in items
+        )
+        body = f'<ul style="list-style-type: none; margin: 0; padding: 0;">{li_items}</ul>'
+    elif isinstance(value, (list, tuple)) and value and all(isinstance(r, dict) for r in value):
+        body = rows_table(list(value))
+    elif isinstance(value, (list, tuple)) and value:
+        li_items = "".join(f"<li>{_format_value(v)}</li>" for v in list(value)[:MAX_TEMPLATE_ROWS])
+        body = f'<ul style="margin: 0; padding-left: 20px;">{li_items}</ul>'
+    elif value in ("", None, {}, [], ()):
+        body = f'<p style="{TEXT_STYLE}">No records found for the requested query.</p>'
+    else:
+        body = f'<p style="{TEXT_STYLE}">{_format_value(value)}</p>'
+
+    return card_html(title, body)
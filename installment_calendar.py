@@ -0,0 +1,213 @@
+"""
+Installment calendar
+processed_data.csv only says who is due *today* (Is_Installment_Day, Due_Today)
+as of the export. This module expands every loan into its weekly installments
+(installment k falls on Issued_Date + 7k days, each Total_Charged / Installments)
+with one vectorized pass, and keeps them as date-sorted NumPy arrays with running
+totals. "Due on D" and "expected between D1 and D2" are then a binary search
+plus a slice, for the python_calculator helpers and the /api/installments endpoints.
+
+Outstanding amounts compare the schedule with each loan's current Total_Paid:
+an installment is outstanding by whatever part of it is not yet covered.
+"""
+
+import logging
+import re
+import threading
+from datetime import date, timedelta
+
+import numpy as np
+import pandas as pd
+
+from datasets import get_data_version, load_dataset, on_refresh
+
+logger = logging.getLogger(__name__)
+
+WEEKDAYS = ['monday', 'tuesday', 'wednesday', 'thursday', 'friday', 'saturday', 'sunday']
+GROUP_COLUMNS = {'manager': 'Managed_By', 'product': 'Loan_Product_Type', 'status': 'Status'}
+
+_calendar = {'version': None, 'calendar': None}
+_lock = threading.Lock()
+
+
+def _money(value):
+    return round(float(value), 2)
+
+
+class InstallmentCalendar:
+    """Every scheduled installment, sorted by due date, with cumulative sums for range totals"""
+
+    def __init__(self, processed):
+        self.loans = processed.reset_index(drop=True)
+        counts = self.loans['Installments'].fillna(0).clip(lower=0).to_numpy(dtype=np.int64)
+        issued = pd.to_datetime(self.loans['Issued_Date']).to_numpy(dtype='datetime64[D]')
+        per_installment = (self.loans['Total_Charged'] / self.loans['Installments'].where(counts > 0)).fillna(0).to_numpy()
+        paid = self.loans['Total_Paid'].fillna(0).to_numpy(dtype=np.float64)
+
+        rows = np.repeat(np.arange(len(self.loans), dtype=np.int32), counts)
+        starts = np.repeat(np.cumsum(counts) - counts, counts)
+        numbers = (np.arange(len(rows)) - starts + 1).astype(np.int16)
+        due = issued[rows] + 7 * numbers.astype('timedelta64[D]')
+        amounts = per_installment[rows]
+        # The part of each installment not yet covered by what the loan has paid so far
+        outstanding = np.clip(numbers * amounts - paid[rows], 0, amounts)
+
+        order = np.argsort(due, kind='stable')
+        self.due = due[order]
+        self.rows = rows[order]
+        self.numbers = numbers[order]
+        self.amounts = amounts[order]
+        self.outstanding = outstanding[order]
+        # Running totals with a leading zero: the sum over [i, j) is cum[j] - cum[i]
+        self.cum_amounts = np.concatenate(([0.0], np.cumsum(self.amounts)))
+        self.cum_outstanding = np.concatenate(([0.0], np.cumsum(self.outstanding)))
+        self.group_codes = {}
+        for key, column in GROUP_COLUMNS.items():
+            codes, labels = pd.factorize(self.loans[column], use_na_sentinel=False)
+            self.group_codes[key] = (codes.astype(np.int32), [str(label) for label in labels])
+
+        # Export date of the snapshot: Issued_Date + Days_Since_Issued
+        as_of = issued + self.loans['Days_Since_Issued'].fillna(0).to_numpy(dtype=np.int64).astype('timedelta64[D]')
+        self.as_of = str(as_of.max()) if len(as_of) else date.today().isoformat()
+
+    def bounds(self, date_from, date_to):
+        """[start, end) positions of the installments due from date_from to date_to inclusive"""
+        start = int(np.searchsorted(self.due, np.datetime64(date_from, 'D'), side='left'))
+        end = int(np.searchsorted(self.due, np.datetime64(date_to, 'D'), side='right'))
+        return start, max(start, end)
+
+    def installments(self, date_from, date_to=None, outstanding_only=False):
+        """DataFrame of the installments due in the range, one row per installment"""
+        start, end = self.bounds(date_from, date_to or date_from)
+        rows = self.rows[start:end]
+        loans = self.loans.iloc[rows]
+        frame = pd.DataFrame({
+            'Due_Date': self.due[start:end].astype(str),
+            'Loan_No': loans['Loan_No'].to_numpy(),
+            'Client_Code': loans['Client_Code'].to_numpy(),
+            'Client_Name': loans['Client_Name'].to_numpy(),
+            'Managed_By': loans['Managed_By'].to_numpy(),
+            'Loan_Product_Type': loans['Loan_Product_Type'].to_numpy(),
+            'Status': loans['Status'].to_numpy(),
+            'Installment_No': self.numbers[start:end],
+            'Installments': loans['Installments'].to_numpy(),
+            'Installment_Amount': self.amounts[start:end].round(2),
+            'Outstanding': self.outstanding[start:end].round(2),
+            'Mobile_Phone_No': loans['Mobile_Phone_No'].to_numpy(),
+        })
+        if outstanding_only:
+            frame = frame[frame['Outstanding'] > 0]
+        return frame.reset_index(drop=True)
+
+    def expected(self, date_from, date_to, by=None):
+        """Scheduled and outstanding totals for the range, per day and optionally per group"""
+        start, end = self.bounds(date_from, date_to)
+        result = {
+            'from': date_from,
+            'to': date_to,
+            'installments': end - start,
+            'scheduled': _money(self.cum_amounts[end] - self.cum_amounts[start]),
+            'outstanding': _money(self.cum_outstanding[end] - self.cum_outstanding[start]),
+        }
+        due = self.due[start:end]
+        days, first = np.unique(due, return_index=True)
+        if len(days):
+            scheduled = np.add.reduceat(self.amounts[start:end], first)
+            outstanding = np.add.reduceat(self.outstanding[start:end], first)
+            counts = np.diff(np.append(first, len(due)))
+        else:
+            scheduled = outstanding = counts = []
+        result['days'] = [
+            {'date': str(day), 'installments': int(n), 'scheduled': _money(s), 'outstanding': _money(o)}
+            for day, n, s, o in zip(days, counts, scheduled, outstanding)
+        ]
+        if by:
+            if by not in self.group_codes:
+                raise ValueError(f"'by' must be one of: {', '.join(GROUP_COLUMNS)}")
+            codes, labels = self.group_codes[by]
+            slice_codes = codes[self.rows[start:end]]
+            counts = np.bincount(slice_codes, minlength=len(labels))
+            scheduled = np.bincount(slice_codes, weights=self.amounts[start:end], minlength=len(labels))
+            outstanding = np.bincount(slice_codes, weights=self.outstanding[start:end], minlength=len(labels))
+            result['by'] = by
+            result['groups'] = {
+                labels[i]: {'installments': int(counts[i]), 'scheduled': _money(scheduled[i]), 'outstanding': _money(outstanding[i])}
+                for i in np.argsort(-scheduled, kind='stable') if counts[i]
+            }
+        return result
+
+
+def get_calendar():
+    """The installment calendar for the current data version"""
+    version = get_data_version()
+    if _calendar['version'] != version:
+        with _lock:
+            if _calendar['version'] != version:
+                calendar = InstallmentCalendar(load_dataset('processed_data'))
+                _calendar.update({'version': version, 'calendar': calendar})
+                logger.info(f"Built installment calendar ({len(calendar.due)} installments, version {version})")
+    return _calendar['calendar']
+
+
+@on_refresh
+def _refresh(version):
+    get_calendar()
+
+
+def parse_day(text, as_of=None):
+    """
+    ISO date, 'today', 'tomorrow', 'yesterday' or a weekday name (the next one on or
+    after the data's as-of date) -> 'YYYY-MM-DD'. ValueError for anything else.
+    """
+    as_of = date.fromisoformat(as_of or get_calendar().as_of)
+    value = str(text).strip().lower()
+    offsets = {'today': 0, 'tomorrow': 1, 'yesterday': -1}
+    if value in offsets:
+        return (as_of + timedelta(days=offsets[value])).isoformat()
+    if value in WEEKDAYS:
+        return (as_of + timedelta(days=(WEEKDAYS.index(value) - as_of.weekday()) % 7)).isoformat()
+    try:
+        return date.fromisoformat(value).isoformat()
+    except ValueError:
+        raise ValueError(f"'{text}' is not a date (use YYYY-MM-DD, today, tomorrow or a weekday)")
+
+
+def parse_range(date_from, date_to=None):
+    """(from, to) ISO dates; date_from may also be 'this week' / 'next week' (Monday to Sunday)"""
+    value = str(date_from).strip().lower()
+    week = re.fullmatch(r'(this|next) week', value)
+    if week and date_to is None:
+        as_of = date.fromisoformat(get_calendar().as_of)
+        monday = as_of - timedelta(days=as_of.weekday()) + timedelta(weeks=week.group(1) == 'next')
+        return monday.isoformat(), (monday + timedelta(days=6)).isoformat()
+    start = parse_day(date_from)
+    end = parse_day(date_to) if date_to else start
+    if start > end:
+        raise ValueError("'from' must not be after 'to'")
+    return start, end
+
+
+def installments_due(date_from, date_to=None, outstanding_only=False):
+    """python_calculator helper: DataFrame of installments due on a day or range (see parse_range)"""
+    start, end = parse_range(date_from, date_to)
+    return get_calendar().installments(start, end, outstanding_only=outstanding_only)
+
+
+def expected_collections(date_from, date_to=None, by=None):
+    """python_calculator helper and API view: scheduled/outstanding totals for a day or range"""
+    start, end = parse_range(date_from, date_to)
+    return {'as_of': get_calendar().as_of, **get_calendar().expected(start, end, by=by)}
+
+
+def due_on(day, outstanding_only=False):
+    """API view: the installments due on one day with their totals"""
+    start, _ = parse_range(day)
+    frame = get_calendar().installments(start, outstanding_only=outstanding_only)
+    return {
+        'date': start,
+        'as_of': get_calendar().as_of,
+        'installments': len(frame),
+        'scheduled': _money(frame['Installment_Amount'].sum()),
+        'outstanding': _money(frame['Outstanding'].sum()),
+        'loans': frame.to_dict('records'),
+    }
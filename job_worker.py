@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+"""
+Job worker for the Brightcom Loan Assistant
+Executes questions queued through POST /api/jobs, outside the web workers.
+Each worker process claims one job at a time from the shared job table,
+heartbeats while the agent runs, stores the answer and calls the job's
+callback_url if one was given. Stale jobs from crashed workers are requeued.
+The main process also watches the data version and runs the refresh hooks
+(manager briefings, replay of popular questions) at background priority
+whenever the CSVs change.
+
+Usage: python job_worker.py [--processes N]
+"""
+
+import argparse
+import asyncio
+import logging
+import multiprocessing
+import os
+import signal
+import socket
+import threading
+import time
+
+import requests
+
+import jobs
+from config import LOGGING_CONFIG, PERFORMANCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_stopping = threading.Event()
+
+
+def _progress(started, baseline):
+    """Elapsed time and LLM/tool calls made so far by this process's current job"""
+    import metrics
+    counters = metrics.snapshot()['counters']
+    llm_calls = sum(v for k, v in counters.items() if k.startswith('generation.') and k.endswith('.calls'))
+    baseline_llm = sum(v for k, v in baseline.items() if k.startswith('generation.') and k.endswith('.calls'))
+    return {
+        'stage': 'running',
+        'elapsed_seconds': round(time.time() - started, 1),
+        'llm_calls': llm_calls - baseline_llm,
+        'tool_calls': counters.get('react.tool_calls', 0) - baseline.get('react.tool_calls', 0)
+    }
+
+
+def _notify(job):
+    """POST the finished job to its callback_url; failures are only logged"""
+    if not job.get('callback_url'):
+        return
+    # Checked again at delivery: the host may resolve differently than when the job was queued
+    problem = jobs.callback_url_problem(job['callback_url'])
+    if problem:
+        logger.warning(f"Not calling back job {job['id']}: {problem}")
+        return
+    try:
+        requests.post(
+            job['callback_url'],
+            json=jobs.public_view(job),
+            timeout=PERFORMANCE_CONFIG['JOB_CALLBACK_TIMEOUT'],
+            # A redirect could point the request at an address the check above would refuse
+            allow_redirects=False
+        )
+    except requests.exceptions.RequestException as e:
+        logger.warning(f"Callback for job {job['id']} to {job['callback_url']} failed: {e}")
+
+
+def run_job(job):
+    """Answer one claimed job, heartbeating until the agent returns"""
+    import metrics
+    import scheduler
+    from html_responses import error_text, is_error_response
+    from utils_simple import promt_llm
+
+    # LLM and tool slots are shared with interactive chats by priority class
+    token = scheduler.set_context(job['priority'] or 'batch', job['client'] or job['session_id'] or f"job:{job['id']}")
+    started = time.time()
+    baseline = dict(metrics.snapshot()['counters'])
+    done = threading.Event()
+
+    def beat():
+        while not done.wait(PERFORMANCE_CONFIG['JOB_HEARTBEAT_SECONDS']):
+            jobs.heartbeat(job['id'], _progress(started, baseline))
+
+    beater = threading.Thread(target=beat, daemon=True)
+    beater.start()
+    try:
+        response = asyncio.run(promt_llm(
+            query=job['prompt'],
+            conversation_history=job['history'],
+            mode=job['mode'],
+            session_id=job['session_id']
+        ))
+        if is_error_response(response):
+            # promt_llm reports failures as error cards rather than raising
+            error = error_text(response) if isinstance(response, str) and response.strip() else 'No answer generated'
+            jobs.fail(job['id'], error, {**_progress(started, baseline), 'stage': 'failed'})
+            logger.warning(f"Job {job['id']} failed after {time.time() - started:.2f}s: {error}")
+        else:
+            progress = {**_progress(started, baseline), 'stage': 'done'}
+            jobs.finish(job['id'], response, progress)
+            logger.info(f"Job {job['id']} finished in {time.time() - started:.2f}s")
+    except Exception as e:
+        logger.error(f"Job {job['id']} failed: {e}")
+        jobs.fail(job['id'], str(e), {**_progress(started, baseline), 'stage': 'failed'})
+    finally:
+        done.set()
+        beater.join()
+        scheduler.reset_context(token)
+    _notify(jobs.get_job(job['id']))
+
+
+def worker_loop(index):
+    """Claim and run jobs until stopped"""
+    worker_id = f"{socket.gethostname()}:{os.getpid()}:{index}"
+    logger.info(f"Job worker {worker_id} started")
+    last_recovery = 0.0
+    while not _stopping.is_set():
+        try:
+            if time.time() - last_recovery > PERFORMANCE_CONFIG['JOB_HEARTBEAT_SECONDS']:
+                jobs.recover_stale()
+                last_recovery = time.time()
+            job = jobs.claim_next(worker_id)
+        except Exception as e:
+            logger.error(f"Job worker {worker_id} could not reach the job table: {e}")
+            job = None
+        if job is None:
+            _stopping.wait(PERFORMANCE_CONFIG['JOB_POLL_SECONDS'])
+            continue
+        logger.info(f"Job worker {worker_id} running job {job['id']}: {job['prompt'][:100]}")
+        run_job(job)
+    logger.info(f"Job worker {worker_id} stopped")
+
+
+def refresh_loop():
+    """Run the data refresh hooks (briefings, popular-question replay) whenever the data version changes"""
+    import briefings  # noqa: F401 - registers its refresh hook
+    import client_profiles  # noqa: F401 - registers its refresh hook
+    import data_profile  # noqa: F401 - registers its refresh hook
+    import datasets
+    import groupby_kernels  # noqa: F401 - registers its refresh hook
+    import installment_calendar  # noqa: F401 - registers its refresh hook
+    import ledger_store  # noqa: F401 - registers its refresh hook
+    import par_engine  # noqa: F401 - registers its refresh hook
+    import query_log  # noqa: F401 - registers its refresh hook
+    while not _stopping.is_set():
+        try:
+            datasets.check_for_refresh()
+        except Exception as e:
+            logger.error(f"Data refresh check failed: {e}")
+        _stopping.wait(PERFORMANCE_CONFIG['DATA_REFRESH_POLL_SECONDS'])
+
+
+def _stop(signum, frame):
+    _stopping.set()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument(
+        '--processes', type=int, default=PERFORMANCE_CONFIG['JOB_WORKERS'],
+        help='worker processes (each runs one job at a time)'
+    )
+    args = parser.parse_args()
+
+    logging.basicConfig(level=getattr(logging, LOGGING_CONFIG['LEVEL']), format=LOGGING_CONFIG['FORMAT'])
+    signal.signal(signal.SIGTERM, _stop)
+    signal.signal(signal.SIGINT, _stop)
+
+    if args.processes <= 1:
+        threading.Thread(target=refresh_loop, daemon=True).start()
+        worker_loop(0)
+        return
+    processes = [multiprocessing.Process(target=worker_loop, args=(i,)) for i in range(args.processes)]
+    for process in processes:
+        process.start()
+    # Started after forking so the workers don't inherit the thread
+    threading.Thread(target=refresh_loop, daemon=True).start()
+    for process in processes:
+        process.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,266 @@
+"""
+Persistent job queue for long-running analyses
+Questions submitted through /api/jobs are stored in a SQLite job table and
+executed by job_worker.py processes, decoupled from the web workers. Jobs and
+their results survive restarts of either side; a job whose worker stops
+heartbeating is put back in the queue.
+"""
+
+import ipaddress
+import json
+import logging
+import os
+import socket
+import sqlite3
+import time
+import uuid
+from urllib.parse import urlsplit
+
+from config import PERFORMANCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+def _connect():
+    path = PERFORMANCE_CONFIG['JOBS_DB']
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS jobs ("
+        "id TEXT PRIMARY KEY, status TEXT NOT NULL, prompt TEXT NOT NULL, mode TEXT, history TEXT, "
+        "session_id TEXT, callback_url TEXT, result TEXT, error TEXT, progress TEXT, "
+        "attempts INTEGER DEFAULT 0, worker TEXT, created REAL, started REAL, finished REAL, heartbeat REAL, "
+        "priority TEXT DEFAULT 'batch', client TEXT)"
+    )
+    columns = {row['name'] for row in conn.execute("PRAGMA table_info(jobs)")}
+    if 'priority' not in columns:
+        # Tables created before priority scheduling
+        conn.execute("ALTER TABLE jobs ADD COLUMN priority TEXT DEFAULT 'batch'")
+        conn.execute("ALTER TABLE jobs ADD COLUMN client TEXT")
+    conn.execute("CREATE INDEX IF NOT EXISTS jobs_status_created ON jobs (status, created)")
+    return conn
+
+
+def _row_to_job(row):
+    job = dict(row)
+    job['history'] = json.loads(job['history'] or '[]')
+    job['progress'] = json.loads(job['progress']) if job['progress'] else None
+    return job
+
+
+def create_job(prompt, mode=None, history=None, session_id=None, callback_url=None, priority='batch', client=None):
+    """Queue a question and return its job id"""
+    job_id = uuid.uuid4().hex
+    conn = _connect()
+    try:
+        conn.execute(
+            "INSERT INTO jobs (id, status, prompt, mode, history, session_id, callback_url, priority, client, created) "
+            "VALUES (?, 'queued', ?, ?, ?, ?, ?, ?, ?, ?)",
+            (job_id, prompt, mode, json.dumps(history or []), session_id, callback_url, priority, client, time.time())
+        )
+    finally:
+        conn.close()
+    return job_id
+
+
+def callback_url_problem(url):
+    """
+    Why a callback_url may not be called (None if it may). Only http(s) URLs are
+    accepted; with JOB_CALLBACK_ALLOWED_HOSTS set the host must be listed, otherwise
+    it must not resolve to a loopback, private, link-local or reserved address.
+    """
+    parts = urlsplit(url or '')
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        return 'callback_url must be an http(s) URL'
+    host = parts.hostname.lower()
+    allowed = PERFORMANCE_CONFIG['JOB_CALLBACK_ALLOWED_HOSTS']
+    if allowed:
+        return None if host in allowed else f"host '{host}' is not in JOB_CALLBACK_ALLOWED_HOSTS"
+    try:
+        addresses = {info[4][0] for info in socket.getaddrinfo(host, parts.port or None, proto=socket.IPPROTO_TCP)}
+    except (socket.gaierror, UnicodeError, ValueError):
+        return f"host '{host}' does not resolve"
+    for address in addresses:
+        ip = ipaddress.ip_address(address.split('%')[0])
+        if not ip.is_global or ip.is_multicast:
+            return f"host '{host}' resolves to a non-public address ({ip})"
+    return None
+
+
+def get_job(job_id):
+    """Job as a dict, or None if unknown"""
+    conn = _connect()
+    try:
+        row = conn.execute("SELECT * FROM jobs WHERE id = ?", (job_id,)).fetchone()
+    finally:
+        conn.close()
+    return _row_to_job(row) if row else None
+
+
+def public_view(job):
+    """Job fields returned by the API (no internal bookkeeping)"""
+    now = time.time()
+    view = {
+        'job_id': job['id'],
+        'status': job['status'],
+        'mode': job['mode'] or 'auto',
+        'priority': job['priority'],
+        'progress': job['progress'],
+        'created': job['created'],
+        'queued_seconds': round((job['started'] or now) - job['created'], 2),
+    }
+    if job['started']:
+        view['run_seconds'] = round((job['finished'] or now) - job['started'], 2)
+    if job['status'] == 'done':
+        view['response'] = job['result']
+    if job['status'] == 'failed':
+        view['error'] = job['error']
+    if job['status'] == 'queued':
+        view['queue_position'] = queue_position(job)
+    return view
+
+
+def _priority_rank():
+    """SQL expression ranking jobs by their scheduler class priority"""
+    cases = ' '.join(
+        f"WHEN '{name}' THEN {settings['priority']}"
+        for name, settings in PERFORMANCE_CONFIG['SCHEDULER_CLASSES'].items()
+    )
+    return f"CASE priority {cases} ELSE 99 END"
+
+
+def queue_position(job):
+    conn = _connect()
+    rank = _priority_rank()
+    try:
+        # Jobs of a higher class are claimed first, even if they were queued later
+        return conn.execute(
+            f"SELECT COUNT(*) FROM jobs WHERE status = 'queued' AND "
+            f"({rank} < (SELECT {rank} FROM jobs WHERE id = ?) OR "
+            f"({rank} = (SELECT {rank} FROM jobs WHERE id = ?) AND created <= ?))",
+            (job['id'], job['id'], job['created'])
+        ).fetchone()[0]
+    finally:
+        conn.close()
+
+
+def wait_for(job_id, timeout):
+    """
+    Long-poll: return the job once it is finished or `timeout` seconds have passed.
+    The wait holds a web worker, so it is capped at JOB_MAX_WAIT_SECONDS.
+    """
+    deadline = time.time() + min(timeout, PERFORMANCE_CONFIG['JOB_MAX_WAIT_SECONDS'])
+    while True:
+        job = get_job(job_id)
+        if job is None or job['status'] in ('done', 'failed') or time.time() >= deadline:
+            return job
+        time.sleep(PERFORMANCE_CONFIG['JOB_POLL_SECONDS'])
+
+
+def claim_next(worker_id):
+    """
+    Atomically move the next queued job (highest priority class, then oldest) to
+    'running' for this worker; None when the queue is empty.
+    """
+    conn = _connect()
+    try:
+        # BEGIN IMMEDIATE takes the write lock, so two workers can't claim the same job
+        conn.execute("BEGIN IMMEDIATE")
+        row = conn.execute(
+            f"SELECT id FROM jobs WHERE status = 'queued' ORDER BY {_priority_rank()}, created LIMIT 1"
+        ).fetchone()
+        if row is None:
+            conn.execute("COMMIT")
+            return None
+        now = time.time()
+        conn.execute(
+            "UPDATE jobs SET status = 'running', worker = ?, started = ?, heartbeat = ?, "
+            "attempts = attempts + 1 WHERE id = ?",
+            (worker_id, now, now, row['id'])
+        )
+        conn.execute("COMMIT")
+        job = conn.execute("SELECT * FROM jobs WHERE id = ?", (row['id'],)).fetchone()
+        return _row_to_job(job)
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+
+
+def heartbeat(job_id, progress=None):
+    """Record that the job's worker is alive, with optional progress details"""
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET heartbeat = ?, progress = COALESCE(?, progress) WHERE id = ? AND status = 'running'",
+            (time.time(), json.dumps(progress) if progress is not None else None, job_id)
+        )
+    finally:
+        conn.close()
+
+
+def finish(job_id, result, progress=None):
+    _complete(job_id, 'done', result=result, progress=progress)
+
+
+def fail(job_id, error, progress=None):
+    _complete(job_id, 'failed', error=error, progress=progress)
+
+
+def _complete(job_id, status, result=None, error=None, progress=None):
+    conn = _connect()
+    try:
+        conn.execute(
+            "UPDATE jobs SET status = ?, result = ?, error = ?, finished = ?, "
+            "progress = COALESCE(?, progress) WHERE id = ?",
+            (status, result, error, time.time(), json.dumps(progress) if progress is not None else None, job_id)
+        )
+    finally:
+        conn.close()
+
+
+def recover_stale():
+    """
+    Requeue running jobs whose worker stopped heartbeating (crash, restart).
+    Jobs that already used JOB_MAX_ATTEMPTS are failed instead. Returns the number recovered.
+    """
+    cutoff = time.time() - PERFORMANCE_CONFIG['JOB_STALE_SECONDS']
+    conn = _connect()
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        conn.execute(
+            "UPDATE jobs SET status = 'failed', error = 'Worker stopped responding', finished = ? "
+            "WHERE status = 'running' AND heartbeat < ? AND attempts >= ?",
+            (time.time(), cutoff, PERFORMANCE_CONFIG['JOB_MAX_ATTEMPTS'])
+        )
+        requeued = conn.execute(
+            "UPDATE jobs SET status = 'queued', worker = NULL, started = NULL "
+            "WHERE status = 'running' AND heartbeat < ?",
+            (cutoff,)
+        ).rowcount
+        # Finished jobs are kept for a while so clients can still collect them
+        conn.execute(
+            "DELETE FROM jobs WHERE status IN ('done', 'failed') AND finished < ?",
+            (time.time() - PERFORMANCE_CONFIG['JOB_RETENTION_SECONDS'],)
+        )
+        conn.execute("COMMIT")
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+    finally:
+        conn.close()
+    if requeued:
+        logger.warning(f"Requeued {requeued} job(s) from unresponsive workers")
+    return requeued
+
+
+def stats():
+    conn = _connect()
+    try:
+        rows = conn.execute("SELECT status, COUNT(*) FROM jobs GROUP BY status").fetchall()
+    finally:
+        conn.close()
+    return {status: count for status, count in rows}
@@ -0,0 +1,153 @@
+"""
+JSON tool-calling agent for the Brightcom Loan Assistant
+Replaces free-text ReAct parsing with Ollama's JSON output mode. Every model
+turn is a JSON object, either {"tool": "python_calculator", "code": "..."} or
+{"final": "<html>"}. When AI_CONFIG['JSON_SCHEMA_FORMAT'] is set, the schema is
+passed as Ollama's format, so the grammar makes malformed turns impossible.
+If the protocol still fails, the caller falls back to the ReAct agent.
+"""
+
+import json
+import logging
+import re
+import time
+
+import metrics
+from config import AI_CONFIG
+from data_profile import prompt_block
+from generation import profile_options, record_usage
+from html_responses import is_tool_error, render_result_html
+from ollama_client import OllamaError, chat
+from plan_execute import CODE_RULES, DATASETS_PROMPT
+from tool_cache import strip_annotations
+from utils_simple import python_calculator
+
+logger = logging.getLogger(__name__)
+
+ACTION_SCHEMA = {
+    "anyOf": [
+        {
+            "type": "object",
+            "properties": {
+                "tool": {"type": "string", "enum": ["python_calculator"]},
+                "code": {"type": "string"}
+            },
+            "required": ["tool", "code"],
+            "additionalProperties": False
+        },
+        {
+            "type": "object",
+            "properties": {
+                "final": {"type": "string"}
+            },
+            "required": ["final"],
+            "additionalProperties": False
+        }
+    ]
+}
+
+SYSTEM_PROMPT = """
+You are a Loan Data Analyst at BrightCom Loans. You answer questions about the loan CSV datasets by running Python code, then reply with HTML.
+
+PROTOCOL: every reply is ONE JSON object and nothing else.
+- To run code: {"tool": "python_calculator", "code": "<one line of Python>"}
+- To answer: {"final": "<div class=\\"response-container\\">...</div>"}
+After each tool call you receive the result as "Observation: ...". Usually one tool call is enough; answer as soon as you have the values.
+
+CODE RULES:""" + CODE_RULES + DATASETS_PROMPT + """
+ANSWER RULES:
+- The final HTML is self-contained and static, styled inline with the brand colors Primary #F25D27, Success #82BF45, Dark #19593B, White #FFFFFF.
+- Use the concrete values from the Observation, never placeholders.
+"""
+
+
+class ProtocolError(Exception):
+    """The model reply could not be read as a protocol turn"""
+
+
+def parse_turn(text):
+    """Decode one model reply into ('tool', code) or ('final', html)"""
+    try:
+        turn = json.loads(text)
+    except ValueError as e:
+        raise ProtocolError(f"Invalid JSON: {e}") from e
+    if not isinstance(turn, dict):
+        raise ProtocolError("Reply is not a JSON object")
+    if isinstance(turn.get('final'), str) and turn['final'].strip():
+        return 'final', turn['final'].strip()
+    if turn.get('tool') == 'python_calculator' and isinstance(turn.get('code'), str) and turn['code'].strip():
+        return 'tool', turn['code'].strip()
+    raise ProtocolError(f"Reply has neither a final answer nor a tool call: {text[:200]}")
+
+
+def _clean_html(text):
+    html_start = text.find('<')
+    html_end = text.rfind('>')
+    if html_start < 0 or html_end <= html_start:
+        return None
+    return text[html_start:html_end + 1]
+
+
+def run_json_protocol(question, context=""):
+    """
+    Answer a question with the JSON tool-calling protocol.
+    Returns the HTML answer, or None when the protocol failed and the caller should fall back.
+    """
+    output_format = ACTION_SCHEMA if AI_CONFIG['JSON_SCHEMA_FORMAT'] else 'json'
+    messages = [
+        {'role': 'system', 'content': SYSTEM_PROMPT + prompt_block()},
+        {'role': 'user', 'content': f"{context}Question: {question}"}
+    ]
+    started = time.time()
+    metrics.increment('json.runs')
+    seen_code = set()
+    last_observation = None
+
+    for step in range(AI_CONFIG['MAX_ITERATIONS']):
+        try:
+            # First turn writes a tool call; after an observation the answer is usually final
+            stage = 'final' if last_observation is not None else 'action'
+            # The output grammar ends the reply, so stop sequences would only truncate JSON
+            reply = chat(messages, format=output_format, options=profile_options(stage, include_stop=False))
+            record_usage(stage, reply)
+            metrics.increment('json.llm_calls')
+            kind, payload = parse_turn(reply['text'])
+        except ProtocolError as e:
+            metrics.increment('json.parse_failures')
+            logger.warning(f"JSON agent protocol error, falling back: {e}")
+            return None
+        except OllamaError as e:
+            logger.error(f"JSON agent could not reach Ollama, falling back: {e}")
+            return None
+
+        if kind == 'final':
+            answer = _clean_html(payload)
+            if answer is None:
+                # A plain-text final answer still beats another LLM round trip
+                answer = render_result_html(question.strip().rstrip('?'), payload)
+            metrics.observe('json.iterations', step + 1)
+            metrics.observe('json.seconds', time.time() - started)
+            return answer
+
+        normalized = re.sub(r'\s+', ' ', payload)
+        if normalized in seen_code and last_observation is not None:
+            # Same program again: the model is stuck, answer from what we have
+            metrics.increment('json.repeated_action')
+            return render_result_html("Analysis Result", last_observation)
+        seen_code.add(normalized)
+
+        observation = python_calculator.run(payload)
+        if not is_tool_error(observation):
+            last_observation = observation
+        messages.append({'role': 'assistant', 'content': reply['text']})
+        messages.append({'role': 'user', 'content': f"Observation: {strip_annotations(observation)}"})
+
+    metrics.increment('json.max_iterations')
+    if last_observation is not None:
+        return render_result_html("Partial Result", last_observation)
+    return None
+
+
+async def run_json_agent(question, context=""):
+    """Process a question with the JSON protocol; None means fall back to ReAct"""
+    return run_json_protocol(question, context=context)
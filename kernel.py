@@ -0,0 +1,164 @@
+"""
+Stateful execution kernel for python_calculator
+Keeps the variables an analysis snippet defines (DataFrames, intermediate
+results) so later tool calls in the same turn -- or, optionally, the same
+session -- can reuse them instead of recomputing. Kernels are size-capped,
+evict large intermediates, and are torn down when the turn ends.
+"""
+
+import contextvars
+import logging
+import sys
+import threading
+import time
+import types
+
+import numpy as np
+import pandas as pd
+
+import metrics
+from config import PERFORMANCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_current = contextvars.ContextVar('calculator_kernel', default=None)
+_sessions = {}
+_sessions_lock = threading.Lock()
+
+
+def value_size(value):
+    """Approximate memory footprint of a namespace value in bytes"""
+    try:
+        if isinstance(value, pd.DataFrame):
+            return int(value.memory_usage(deep=True).sum())
+        if isinstance(value, (pd.Series, pd.Index)):
+            return int(value.memory_usage(deep=True))
+        if isinstance(value, np.ndarray):
+            return int(value.nbytes)
+        if isinstance(value, (list, tuple, set, dict)):
+            items = value.items() if isinstance(value, dict) else value
+            return sys.getsizeof(value) + sum(sys.getsizeof(i) for i in items)
+        return sys.getsizeof(value)
+    except Exception:
+        return sys.getsizeof(value)
+
+
+class Kernel:
+    """Persistent namespace for the analysis snippets of one turn or session"""
+
+    def __init__(self, session_id=None):
+        self.session_id = session_id
+        self.namespace = {}
+        # Cached snippets whose variables were never bound (tool-cache hits)
+        self.pending = []
+        self.last_used = time.time()
+
+    def bind(self, namespace):
+        """Expose the kernel's variables to a snippet's execution namespace"""
+        namespace.update(self.namespace)
+        self.last_used = time.time()
+        return namespace
+
+    def absorb(self, namespace, base_names):
+        """Keep the user variables a snippet left behind, then enforce the memory caps"""
+        for name, value in namespace.items():
+            if name.startswith('_') or name in base_names:
+                continue
+            if isinstance(value, types.ModuleType):
+                continue
+            self.namespace[name] = value
+        self.enforce_limits()
+
+    def replay_pending(self, namespace):
+        """Execute cached snippets so the variables they define exist; returns True if any ran"""
+        if not self.pending:
+            return False
+        pending, self.pending = self.pending, []
+        base_names = set(namespace)
+        self.bind(namespace)
+        for code in pending:
+            try:
+                exec(code, namespace, namespace)
+            except Exception as e:
+                logger.warning(f"Kernel replay of cached snippet failed: {e}")
+        self.absorb(namespace, base_names)
+        metrics.increment('kernel.replays')
+        return True
+
+    def enforce_limits(self):
+        """Evict oversized values, then the largest ones until under the kernel budget"""
+        sizes = {name: value_size(value) for name, value in self.namespace.items()}
+        for name, size in sizes.items():
+            if size > PERFORMANCE_CONFIG['KERNEL_MAX_VALUE_BYTES']:
+                del self.namespace[name]
+                metrics.increment('kernel.evictions')
+                logger.info(f"Kernel evicted '{name}' ({size} bytes over the per-value limit)")
+        sizes = {name: sizes[name] for name in self.namespace}
+        total = sum(sizes.values())
+        for name in sorted(sizes, key=sizes.get, reverse=True):
+            if total <= PERFORMANCE_CONFIG['KERNEL_MAX_BYTES']:
+                break
+            del self.namespace[name]
+            total -= sizes[name]
+            metrics.increment('kernel.evictions')
+            logger.info(f"Kernel evicted '{name}' ({sizes[name]} bytes) to stay under budget")
+
+    def size(self):
+        return sum(value_size(v) for v in self.namespace.values())
+
+    def close(self):
+        self.namespace.clear()
+        self.pending.clear()
+
+
+def current_kernel():
+    """Kernel of the turn running on this context, if any"""
+    return _current.get()
+
+
+def _session_kernel(session_id):
+    now = time.time()
+    with _sessions_lock:
+        for sid in [s for s, k in _sessions.items() if now - k.last_used > PERFORMANCE_CONFIG['KERNEL_SESSION_TTL']]:
+            _sessions.pop(sid).close()
+        kernel = _sessions.get(session_id)
+        if kernel is None:
+            if len(_sessions) >= PERFORMANCE_CONFIG['KERNEL_MAX_SESSIONS']:
+                oldest = min(_sessions, key=lambda s: _sessions[s].last_used)
+                _sessions.pop(oldest).close()
+            kernel = _sessions[session_id] = Kernel(session_id)
+        return kernel
+
+
+def open_turn(session_id=None):
+    """
+    Activate a kernel for the current turn.
+    With KERNEL_SCOPE 'session' and a session id, the session's kernel is reused.
+    Returns a token for close_turn.
+    """
+    if PERFORMANCE_CONFIG['KERNEL_SCOPE'] == 'off':
+        return None
+    if session_id and PERFORMANCE_CONFIG['KERNEL_SCOPE'] == 'session':
+        kernel = _session_kernel(session_id)
+    else:
+        kernel = Kernel()
+    return _current.set(kernel)
+
+
+def close_turn(token):
+    """Deactivate the turn's kernel; per-turn kernels are torn down"""
+    if token is None:
+        return
+    kernel = _current.get()
+    _current.reset(token)
+    if kernel is not None and kernel.session_id is None:
+        metrics.observe('kernel.turn_bytes', kernel.size())
+        kernel.close()
+
+
+def drop_session(session_id):
+    """Tear down a session kernel (e.g. when its conversation memory is cleared)"""
+    with _sessions_lock:
+        kernel = _sessions.pop(session_id, None)
+    if kernel is not None:
+        kernel.close()
@@ -0,0 +1,495 @@
+"""
+Out-of-core ledger store
+ledger.csv is append-only and by far the largest dataset. With
+PERFORMANCE_CONFIG['LEDGER_OUT_OF_CORE'] on, it is converted into month
+partitions of columnar .npy files under LEDGER_STORE_DIR: Posting_Date as int32
+days, Loan_No and Loan_Product_Type as int32 dictionary codes, amounts as
+float64. Queries prune partitions (and the parts inside them) by Posting_Date
+and stream what remains through memory maps, aggregating part by part, so a
+worker's memory follows LEDGER_CHUNK_ROWS rather than the ledger's history.
+
+Rows appended to the CSV are converted incrementally; any other change
+rebuilds the store. Conversion reads the CSV in chunks too.
+"""
+
+import fcntl
+import hashlib
+import io
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import DATA_CONFIG, PERFORMANCE_CONFIG
+from datasets import DATASET_FILES, load_dataset, on_refresh
+from groupby_kernels import AGGREGATIONS, group_count, group_extreme, group_sum
+
+logger = logging.getLogger(__name__)
+
+CODED_COLUMNS = ['Loan_No', 'Loan_Product_Type']
+AMOUNT_COLUMNS = ['Interest_Paid', 'Principle_Paid', 'Total_Paid']
+COLUMNS = ['Posting_Date'] + CODED_COLUMNS + AMOUNT_COLUMNS
+GROUP_KEYS = ('Posting_Date', 'month') + tuple(CODED_COLUMNS)
+MANIFEST = 'manifest.json'
+DIGEST_BYTES = 4096
+
+_current = {'source': None, 'store': None}
+_lock = threading.Lock()
+
+
+def enabled():
+    return PERFORMANCE_CONFIG['LEDGER_OUT_OF_CORE']
+
+
+def _day_number(value):
+    """ISO date -> days since 1970-01-01 (None passes through)"""
+    if value is None:
+        return None
+    try:
+        return int(np.datetime64(str(value), 'D').astype(np.int64))
+    except ValueError:
+        raise ValueError(f"'{value}' is not a date in YYYY-MM-DD format")
+
+
+def _iso(days):
+    return np.asarray(days, dtype=np.int64).astype('datetime64[D]').astype(str)
+
+
+def _source_state(path):
+    stat = os.stat(path)
+    return {'bytes': stat.st_size, 'mtime_ns': stat.st_mtime_ns}
+
+
+def _tail_digest(path, end):
+    """Digest of the bytes just before `end`, to recognise an appended-to file"""
+    with open(path, 'rb') as handle:
+        handle.seek(max(0, end - DIGEST_BYTES))
+        return hashlib.sha1(handle.read(min(end, DIGEST_BYTES))).hexdigest()
+
+
+class _Capped(io.RawIOBase):
+    """Reads at most `remaining` bytes, so a CSV growing during conversion is not half-read"""
+
+    def __init__(self, handle, remaining):
+        self.handle = handle
+        self.remaining = remaining
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        size = min(len(buffer), self.remaining)
+        if size <= 0:
+            return 0
+        read = self.handle.readinto(memoryview(buffer)[:size])
+        self.remaining -= read
+        return read
+
+
+def _encode(values, dictionary):
+    """int32 codes of a chunk's strings, extending the store-wide dictionary (-1 for missing)"""
+    codes, uniques = pd.factorize(values)
+    mapping = np.array([dictionary.setdefault(str(u), len(dictionary)) for u in uniques], dtype=np.int32)
+    result = np.full(len(codes), -1, dtype=np.int32)
+    valid = codes >= 0
+    result[valid] = mapping[codes[valid]]
+    return result
+
+
+def _write_chunk(directory, manifest, dictionaries, chunk, part_name):
+    """Split a CSV chunk by Posting_Date month and write one part per month"""
+    days = pd.to_datetime(chunk['Posting_Date'], errors='coerce')
+    valid = days.notna().to_numpy()
+    if not valid.all():
+        logger.warning(f"Skipping {int((~valid).sum())} ledger rows without a valid Posting_Date")
+        chunk, days = chunk[valid], days[valid]
+    columns = {'Posting_Date': days.to_numpy(dtype='datetime64[D]').astype(np.int32)}
+    for column in CODED_COLUMNS:
+        columns[column] = _encode(chunk[column], dictionaries[column])
+    for column in AMOUNT_COLUMNS:
+        columns[column] = pd.to_numeric(chunk[column], errors='coerce').to_numpy(dtype=np.float64)
+    order = np.argsort(columns['Posting_Date'], kind='stable')
+    columns = {name: array[order] for name, array in columns.items()}
+
+    months = columns['Posting_Date'].astype('datetime64[D]').astype('datetime64[M]')
+    bounds = np.flatnonzero(np.r_[True, months[1:] != months[:-1], True])
+    for start, end in zip(bounds[:-1], bounds[1:]):
+        month = str(months[start])
+        part_dir = os.path.join(directory, f"month={month}", part_name)
+        os.makedirs(part_dir, exist_ok=True)
+        stats = {}
+        for name, array in columns.items():
+            values = array[start:end]
+            np.save(os.path.join(part_dir, f"{name}.npy"), values)
+            if name in AMOUNT_COLUMNS:
+                present = values[~np.isnan(values)]
+                stats[name] = {
+                    'min': float(present.min()) if len(present) else None,
+                    'max': float(present.max()) if len(present) else None,
+                    'nulls': int(len(values) - len(present)),
+                }
+        partition = manifest['partitions'].setdefault(month, {'rows': 0, 'parts': []})
+        partition['parts'].append({
+            'name': part_name,
+            'rows': int(end - start),
+            'first_day': int(columns['Posting_Date'][start]),
+            'last_day': int(columns['Posting_Date'][end - 1]),
+            'stats': stats,
+        })
+        partition['rows'] += int(end - start)
+    manifest['rows'] += int(len(chunk))
+
+
+def _convert(path, directory, manifest, state, offset=0):
+    """Convert the CSV bytes [offset, state['bytes']) into parts of the next generation"""
+    dictionaries = {c: {v: i for i, v in enumerate(manifest['dictionaries'][c])} for c in CODED_COLUMNS}
+    generation = manifest['generation'] = manifest['generation'] + 1
+    with open(path, 'rb') as handle:
+        handle.seek(offset)
+        capped = io.BufferedReader(_Capped(handle, state['bytes'] - offset))
+        options = {
+            'chunksize': PERFORMANCE_CONFIG['LEDGER_CHUNK_ROWS'],
+            'encoding': DATA_CONFIG['ENCODING'],
+            'dtype': {c: str for c in CODED_COLUMNS + ['Posting_Date']},
+        }
+        if offset:
+            options.update(header=None, names=manifest['header'])
+        for index, chunk in enumerate(pd.read_csv(capped, **options)):
+            if not manifest['header']:
+                manifest['header'] = list(chunk.columns)
+            _write_chunk(directory, manifest, dictionaries, chunk, f"g{generation:04d}-{index:05d}")
+    manifest['dictionaries'] = {c: list(d) for c, d in dictionaries.items()}
+    manifest['source'] = state
+    manifest['tail_digest'] = _tail_digest(path, state['bytes'])
+
+
+def _read_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST)) as handle:
+            return json.load(handle)
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(directory, manifest):
+    temp = os.path.join(directory, f"{MANIFEST}.{os.getpid()}")
+    with open(temp, 'w') as handle:
+        json.dump(manifest, handle)
+    os.replace(temp, os.path.join(directory, MANIFEST))
+
+
+def _is_append(path, manifest, state):
+    old = manifest['source']['bytes']
+    if state['bytes'] <= old or _tail_digest(path, old) != manifest['tail_digest']:
+        return False
+    with open(path, 'rb') as handle:
+        handle.seek(old - 1)
+        return handle.read(1) == b'\n'
+
+
+def sync():
+    """Bring the store up to date with ledger.csv (append or full rebuild); returns the manifest"""
+    directory = PERFORMANCE_CONFIG['LEDGER_STORE_DIR']
+    path = DATASET_FILES['ledger']
+    os.makedirs(os.path.dirname(os.path.abspath(directory)), exist_ok=True)
+    with open(f"{directory}.lock", 'w') as lock:
+        fcntl.flock(lock, fcntl.LOCK_EX)
+        state = _source_state(path)
+        manifest = _read_manifest(directory)
+        if manifest and manifest['source'] == state:
+            return manifest
+        started = time.time()
+        if manifest and _is_append(path, manifest, state):
+            rows_before = manifest['rows']
+            _convert(path, directory, manifest, state, offset=manifest['source']['bytes'])
+            _write_manifest(directory, manifest)
+            logger.info(f"Appended {manifest['rows'] - rows_before} rows to the ledger store in {time.time() - started:.1f}s")
+            return manifest
+
+        build = f"{directory}.build-{os.getpid()}"
+        shutil.rmtree(build, ignore_errors=True)
+        os.makedirs(build)
+        manifest = {'rows': 0, 'generation': 0, 'header': [], 'partitions': {},
+                    'dictionaries': {c: [] for c in CODED_COLUMNS}}
+        _convert(path, build, manifest, state)
+        _write_manifest(build, manifest)
+        retired = f"{directory}.old-{os.getpid()}"
+        if os.path.exists(directory):
+            os.rename(directory, retired)
+        os.rename(build, directory)
+        shutil.rmtree(retired, ignore_errors=True)
+        logger.info(f"Built the ledger store ({manifest['rows']} rows, {len(manifest['partitions'])} months) "
+                    f"in {time.time() - started:.1f}s")
+        return manifest
+
+
+class LedgerStore:
+    """Read side of a manifest: partition pruning, streamed scans and aggregates"""
+
+    def __init__(self, directory, manifest):
+        self.directory = directory
+        self.manifest = manifest
+        self.months = sorted(manifest['partitions'])
+        self.dictionaries = {c: np.array(manifest['dictionaries'][c], dtype=object) for c in CODED_COLUMNS}
+
+    @property
+    def rows(self):
+        return self.manifest['rows']
+
+    def parts(self, first=None, last=None):
+        """(directory, metadata) of the parts that may hold rows posted between day numbers first and last"""
+        first_month = None if first is None else str(np.datetime64(first, 'D').astype('datetime64[M]'))
+        last_month = None if last is None else str(np.datetime64(last, 'D').astype('datetime64[M]'))
+        for month in self.months:
+            if (first_month and month < first_month) or (last_month and month > last_month):
+                continue
+            for part in self.manifest['partitions'][month]['parts']:
+                if (first is not None and part['last_day'] < first) or (last is not None and part['first_day'] > last):
+                    continue
+                yield os.path.join(self.directory, f"month={month}", part['name']), part
+
+    def scan(self, columns=None, date_from=None, date_to=None):
+        """Chunks {column: array} of the rows posted in the range (inclusive), one part at a time"""
+        columns = list(columns or COLUMNS)
+        first, last = _day_number(date_from), _day_number(date_to)
+        for part_dir, part in self.parts(first, last):
+            days = np.load(os.path.join(part_dir, 'Posting_Date.npy'), mmap_mode='r')
+            start = 0 if first is None or part['first_day'] >= first else int(np.searchsorted(days, first, 'left'))
+            end = len(days) if last is None or part['last_day'] <= last else int(np.searchsorted(days, last, 'right'))
+            if start < end:
+                yield {c: np.load(os.path.join(part_dir, f"{c}.npy"), mmap_mode='r')[start:end] for c in columns}
+
+    def _keys(self, by, first, last):
+        """(groups, chunk -> group codes, group codes -> labels) for a group key"""
+        if by in CODED_COLUMNS:
+            labels = self.dictionaries[by]
+            return len(labels), lambda chunk: chunk[by], lambda codes: labels[codes]
+        bounds = [p for m in self.months for p in self.manifest['partitions'][m]['parts']]
+        low = first if first is not None else min((p['first_day'] for p in bounds), default=0)
+        high = last if last is not None else max((p['last_day'] for p in bounds), default=0)
+        if by == 'Posting_Date':
+            return (max(high - low + 1, 0), lambda chunk: chunk['Posting_Date'] - low,
+                    lambda codes: _iso(codes + low))
+        low_month = np.datetime64(low, 'D').astype('datetime64[M]').astype(np.int64)
+        high_month = np.datetime64(high, 'D').astype('datetime64[M]').astype(np.int64)
+
+        def month_codes(chunk):
+            return chunk['Posting_Date'].astype('datetime64[D]').astype('datetime64[M]').astype(np.int64) - low_month
+
+        def month_labels(codes):
+            return (np.asarray(codes) + low_month).astype('datetime64[M]').astype(str)
+        return max(high_month - low_month + 1, 0), month_codes, month_labels
+
+    def summarize(self, by, values=(), date_from=None, date_to=None, dates=False):
+        """
+        One streamed pass: a DataFrame indexed by the group key with 'rows', the sum of each
+        value column and, with dates=True, 'first_date'/'last_date' (ISO) per group.
+        """
+        if by not in GROUP_KEYS:
+            raise ValueError(f"by must be one of: {', '.join(GROUP_KEYS)}")
+        first, last = _day_number(date_from), _day_number(date_to)
+        groups, codes_of, labels_of = self._keys(by, first, last)
+        rows = np.zeros(groups, dtype=np.int64)
+        sums = {value: np.zeros(groups) for value in values}
+        first_day = np.full(groups, np.nan)
+        last_day = np.full(groups, np.nan)
+        for chunk in self.scan(list(values) + ['Posting_Date'] + ([by] if by in CODED_COLUMNS else []), date_from, date_to):
+            codes = np.asarray(codes_of(chunk), dtype=np.int64)
+            rows += group_count(codes, groups)
+            for value in values:
+                sums[value] += group_sum(codes, np.asarray(chunk[value]), groups)
+            if dates:
+                days = np.asarray(chunk['Posting_Date'], dtype=np.float64)
+                first_day = np.fmin(first_day, group_extreme(codes, days, groups, np.minimum))
+                last_day = np.fmax(last_day, group_extreme(codes, days, groups, np.maximum))
+        present = np.flatnonzero(rows)
+        frame = pd.DataFrame({'rows': rows[present], **{value: sums[value][present] for value in values}},
+                             index=pd.Index(labels_of(present), name=by))
+        if dates:
+            frame['first_date'] = _iso(first_day[present])
+            frame['last_date'] = _iso(last_day[present])
+        # Dictionary codes follow first appearance; sort like a pandas group-by
+        return frame.sort_index() if by in CODED_COLUMNS else frame
+
+    def aggregate(self, by, value=None, agg='sum', date_from=None, date_to=None):
+        """Streamed df.groupby(by)[value].agg(); by may also be 'month'. A Series sorted by key."""
+        if agg not in AGGREGATIONS:
+            raise ValueError(f"agg must be one of: {', '.join(AGGREGATIONS)}")
+        if value is None and agg not in ('count', 'size'):
+            raise ValueError(f"agg '{agg}' needs a value column")
+        if value is not None and value not in AMOUNT_COLUMNS:
+            raise ValueError(f"value must be one of: {', '.join(AMOUNT_COLUMNS)}")
+        if by not in GROUP_KEYS:
+            raise ValueError(f"by must be one of: {', '.join(GROUP_KEYS)}")
+        first, last = _day_number(date_from), _day_number(date_to)
+        groups, codes_of, labels_of = self._keys(by, first, last)
+        rows = np.zeros(groups, dtype=np.int64)
+        counted = np.zeros(groups, dtype=np.int64)
+        total = np.zeros(groups)
+        extreme = np.full(groups, np.nan)
+        columns = ['Posting_Date'] + ([by] if by in CODED_COLUMNS else []) + ([value] if value else [])
+        for chunk in self.scan(columns, date_from, date_to):
+            codes = np.asarray(codes_of(chunk), dtype=np.int64)
+            rows += group_count(codes, groups)
+            if value is None:
+                continue
+            values = np.asarray(chunk[value])
+            counted += group_count(np.where(np.isnan(values), -1, codes), groups)
+            if agg in ('sum', 'mean'):
+                total += group_sum(codes, values, groups)
+            elif agg in ('min', 'max'):
+                ufunc, combine = (np.maximum, np.fmax) if agg == 'max' else (np.minimum, np.fmin)
+                extreme = combine(extreme, group_extreme(codes, values, groups, ufunc))
+        if agg == 'size' or (agg == 'count' and value is None):
+            result = rows
+        elif agg == 'count':
+            result = counted
+        elif agg == 'sum':
+            result = total
+        elif agg == 'mean':
+            with np.errstate(invalid='ignore', divide='ignore'):
+                result = np.where(counted > 0, total / counted, np.nan)
+        else:
+            result = extreme
+        present = np.flatnonzero(rows)
+        series = pd.Series(result[present], index=pd.Index(labels_of(present), name=by), name=value or agg)
+        return series.sort_index() if by in CODED_COLUMNS else series
+
+    def column_stats(self):
+        """{column: {'nulls', 'distinct', 'min', 'max'}} from the manifest, plus 'labels' for coded columns"""
+        parts = [part for month in self.months for part in self.manifest['partitions'][month]['parts']]
+        stats = {'Posting_Date': {
+            'nulls': 0,
+            'min': str(_iso([min(p['first_day'] for p in parts)])[0]) if parts else None,
+            'max': str(_iso([max(p['last_day'] for p in parts)])[0]) if parts else None,
+        }}
+        for column in CODED_COLUMNS:
+            labels = sorted(self.dictionaries[column])
+            stats[column] = {'nulls': None, 'distinct': len(labels), 'labels': labels}
+        for column in AMOUNT_COLUMNS:
+            present = [p['stats'][column] for p in parts if p['stats'][column]['min'] is not None]
+            stats[column] = {
+                'nulls': sum(p['stats'][column]['nulls'] for p in parts),
+                'min': min((s['min'] for s in present), default=None),
+                'max': max((s['max'] for s in present), default=None),
+            }
+        return stats
+
+    def frame(self, date_from=None, date_to=None, loan_nos=None):
+        """Rows posted in the range (optionally only for some loans) as a ledger.csv-like DataFrame"""
+        wanted = None
+        if loan_nos is not None:
+            lookup = {loan: code for code, loan in enumerate(self.dictionaries['Loan_No'])}
+            wanted = np.array([lookup[l] for l in ([loan_nos] if isinstance(loan_nos, str) else loan_nos) if l in lookup])
+        chunks = []
+        for chunk in self.scan(COLUMNS, date_from, date_to):
+            if wanted is not None:
+                keep = np.isin(chunk['Loan_No'], wanted)
+                chunk = {c: a[keep] for c, a in chunk.items()}
+            chunks.append({c: np.array(a) for c, a in chunk.items()})
+        data = {c: np.concatenate([chunk[c] for chunk in chunks]) if chunks else np.array([]) for c in COLUMNS}
+        frame = pd.DataFrame({'Posting_Date': _iso(data['Posting_Date'])})
+        for column in CODED_COLUMNS:
+            # Code -1 (missing) picks the trailing NaN
+            frame[column] = np.append(self.dictionaries[column], np.nan)[data[column].astype(np.int64)]
+        for column in AMOUNT_COLUMNS:
+            frame[column] = data[column].astype(np.float64)
+        return frame[[c for c in self.manifest['header'] if c in frame.columns] or COLUMNS]
+
+    def recent(self, loan_groups, limit, expected=None):
+        """
+        The newest `limit` payments per group, where loan_groups maps Loan_No to a group
+        label (e.g. a Client_Code): {label: [(date, loan_no, total_paid), ...] newest first}.
+        Scans months newest first and stops once every group in `expected`
+        ({label: payment count}) has min(limit, count) rows.
+        """
+        labels = sorted(set(loan_groups.values()))
+        label_index = {label: i for i, label in enumerate(labels)}
+        group_of_code = np.array(
+            [label_index.get(loan_groups.get(loan), -1) for loan in self.dictionaries['Loan_No']] + [-1], dtype=np.int64
+        )
+        wanted = np.zeros(len(labels), dtype=np.int64)
+        for label, count in (expected or {}).items():
+            if label in label_index:
+                wanted[label_index[label]] = min(limit, count)
+
+        names = ('group', 'day', 'position', 'loan', 'paid')
+        kept = {name: np.array([], dtype=np.float64 if name == 'paid' else np.int64) for name in names}
+        position = 0
+        for month in reversed(self.months):
+            start = np.datetime64(month, 'M')
+            month_end = str((start + 1).astype('datetime64[D]') - 1)
+            for chunk in self.scan(['Posting_Date', 'Loan_No', 'Total_Paid'], str(start.astype('datetime64[D]')), month_end):
+                groups = group_of_code[np.asarray(chunk['Loan_No'], dtype=np.int64)]
+                keep = groups >= 0
+                # File order breaks ties on the same day: later rows are newer
+                added = {
+                    'group': groups[keep],
+                    'day': np.asarray(chunk['Posting_Date'], dtype=np.int64)[keep],
+                    'position': position + np.flatnonzero(keep),
+                    'loan': np.asarray(chunk['Loan_No'], dtype=np.int64)[keep],
+                    'paid': np.asarray(chunk['Total_Paid'], dtype=np.float64)[keep],
+                }
+                kept = {name: np.concatenate([kept[name], added[name]]) for name in names}
+                position += len(groups)
+            if not len(kept['group']):
+                continue
+            # Newest first within each group, then keep the first `limit` of each
+            order = np.lexsort((-kept['position'], -kept['day'], kept['group']))
+            kept = {name: array[order] for name, array in kept.items()}
+            starts = np.flatnonzero(np.r_[True, kept['group'][1:] != kept['group'][:-1]])
+            rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.r_[starts, len(order)]))
+            kept = {name: array[rank < limit] for name, array in kept.items()}
+            if expected is not None and (np.bincount(kept['group'], minlength=len(labels)) >= wanted).all():
+                break
+
+        result = {}
+        for group, day, loan, paid in zip(kept['group'], _iso(kept['day']), kept['loan'], kept['paid']):
+            result.setdefault(labels[group], []).append((day, self.dictionaries['Loan_No'][loan], float(paid)))
+        return result
+
+
+def get_store():
+    """The store for the current ledger.csv, converting it first if needed"""
+    state = _source_state(DATASET_FILES['ledger'])
+    if _current['source'] != state:
+        with _lock:
+            if _current['source'] != state:
+                manifest = sync()
+                _current.update({'source': manifest['source'], 'store': LedgerStore(PERFORMANCE_CONFIG['LEDGER_STORE_DIR'], manifest)})
+    return _current['store']
+
+
+@on_refresh
+def _refresh(version):
+    if enabled():
+        get_store()
+
+
+def ledger_query(date_from=None, date_to=None, loan_no=None):
+    """
+    python_calculator helper: ledger rows posted from date_from to date_to (inclusive,
+    YYYY-MM-DD, either may be None), optionally for one Loan_No or a list of them.
+    Reads only the matching month partitions in out-of-core mode.
+    """
+    if loan_no is not None and not isinstance(loan_no, str):
+        loan_no = list(loan_no)
+        if len(loan_no) == 1 and not isinstance(loan_no[0], str):
+            # python_calculator rewrites ['a', 'b'] to [['a', 'b']]
+            loan_no = list(loan_no[0])
+    if enabled():
+        return get_store().frame(date_from, date_to, loan_no)
+    ledger = load_dataset('ledger')
+    mask = np.ones(len(ledger), dtype=bool)
+    if date_from:
+        mask &= (ledger['Posting_Date'] >= str(np.datetime64(date_from, 'D'))).to_numpy()
+    if date_to:
+        mask &= (ledger['Posting_Date'] <= str(np.datetime64(date_to, 'D'))).to_numpy()
+    if loan_no is not None:
+        mask &= ledger['Loan_No'].isin([loan_no] if isinstance(loan_no, str) else loan_no).to_numpy()
+    return ledger[mask].reset_index(drop=True)
@@ -0,0 +1,232 @@
+#!/usr/bin/env python3
+"""
+Per-worker memory accounting
+Breaks a worker's RSS down by component: the loaded DataFrames
+(memory_usage(deep=True)), the conversation memory, and, when tracemalloc is
+tracing (start the server with PYTHONTRACEMALLOC=8), the Python allocations
+grouped by the package that made them: langchain, pandas, numpy, this app's
+modules and so on. An allocation counts towards the innermost non-stdlib frame
+of its traceback, so what a package's imports pull in is charged to it.
+/api/memory/report serves report() for the worker that answers.
+
+Run as a script it measures a fresh process stage by stage (libraries,
+datasets, the agent, the precomputed views) and prints the RSS each stage adds.
+Tracing roughly doubles what imports cost; --no-trace gives the real deltas.
+
+Usage: python memory_report.py [--compact] [--no-trace] [--top N] [--json]
+"""
+
+import argparse
+import json
+import os
+import resource
+import sys
+import sysconfig
+import time
+import tracemalloc
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+STDLIB = sysconfig.get_paths()['stdlib']
+MB = 1024 * 1024
+# Traceback depth the CLI traces with; deeper attributes import-time allocations better
+TRACE_FRAMES = 8
+
+
+def _status_mb(field):
+    """VmRSS / VmHWM of this process from /proc (Linux); None elsewhere"""
+    try:
+        with open('/proc/self/status') as handle:
+            for line in handle:
+                if line.startswith(field + ':'):
+                    return round(int(line.split()[1]) / 1024, 1)
+    except OSError:
+        pass
+    return None
+
+
+def rss_mb():
+    """Current resident set size in MB (None where /proc is not available)"""
+    return _status_mb('VmRSS')
+
+
+def peak_rss_mb():
+    """Peak resident set size in MB"""
+    peak = _status_mb('VmHWM')
+    if peak is None:
+        # ru_maxrss is in kilobytes on Linux and bytes on macOS
+        peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (MB if sys.platform == 'darwin' else 1024)
+    return round(peak, 1)
+
+
+def _mb(size):
+    return round(size / MB, 2)
+
+
+def dataset_usage():
+    """Deep memory of each DataFrame this process holds, with its largest columns"""
+    # Imported here so gunicorn_config can use rss_mb() without loading pandas
+    from datasets import loaded_frames
+    frames = {}
+    for name, frame in loaded_frames().items():
+        columns = frame.memory_usage(deep=True, index=False)
+        frames[name] = {
+            'rows': len(frame),
+            'mb': _mb(columns.sum() + frame.index.memory_usage(deep=True)),
+            'largest_columns': {c: _mb(size) for c, size in columns.sort_values(ascending=False).head(5).items()},
+        }
+    return {'total_mb': round(sum(f['mb'] for f in frames.values()), 2), 'frames': frames}
+
+
+def conversation_usage():
+    """Messages held by the agent's ConversationBufferMemory (if the agent is loaded in this process)"""
+    utils_simple = sys.modules.get('utils_simple')
+    if utils_simple is None:
+        return None
+    messages = utils_simple.get_conversation_memory()
+    size = sum(sys.getsizeof(m) + sys.getsizeof(m.content) for m in messages)
+    return {'messages': len(messages), 'mb': _mb(size)}
+
+
+def _file_package(filename):
+    """Top-level package (or app module) an allocation's source file belongs to"""
+    if filename.startswith(ROOT + os.sep):
+        return 'app:' + os.path.relpath(filename, ROOT).split(os.sep)[0].removesuffix('.py')
+    for marker in ('site-packages' + os.sep, 'dist-packages' + os.sep):
+        if marker in filename:
+            return filename.split(marker, 1)[1].split(os.sep)[0].removesuffix('.py')
+    if filename.startswith(STDLIB) or filename.startswith('<frozen'):
+        return 'stdlib'
+    return 'other'
+
+
+def _package(traceback, names):
+    """Package of the innermost frame outside the standard library ('stdlib' if there is none)"""
+    for frame in reversed(traceback):
+        package = names.get(frame.filename)
+        if package is None:
+            package = names[frame.filename] = _file_package(frame.filename)
+        if package != 'stdlib':
+            return package
+    return 'stdlib'
+
+
+def allocation_usage(top=15):
+    """Traced Python allocations by package, largest first; None unless tracemalloc is tracing"""
+    if not tracemalloc.is_tracing():
+        return None
+    packages, names = {}, {}
+    for stat in tracemalloc.take_snapshot().statistics('traceback'):
+        package = _package(stat.traceback, names)
+        packages[package] = packages.get(package, 0) + stat.size
+    ranked = sorted(packages.items(), key=lambda item: item[1], reverse=True)
+    traced, _ = tracemalloc.get_traced_memory()
+    return {
+        'traced_mb': _mb(traced),
+        'tracemalloc_overhead_mb': _mb(tracemalloc.get_tracemalloc_memory()),
+        'packages': {package: _mb(size) for package, size in ranked[:top]},
+        'other_packages_mb': _mb(sum(size for _, size in ranked[top:])),
+    }
+
+
+def report(top=15):
+    """RSS of this process and what it is spent on"""
+    datasets = dataset_usage()
+    allocations = allocation_usage(top)
+    rss = rss_mb()
+    # Traced allocations include the DataFrames, so only one of the two is subtracted
+    accounted = allocations['traced_mb'] if allocations else datasets['total_mb']
+    return {
+        'pid': os.getpid(),
+        'rss_mb': rss,
+        'peak_rss_mb': peak_rss_mb(),
+        'datasets': datasets,
+        'conversation_memory': conversation_usage(),
+        'allocations': allocations,
+        'modules_loaded': len(sys.modules),
+        'unaccounted_mb': round(rss - accounted, 1) if rss is not None else None,
+    }
+
+
+def _stages():
+    """(name, callable) steps that build up a worker the way the app does"""
+    def libraries():
+        import numpy  # noqa: F401
+        import pandas  # noqa: F401
+
+    def langchain():
+        import langchain.agents  # noqa: F401
+        import langchain.memory  # noqa: F401
+        import langchain_community  # noqa: F401
+
+    def datasets():
+        from datasets import DATASET_FILES, load_dataset
+        for name in DATASET_FILES:
+            load_dataset(name)
+
+    def agent():
+        import utils_simple  # noqa: F401
+
+    def views():
+        import datasets
+        import client_profiles  # noqa: F401 - registers its refresh hook
+        import data_profile  # noqa: F401 - registers its refresh hook
+        import groupby_kernels  # noqa: F401 - registers its refresh hook
+        import installment_calendar  # noqa: F401 - registers its refresh hook
+        import par_engine  # noqa: F401 - registers its refresh hook
+        datasets.check_for_refresh()
+
+    return [
+        ('pandas + numpy', libraries),
+        ('langchain', langchain),
+        ('datasets', datasets),
+        ('agent (utils_simple)', agent),
+        ('precomputed views', views),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--compact', action='store_true', help="load datasets with PERFORMANCE_CONFIG['COMPACT_DATASETS']")
+    parser.add_argument('--no-trace', action='store_true', help='skip tracemalloc (no per-package breakdown, less overhead)')
+    parser.add_argument('--top', type=int, default=15, help='packages listed in the allocation breakdown')
+    parser.add_argument('--json', action='store_true', help='print the final report as JSON')
+    args = parser.parse_args()
+
+    if not args.no_trace:
+        tracemalloc.start(TRACE_FRAMES)
+    from config import PERFORMANCE_CONFIG
+    PERFORMANCE_CONFIG['COMPACT_DATASETS'] = args.compact
+
+    previous = rss_mb()
+    print(f"{'stage':<24}{'seconds':>9}{'+RSS MB':>10}{'RSS MB':>9}")
+    print(f"{'interpreter':<24}{'':>9}{'':>10}{previous:>9.1f}")
+    for name, step in _stages():
+        started = time.time()
+        try:
+            step()
+        except ImportError as e:
+            print(f"{name:<24} skipped ({e})")
+            continue
+        current = rss_mb()
+        print(f"{name:<24}{time.time() - started:>9.2f}{current - previous:>10.1f}{current:>9.1f}")
+        previous = current
+
+    result = report(args.top)
+    if args.json:
+        print(json.dumps(result, indent=2))
+        return
+    print(f"\nDataFrames (deep): {result['datasets']['total_mb']} MB")
+    for name, frame in result['datasets']['frames'].items():
+        print(f"  {name:<16}{frame['rows']:>9,} rows {frame['mb']:>8.2f} MB")
+    if result['allocations']:
+        allocations = result['allocations']
+        print(f"\nTraced Python allocations: {allocations['traced_mb']} MB "
+              f"(tracemalloc itself: {allocations['tracemalloc_overhead_mb']} MB)")
+        for package, size in allocations['packages'].items():
+            print(f"  {package:<28}{size:>8.2f} MB")
+    print(f"\nRSS {result['rss_mb']} MB, peak {result['peak_rss_mb']} MB, "
+          f"{result['unaccounted_mb']} MB outside the breakdown (native libraries, allocator slack)")
+
+
+if __name__ == "__main__":
+    main()
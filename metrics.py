@@ -0,0 +1,62 @@
+"""
+In-process metrics for the Brightcom Loan Assistant
+Thread-safe counters and value observations, exposed through /api/metrics.
+Each gunicorn worker keeps its own registry.
+"""
+
+import threading
+import time
+
+_lock = threading.Lock()
+_counters = {}
+_observations = {}
+_started = time.time()
+
+
+def increment(name, amount=1):
+    """Add to a named counter"""
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + amount
+
+
+def observe(name, value):
+    """Record a value (latency, iterations, ...) into a count/sum/min/max summary"""
+    with _lock:
+        summary = _observations.get(name)
+        if summary is None:
+            _observations[name] = {'count': 1, 'sum': value, 'min': value, 'max': value}
+        else:
+            summary['count'] += 1
+            summary['sum'] += value
+            summary['min'] = min(summary['min'], value)
+            summary['max'] = max(summary['max'], value)
+
+
+def ratio(numerator, denominator):
+    """Safe ratio of two counters"""
+    with _lock:
+        total = _counters.get(denominator, 0)
+        return round(_counters.get(numerator, 0) / total, 4) if total else 0.0
+
+
+def snapshot():
+    """Copy of all counters and observation summaries"""
+    with _lock:
+        observations = {
+            name: dict(summary, mean=round(summary['sum'] / summary['count'], 4))
+            for name, summary in _observations.items()
+        }
+        return {
+            'counters': dict(_counters),
+            'observations': observations,
+            'since': _started
+        }
+
+
+def reset():
+    """Clear all metrics"""
+    global _started
+    with _lock:
+        _counters.clear()
+        _observations.clear()
+        _started = time.time()
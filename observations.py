@@ -0,0 +1,218 @@
+"""
+Observation shaper for tool results fed back into the LLM context
+Keeps python_calculator observations within a token budget: large DataFrames,
+Series and collections are summarized (shape, head/tail sample, statistics)
+and the full result is parked under a handle id, so it can be fetched later
+for rendering or export without going back through the LLM.
+"""
+
+import json
+import logging
+import os
+import pickle
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+
+import pandas as pd
+
+import metrics
+from config import AI_CONFIG, PERFORMANCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+HANDLE_PATTERN = re.compile(r'^r[0-9a-f]{12}$')
+HANDLE_TAG_PATTERN = re.compile(r'\[handle: r[0-9a-f]{12}\]')
+CHARS_PER_TOKEN = 4
+
+_handles = OrderedDict()
+_lock = threading.Lock()
+
+
+def estimate_tokens(text):
+    """Rough token count (Mistral averages ~4 characters per token on this data)"""
+    return len(text) // CHARS_PER_TOKEN + 1
+
+
+def _handles_dir():
+    return os.path.join(PERFORMANCE_CONFIG['CACHE_DIR'], 'results')
+
+
+def store_result(value):
+    """Park a full result and return its handle id"""
+    handle_id = 'r' + uuid.uuid4().hex[:12]
+    with _lock:
+        _handles[handle_id] = value
+        while len(_handles) > PERFORMANCE_CONFIG['RESULT_HANDLE_MEMORY_SIZE']:
+            _handles.popitem(last=False)
+    # On disk as well, so any worker can serve the handle
+    try:
+        os.makedirs(_handles_dir(), exist_ok=True)
+        with open(os.path.join(_handles_dir(), f"{handle_id}.pkl"), 'wb') as f:
+            pickle.dump(value, f)
+        _prune_handles()
+    except Exception as e:
+        logger.warning(f"Could not persist result handle {handle_id}: {e}")
+    return handle_id
+
+
+def _prune_handles():
+    cutoff = time.time() - PERFORMANCE_CONFIG['RESULT_HANDLE_TTL']
+    for name in os.listdir(_handles_dir()):
+        path = os.path.join(_handles_dir(), name)
+        try:
+            if os.path.getmtime(path) < cutoff:
+                os.remove(path)
+        except OSError:
+            pass
+
+
+def fetch_result(handle_id):
+    """Full result for a handle id, or None if unknown/expired"""
+    if not HANDLE_PATTERN.match(handle_id or ''):
+        return None
+    with _lock:
+        if handle_id in _handles:
+            return _handles[handle_id]
+    path = os.path.join(_handles_dir(), f"{handle_id}.pkl")
+    try:
+        with open(path, 'rb') as f:
+            return pickle.load(f)
+    except (OSError, pickle.UnpicklingError, EOFError):
+        return None
+
+
+def to_payload(value, offset=0, limit=None):
+    """JSON-ready representation of a stored result, optionally paginated"""
+    if isinstance(value, pd.Series):
+        value = value.to_frame()
+    if isinstance(value, pd.DataFrame):
+        rows = value.iloc[offset:offset + limit if limit else None]
+        return {
+            'type': 'dataframe',
+            'total_rows': len(value),
+            'columns': [str(c) for c in value.columns],
+            'index': [str(i) for i in rows.index],
+            'rows': json.loads(rows.to_json(orient='records', date_format='iso'))
+        }
+    if isinstance(value, dict):
+        items = list(value.items())[offset:offset + limit if limit else None]
+        return {'type': 'dict', 'total_rows': len(value), 'rows': json.loads(json.dumps(dict(items), default=str))}
+    if isinstance(value, (list, tuple)):
+        items = list(value)[offset:offset + limit if limit else None]
+        return {'type': 'list', 'total_rows': len(value), 'rows': json.loads(json.dumps(items, default=str))}
+    return {'type': type(value).__name__, 'total_rows': 1, 'rows': str(value)}
+
+
+def _frame_summary(frame, sample_rows):
+    parts = [f"DataFrame with {frame.shape[0]} rows x {frame.shape[1]} columns: {list(map(str, frame.columns))}"]
+    if len(frame) > sample_rows * 2:
+        parts.append(f"head({sample_rows}): {frame.head(sample_rows).to_dict(orient='records')}")
+        parts.append(f"tail({sample_rows}): {frame.tail(sample_rows).to_dict(orient='records')}")
+    else:
+        parts.append(f"rows: {frame.to_dict(orient='records')}")
+    numeric = frame.select_dtypes('number')
+    if not numeric.empty:
+        stats = numeric.agg(['sum', 'mean', 'min', 'max']).round(2)
+        parts.append(f"numeric summary: {stats.to_dict()}")
+    return "\n".join(parts)
+
+
+def _series_summary(series, sample_rows):
+    parts = [f"Series '{series.name}' with {len(series)} values (dtype {series.dtype})"]
+    if len(series) > sample_rows * 2:
+        parts.append(f"head({sample_rows}): {series.head(sample_rows).to_dict()}")
+        parts.append(f"tail({sample_rows}): {series.tail(sample_rows).to_dict()}")
+    else:
+        parts.append(f"values: {series.to_dict()}")
+    if pd.api.types.is_numeric_dtype(series):
+        parts.append(
+            f"sum={series.sum():.2f}, mean={series.mean():.2f}, min={series.min():.2f}, max={series.max():.2f}"
+        )
+    else:
+        parts.append(f"distinct values: {series.nunique()}")
+    return "\n".join(parts)
+
+
+def _collection_summary(value, sample_rows):
+    if isinstance(value, dict):
+        items = list(value.items())
+        head = dict(items[:sample_rows])
+        tail = dict(items[-sample_rows:])
+        text = f"dict with {len(items)} entries\nfirst {sample_rows}: {head}\nlast {sample_rows}: {tail}"
+        values = pd.to_numeric(pd.Series(dict(items)), errors='coerce')
+        if values.notna().all():
+            largest = values.nlargest(sample_rows).round(2).to_dict()
+            text += f"\nlargest {sample_rows}: {largest}\nsum={values.sum():.2f}, mean={values.mean():.2f}, min={values.min():.2f}, max={values.max():.2f}"
+        return text
+    items = list(value)
+    return (
+        f"{type(value).__name__} with {len(items)} items\n"
+        f"first {sample_rows}: {items[:sample_rows]}\nlast {sample_rows}: {items[-sample_rows:]}"
+    )
+
+
+def _summarize(value, sample_rows):
+    if isinstance(value, pd.DataFrame):
+        return _frame_summary(value, sample_rows)
+    if isinstance(value, pd.Series):
+        return _series_summary(value, sample_rows)
+    if isinstance(value, (dict, list, tuple)) and len(value) > sample_rows * 2:
+        return _collection_summary(value, sample_rows)
+    return None
+
+
+def has_handle(observation):
+    """Whether a shaped observation refers to a parked result (which expires after RESULT_HANDLE_TTL)"""
+    return bool(HANDLE_TAG_PATTERN.search(str(observation)))
+
+
+def shape_observation(value):
+    """
+    Render a tool result for the LLM within AI_CONFIG['OBSERVATION_TOKEN_BUDGET'].
+    Results over budget, and pandas objects over OBSERVATION_MAX_ROWS, are
+    summarized and tagged with "[handle: <id>]".
+    """
+    budget = AI_CONFIG['OBSERVATION_TOKEN_BUDGET']
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        # str() of a large frame is pandas' own elided display ("..."), so judge by rows
+        if len(value) > AI_CONFIG['OBSERVATION_MAX_ROWS']:
+            text = f"{type(value).__name__} with {len(value)} rows"
+            budget_exceeded = True
+        else:
+            text = value.to_string()
+            budget_exceeded = estimate_tokens(text) > budget
+    else:
+        text = str(value)
+        budget_exceeded = estimate_tokens(text) > budget
+    if not budget_exceeded:
+        return text
+
+    if isinstance(value, str):
+        # Printed json.dumps output summarizes like the dict/list it encodes
+        try:
+            value = json.loads(value)
+        except ValueError:
+            pass
+
+    handle_id = store_result(value)
+    summary = None
+    for sample_rows in (5, 3, 1):
+        try:
+            summary = _summarize(value, sample_rows)
+        except Exception as e:
+            logger.warning(f"Could not summarize {type(value).__name__} result: {e}")
+            summary = None
+        if summary is None or estimate_tokens(summary) <= budget:
+            break
+    if summary is None:
+        summary = text
+    if estimate_tokens(summary) > budget:
+        keep = budget * CHARS_PER_TOKEN // 2
+        summary = f"{summary[:keep]}\n... [{len(summary) - 2 * keep} characters omitted] ...\n{summary[-keep:]}"
+
+    metrics.increment('observations.shaped')
+    logger.info(f"Shaped {type(value).__name__} observation to ~{estimate_tokens(summary)} tokens (handle {handle_id})")
+    return f"{summary}\n[handle: {handle_id}]"
@@ -0,0 +1,276 @@
+"""
+Minimal Ollama HTTP client
+Talks to the Ollama REST API directly for features the LangChain wrapper
+doesn't expose (JSON/structured output formats, keep_alive, token counts).
+Requests are spread over the backends in AI_CONFIG['OLLAMA_BACKENDS']: least
+outstanding requests first, with cached health probes, a circuit breaker per
+backend, and sticky routing per conversation so Ollama can reuse its KV cache.
+"""
+
+import contextvars
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+import requests
+
+import metrics
+import scheduler
+from config import AI_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_session = contextvars.ContextVar('ollama_session', default=None)
+
+
+class OllamaError(Exception):
+    """Raised when the Ollama server is unreachable or rejects a request"""
+
+
+class Backend:
+    """One Ollama server with its load, health and breaker state"""
+
+    def __init__(self, url):
+        self.url = url.rstrip('/')
+        self.outstanding = 0
+        self.failures = 0          # Consecutive timeouts / connection errors
+        self.open_until = 0.0      # Breaker open (backend skipped) until this time
+        self.trial = False         # Half-open: the one trial request is in flight
+        self.healthy = True
+        self.checked_at = 0.0
+
+    def breaker_open(self, now):
+        return now < self.open_until
+
+    def half_open(self, now):
+        return bool(self.open_until) and not self.breaker_open(now)
+
+    def status(self):
+        now = time.time()
+        return {
+            'url': self.url,
+            'healthy': self.healthy,
+            'outstanding': self.outstanding,
+            'consecutive_failures': self.failures,
+            'breaker': 'open' if self.breaker_open(now) else ('half-open' if self.open_until else 'closed'),
+            'checked_seconds_ago': round(now - self.checked_at, 1) if self.checked_at else None
+        }
+
+
+_backends = [Backend(url) for url in AI_CONFIG['OLLAMA_BACKENDS']]
+_sticky = OrderedDict()
+_lock = threading.Lock()
+
+
+def set_session(key):
+    """Send this context's requests to one backend while it stays available; returns a reset token"""
+    return _session.set(key)
+
+
+def reset_session(token):
+    _session.reset(token)
+
+
+def _probe(backend):
+    """Cached health of a backend (GET /api/tags), refreshed after OLLAMA_HEALTH_TTL seconds"""
+    now = time.time()
+    if now - backend.checked_at < AI_CONFIG['OLLAMA_HEALTH_TTL']:
+        return backend.healthy
+    try:
+        response = requests.get(f"{backend.url}/api/tags", timeout=AI_CONFIG['OLLAMA_HEALTH_TIMEOUT'])
+        healthy = response.status_code == 200
+    except requests.exceptions.RequestException:
+        healthy = False
+    if healthy != backend.healthy:
+        logger.warning(f"Ollama backend {backend.url} is now {'healthy' if healthy else 'unhealthy'}")
+    backend.healthy = healthy
+    backend.checked_at = now
+    return healthy
+
+
+def _acquire(exclude):
+    """Pick a backend: the conversation's sticky one if available, else the least loaded"""
+    now = time.time()
+    closed = [b for b in _backends if b not in exclude and not b.breaker_open(now) and not b.trial]
+    # A failed probe may be stale: with no healthy backend left, still try the closed ones
+    candidates = [b for b in closed if _probe(b)] or closed
+    if not candidates:
+        return None
+    session = _session.get()
+    with _lock:
+        # A half-open backend takes a single trial request until it answers or fails again
+        candidates = [b for b in candidates if not b.trial]
+        if not candidates:
+            return None
+        backend = _sticky.get(session) if session else None
+        if backend not in candidates:
+            backend = min(candidates, key=lambda b: b.outstanding)
+        if backend.half_open(now):
+            backend.trial = True
+        if session:
+            _sticky[session] = backend
+            _sticky.move_to_end(session)
+            while len(_sticky) > AI_CONFIG['OLLAMA_STICKY_SESSIONS']:
+                _sticky.popitem(last=False)
+        backend.outstanding += 1
+    return backend
+
+
+def _release(backend, failed):
+    with _lock:
+        backend.outstanding -= 1
+        backend.trial = False
+        if not failed:
+            if backend.open_until:
+                logger.info(f"Ollama backend {backend.url} recovered, closing its breaker")
+            backend.failures = 0
+            backend.open_until = 0.0
+            return
+        backend.failures += 1
+        if backend.failures >= AI_CONFIG['OLLAMA_BREAKER_THRESHOLD']:
+            # After the cooldown one trial request is let through (half-open); its failure reopens the breaker
+            backend.open_until = time.time() + AI_CONFIG['OLLAMA_BREAKER_COOLDOWN']
+            metrics.increment('ollama.breaker_trips')
+            logger.error(
+                f"Ollama backend {backend.url} failed {backend.failures} times in a row, "
+                f"skipping it for {AI_CONFIG['OLLAMA_BREAKER_COOLDOWN']}s"
+            )
+
+
+def _post(path, payload):
+    if AI_CONFIG.get('KEEP_ALIVE'):
+        # Keep the model resident between requests instead of reloading it
+        payload.setdefault('keep_alive', AI_CONFIG['KEEP_ALIVE'])
+    # Wait for a generation slot by priority class before picking a backend
+    with scheduler.slot('llm'):
+        return _post_to_backends(path, payload)
+
+
+def _post_to_backends(path, payload):
+    tried = []
+    last_error = None
+    while len(tried) < len(_backends):
+        backend = _acquire(tried)
+        if backend is None:
+            break
+        tried.append(backend)
+        try:
+            response = requests.post(
+                f"{backend.url}{path}", json=payload,
+                timeout=(AI_CONFIG['OLLAMA_CONNECT_TIMEOUT'], AI_CONFIG['TIMEOUT_SECONDS'])
+            )
+            response.raise_for_status()
+            data = response.json()
+        except requests.exceptions.ReadTimeout as e:
+            # The backend took the request and hung: it counts toward the breaker, but retrying
+            # elsewhere would make the caller wait another full TIMEOUT_SECONDS
+            _release(backend, failed=True)
+            raise OllamaError(f"Ollama backend {backend.url} timed out on {path}: {e}") from e
+        except requests.exceptions.ConnectionError as e:
+            # Unreachable (including connect timeouts): nothing was generated, try the next one
+            _release(backend, failed=True)
+            metrics.increment('ollama.failovers')
+            last_error = e
+            logger.warning(f"Ollama backend {backend.url} failed on {path}: {e}")
+            continue
+        except requests.exceptions.HTTPError as e:
+            if e.response is not None and e.response.status_code >= 500:
+                # The server is up but failing (model load error, out of memory): trip the breaker, try the next
+                _release(backend, failed=True)
+                metrics.increment('ollama.failovers')
+                last_error = e
+                logger.warning(f"Ollama backend {backend.url} failed on {path}: {e}")
+                continue
+            # 4xx: the request itself is wrong, another backend would reject it too
+            _release(backend, failed=False)
+            raise OllamaError(f"Ollama request to {path} failed: {e}") from e
+        except requests.exceptions.RequestException as e:
+            _release(backend, failed=False)
+            raise OllamaError(f"Ollama request to {path} failed: {e}") from e
+        except ValueError as e:
+            _release(backend, failed=False)
+            raise OllamaError(f"Ollama returned invalid JSON from {path}: {e}") from e
+        _release(backend, failed=False)
+        metrics.increment('ollama.requests')
+        return data
+    raise OllamaError(f"No Ollama backend available for {path}: {last_error or 'every backend breaker is open'}")
+
+
+def warm_up(model=None):
+    """
+    Load the model on every backend so the first chat does not wait for it: an empty
+    /api/generate prompt loads it (kept resident for KEEP_ALIVE) without generating.
+    It takes no scheduler slot, so chats are never queued behind it (a chat arriving
+    meanwhile waits only for the same model load). Returns {url: seconds taken, or the error}.
+    """
+    payload = {'model': model or AI_CONFIG['MODEL_NAME'], 'prompt': '', 'stream': False}
+    if AI_CONFIG.get('KEEP_ALIVE'):
+        payload['keep_alive'] = AI_CONFIG['KEEP_ALIVE']
+    results = {}
+    for backend in _backends:
+        started = time.time()
+        try:
+            response = requests.post(
+                f"{backend.url}/api/generate", json=payload,
+                timeout=(AI_CONFIG['OLLAMA_CONNECT_TIMEOUT'], AI_CONFIG['TIMEOUT_SECONDS'])
+            )
+            response.raise_for_status()
+            results[backend.url] = round(time.time() - started, 2)
+        except requests.exceptions.RequestException as e:
+            logger.warning(f"Could not warm up {payload['model']} on {backend.url}: {e}")
+            results[backend.url] = str(e)
+    return results
+
+
+def backend_status(refresh=False):
+    """Health, load and breaker state of every backend"""
+    if refresh:
+        for backend in _backends:
+            backend.checked_at = 0.0
+            _probe(backend)
+    return [b.status() for b in _backends]
+
+
+def _result(data, text):
+    return {
+        'text': text,
+        'eval_count': data.get('eval_count', 0),
+        'prompt_eval_count': data.get('prompt_eval_count', 0),
+        'total_duration': data.get('total_duration', 0) / 1e9
+    }
+
+
+def chat(messages, format=None, options=None, model=None):
+    """
+    Non-streaming /api/chat call.
+    format may be "json" or a JSON schema (grammar-constrained output, Ollama >= 0.5).
+    """
+    payload = {
+        'model': model or AI_CONFIG['MODEL_NAME'],
+        'messages': messages,
+        'stream': False
+    }
+    if format:
+        payload['format'] = format
+    if options:
+        payload['options'] = options
+    data = _post('/api/chat', payload)
+    return _result(data, data.get('message', {}).get('content', ''))
+
+
+def generate(prompt, system=None, format=None, options=None, model=None):
+    """Non-streaming /api/generate call"""
+    payload = {
+        'model': model or AI_CONFIG['MODEL_NAME'],
+        'prompt': prompt,
+        'stream': False
+    }
+    if system:
+        payload['system'] = system
+    if format:
+        payload['format'] = format
+    if options:
+        payload['options'] = options
+    data = _post('/api/generate', payload)
+    return _result(data, data.get('response', ''))
@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+"""
+Stand-in Ollama server for testing multi-backend routing
+Answers /api/tags, /api/generate and /api/chat with canned replies after a
+configurable delay, and can be told to hang or fail so failover and the
+circuit breaker can be exercised without a GPU.
+
+Usage:
+  python ollama_stub_server.py --port 11501 --delay 0.5
+  python ollama_stub_server.py --port 11502 --hang-rate 0.5
+  OLLAMA_BACKENDS=http://localhost:11501,http://localhost:11502 python app.py
+"""
+
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+CANNED_REACT = (
+    "Thought: I can answer directly.\n"
+    "Final Answer: <div class=\"response-container\"><p>Stub reply from {name}</p></div>"
+)
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    server_version = "OllamaStub/1.0"
+
+    def _send(self, status, payload):
+        body = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/api/tags':
+            self._send(200, {'models': [{'name': f"{self.server.model}:latest"}]})
+        else:
+            self._send(404, {'error': 'not found'})
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        with self.server.lock:
+            self.server.requests += 1
+            count = self.server.requests
+        if random.random() < self.server.hang_rate:
+            # Longer than any sane client read timeout
+            time.sleep(3600)
+            return
+        time.sleep(self.server.delay)
+
+        text = CANNED_REACT.format(name=self.server.name)
+        stats = {'eval_count': len(text) // 4, 'prompt_eval_count': 100, 'total_duration': int(self.server.delay * 1e9)}
+        if self.path == '/api/generate':
+            self._send(200, {'model': request.get('model'), 'response': text, 'done': True, **stats})
+        elif self.path == '/api/chat':
+            content = json.dumps({'final': f"<div class=\"response-container\"><p>Stub reply from {self.server.name}</p></div>"})
+            self._send(200, {'model': request.get('model'), 'message': {'role': 'assistant', 'content': content}, 'done': True, **stats})
+        else:
+            self._send(404, {'error': 'not found'})
+        print(f"[{self.server.name}] request {count}: {self.path} model={request.get('model')}")
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--port', type=int, default=11501)
+    parser.add_argument('--delay', type=float, default=0.2, help='seconds per generation')
+    parser.add_argument('--hang-rate', type=float, default=0.0, help='fraction of requests that never answer')
+    parser.add_argument('--model', default='mistral')
+    args = parser.parse_args()
+
+    server = ThreadingHTTPServer(('127.0.0.1', args.port), StubHandler)
+    server.daemon_threads = True
+    server.name = f"stub:{args.port}"
+    server.model = args.model
+    server.delay = args.delay
+    server.hang_rate = args.hang_rate
+    server.requests = 0
+    server.lock = threading.Lock()
+    print(f"Ollama stub listening on http://127.0.0.1:{args.port}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
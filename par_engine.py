@@ -0,0 +1,212 @@
+"""
+Portfolio-at-risk (PAR) aging engine
+Days past due (DPD) per loan and PAR1/PAR7/PAR30 by manager and product, for any
+as-of date, replaying ledger.csv payments against the weekly schedule without a
+per-loan loop. Payments up to the as-of date are summed per loan with one
+np.bincount over the date-sorted ledger prefix, and the oldest installment those
+payments don't cover is floor(paid / installment) + 1, so its due date (and the
+DPD) follows arithmetically. In out-of-core ledger mode the per-loan sums come
+from a streamed pass over the ledger store's partitions up to the as-of date.
+Reports are cached per data version and as-of date.
+
+PARx is the outstanding principal of loans at least x days past due, divided by
+the outstanding principal of all open loans.
+"""
+
+import logging
+import threading
+from collections import OrderedDict
+
+import numpy as np
+import pandas as pd
+
+import ledger_store
+from config import PERFORMANCE_CONFIG
+from datasets import get_data_version, load_dataset, on_refresh
+from installment_calendar import GROUP_COLUMNS, parse_day
+
+logger = logging.getLogger(__name__)
+
+# Currency units of rounding slack when comparing payments with the schedule
+TOLERANCE = 1.0
+
+_engine = {'version': None, 'engine': None}
+_reports = OrderedDict()
+_lock = threading.Lock()
+
+
+def _money(value):
+    return round(float(value), 2)
+
+
+def _ratio(part, whole):
+    return round(float(part) / float(whole) * 100, 2) if whole else 0.0
+
+
+def bucket_labels(edges):
+    """'current', '1-6', '7-29', ... '90+' for DPD bucket edges [1, 7, 30, 60, 90]"""
+    labels = ['current']
+    labels += [f"{low}-{high - 1}" for low, high in zip(edges, edges[1:])]
+    return labels + [f"{edges[-1]}+"]
+
+
+class AgingEngine:
+    """Loan and ledger columns as arrays, ready to age the portfolio at any date"""
+
+    def __init__(self, processed, ledger=None):
+        self.loans = processed.reset_index(drop=True)
+        self.issued = pd.to_datetime(self.loans['Issued_Date']).to_numpy(dtype='datetime64[D]')
+        self.installments = self.loans['Installments'].fillna(0).to_numpy(dtype=np.int64)
+        self.charged = self.loans['Total_Charged'].fillna(0).to_numpy(dtype=np.float64)
+        self.disbursed = self.loans['Amount_Disbursed'].fillna(0).to_numpy(dtype=np.float64)
+        self.per_installment = np.divide(
+            self.charged, self.installments, out=np.zeros_like(self.charged), where=self.installments > 0
+        )
+        self.group_codes = {}
+        for key, column in GROUP_COLUMNS.items():
+            codes, labels = pd.factorize(self.loans[column], use_na_sentinel=False)
+            self.group_codes[key] = (codes.astype(np.int32), [str(label) for label in labels])
+
+        self.posted = None
+        if ledger is None:
+            return
+        # Ledger rows of known loans, sorted by posting date: payments up to D are a prefix
+        codes = pd.Index(self.loans['Loan_No']).get_indexer(ledger['Loan_No'])
+        known = codes >= 0
+        posted = pd.to_datetime(ledger['Posting_Date'].to_numpy()[known]).to_numpy(dtype='datetime64[D]')
+        order = np.argsort(posted, kind='stable')
+        self.posted = posted[order]
+        self.ledger_codes = codes[known][order].astype(np.int32)
+        self.ledger_total = ledger['Total_Paid'].to_numpy(dtype=np.float64)[known][order]
+        self.ledger_principal = ledger['Principle_Paid'].to_numpy(dtype=np.float64)[known][order]
+
+    def payments(self, day):
+        """(total paid, principal paid) per loan on or before the day"""
+        if self.posted is None:
+            sums = ledger_store.get_store().summarize('Loan_No', ['Total_Paid', 'Principle_Paid'], date_to=str(day))
+            sums = sums.reindex(self.loans['Loan_No']).fillna(0)
+            return sums['Total_Paid'].to_numpy(), sums['Principle_Paid'].to_numpy()
+        end = int(np.searchsorted(self.posted, day, side='right'))
+        count = len(self.loans)
+        paid = np.bincount(self.ledger_codes[:end], weights=self.ledger_total[:end], minlength=count)
+        principal_paid = np.bincount(self.ledger_codes[:end], weights=self.ledger_principal[:end], minlength=count)
+        return paid, principal_paid
+
+    def age(self, as_of):
+        """Per-loan arrays as of the date: paid, outstanding principal, open flag and DPD"""
+        day = np.datetime64(as_of, 'D')
+        paid, principal_paid = self.payments(day)
+
+        open_loans = (self.issued <= day) & (paid + TOLERANCE < self.charged)
+        # Oldest installment the payments so far do not cover (1-based)
+        covered = np.floor(np.divide(
+            paid + TOLERANCE, self.per_installment, out=np.zeros_like(paid), where=self.per_installment > 0
+        )).astype(np.int64)
+        first_unpaid = covered + 1
+        first_unpaid_due = self.issued + 7 * np.minimum(first_unpaid, self.installments).astype('timedelta64[D]')
+        late = open_loans & (first_unpaid <= self.installments) & (first_unpaid_due < day)
+        dpd = np.where(late, (day - first_unpaid_due).astype(np.int64), 0)
+        outstanding = np.where(open_loans, np.clip(self.disbursed - principal_paid, 0, None), 0.0)
+        return {'paid': paid, 'outstanding': outstanding, 'open': open_loans, 'dpd': dpd}
+
+    def report(self, as_of, thresholds, edges):
+        """PAR ratios and DPD buckets for the portfolio and per manager/product"""
+        aged = self.age(as_of)
+        labels = bucket_labels(edges)
+        buckets = np.digitize(aged['dpd'], edges)
+        open_loans = aged['open']
+        outstanding = aged['outstanding']
+
+        def summarize(mask):
+            total = outstanding[mask].sum()
+            summary = {
+                'open_loans': int(mask.sum()),
+                'outstanding_principal': _money(total),
+                'par': {},
+                'buckets': {},
+            }
+            for threshold in thresholds:
+                at_risk = mask & (aged['dpd'] >= threshold)
+                summary['par'][f"PAR{threshold}"] = {
+                    'loans': int(at_risk.sum()),
+                    'outstanding': _money(outstanding[at_risk].sum()),
+                    'ratio': _ratio(outstanding[at_risk].sum(), total),
+                }
+            counts = np.bincount(buckets[mask], minlength=len(labels))
+            amounts = np.bincount(buckets[mask], weights=outstanding[mask], minlength=len(labels))
+            summary['buckets'] = {
+                label: {'loans': int(counts[i]), 'outstanding': _money(amounts[i])} for i, label in enumerate(labels)
+            }
+            return summary
+
+        result = {'as_of': as_of, **summarize(open_loans)}
+        for by in ('manager', 'product'):
+            codes, names = self.group_codes[by]
+            result[f"by_{by}"] = {
+                name: summarize(open_loans & (codes == i)) for i, name in enumerate(names)
+                if (open_loans & (codes == i)).any()
+            }
+        return result
+
+    def loan_aging(self, as_of):
+        """DataFrame of the open loans with their DPD, bucket and outstanding principal"""
+        aged = self.age(as_of)
+        edges = PERFORMANCE_CONFIG['PAR_DPD_BUCKETS']
+        labels = np.array(bucket_labels(edges))
+        mask = aged['open']
+        frame = self.loans.loc[mask, ['Loan_No', 'Client_Code', 'Client_Name', 'Managed_By', 'Loan_Product_Type', 'Issued_Date']].copy()
+        frame['Paid'] = aged['paid'][mask].round(2)
+        frame['Outstanding_Principal'] = aged['outstanding'][mask].round(2)
+        frame['DPD'] = aged['dpd'][mask]
+        frame['DPD_Bucket'] = labels[np.digitize(aged['dpd'][mask], edges)]
+        return frame.sort_values('DPD', ascending=False, kind='stable').reset_index(drop=True)
+
+
+def get_engine():
+    """The aging engine for the current data version"""
+    version = get_data_version()
+    if _engine['version'] != version:
+        with _lock:
+            if _engine['version'] != version:
+                ledger = None if ledger_store.enabled() else load_dataset('ledger')
+                engine = AgingEngine(load_dataset('processed_data'), ledger)
+                _engine.update({'version': version, 'engine': engine})
+                _reports.clear()
+                logger.info(f"Built PAR aging engine ({len(engine.loans)} loans, version {version})")
+    return _engine['engine']
+
+
+@on_refresh
+def _refresh(version):
+    par_report()
+
+
+def par_report(as_of='today'):
+    """PAR1/7/30 and DPD buckets as of a date (ISO, 'today' = the data's export date, weekday names)"""
+    engine = get_engine()
+    day = parse_day(as_of)
+    key = (_engine['version'], day)
+    with _lock:
+        if key in _reports:
+            _reports.move_to_end(key)
+            return _reports[key]
+    result = engine.report(day, PERFORMANCE_CONFIG['PAR_THRESHOLDS'], PERFORMANCE_CONFIG['PAR_DPD_BUCKETS'])
+    with _lock:
+        _reports[key] = result
+        while len(_reports) > PERFORMANCE_CONFIG['PAR_CACHE_SIZE']:
+            _reports.popitem(last=False)
+    return result
+
+
+def loan_aging(as_of='today'):
+    """python_calculator helper: DataFrame of open loans with DPD and bucket, most overdue first"""
+    return get_engine().loan_aging(parse_day(as_of))
+
+
+def overdue_loans(as_of='today', min_dpd=1):
+    """API view of loan_aging(): the open loans at least min_dpd days past due"""
+    if min_dpd < 0:
+        raise ValueError("min_dpd must not be negative")
+    frame = loan_aging(as_of)
+    frame = frame[frame['DPD'] >= min_dpd]
+    return {'as_of': parse_day(as_of), 'min_dpd': min_dpd, 'count': len(frame), 'loans': frame.to_dict('records')}
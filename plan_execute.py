@@ -0,0 +1,229 @@
+"""
+Plan-and-execute agent mode for the Brightcom Loan Assistant
+
+Answers a question with a fixed LLM-call budget instead of the open-ended
+ReAct loop:
+1. one call writes the complete analysis program
+2. the program runs in the python_calculator sandbox, with one repair call if it errors
+3. one call (or the HTML template) phrases the answer
+"""
+
+import logging
+import re
+import time
+
+import program_cache
+from config import AI_CONFIG
+from generation import ProfiledOllama
+from html_responses import error_html, is_tool_error, render_result_html
+from tool_cache import strip_annotations
+from utils_simple import python_calculator
+
+logger = logging.getLogger(__name__)
+
+# Shared with the JSON-protocol agent
+CODE_RULES = """
+- Write the program on ONE line, statements separated by semicolons.
+- Start with: import pandas as pd; df = pd.read_csv('processed_data.csv')
+- The last statement must be an expression (no assignment/print) that evaluates to a small result: a number, a dict, or a list of dicts.
+- Use df.groupby('column')['value'], never df['value'].groupby('column').
+- Never call .fillna() on scalars; use: value if condition else 0.
+"""
+
+DATASETS_PROMPT = """
+DATASETS:
+- processed_data.csv: Managed_By, Loan_No, Loan_Product_Type, Client_Code, Client_Name, Issued_Date, Amount_Disbursed, Installments, Total_Paid, Total_Charged, Days_Since_Issued, Is_Installment_Day, Weeks_Passed, Installments_Expected, Installment_Amount, Expected_Paid, Expected_Before_Today, Arrears, Due_Today, Mobile_Phone_No, Status (Active/Inactive), Client_Loan_Count, Client_Type (New/Repeat)
+- The DATA PROFILE below lists the exact values of categorical columns and the date ranges.
+- loans.csv: Loan_No, Loan_Product_Type, Client_Code, Issued_Date, Approved_Amount, Manager, Recruiter, Installments, Expected_Date_of_Completion
+- ledger.csv: Posting_Date, Loan_No, Loan_Product_Type, Interest_Paid, Principle_Paid, Total_Paid
+- clients.csv: Client_Code, Client_Name, Gender, Age
+- Loan_No joins loans/ledger/processed_data; Client_Code joins processed_data/loans/clients.
+- Use ledger.csv for transaction dates and amounts; use processed_data.csv for everything else when possible.
+- Installments due on a date or range: installments_due('2025-08-15') or installments_due('2025-08-18', '2025-08-24') returns a DataFrame (Due_Date, Loan_No, Client_Name, Managed_By, Loan_Product_Type, Installment_No, Installment_Amount, Outstanding); expected_collections(from, to, by='manager'|'product'|'status') returns totals. Both accept 'today', 'tomorrow', weekday names and 'next week'.
+- Portfolio at risk: par_report(as_of='today') returns {'par': {'PAR1': {'ratio', 'loans', 'outstanding'}, ...}, 'buckets', 'by_manager', 'by_product'}; loan_aging(as_of='today') returns a DataFrame of open loans with DPD, DPD_Bucket, Outstanding_Principal.
+- Fast group-by on a whole dataset: group_agg(by, value, agg='sum', dataset='processed_data', where=None) returns the same Series as df.groupby(by)[value].agg() (agg: sum, count, size, mean, min, max); where is a boolean mask over the unfiltered dataset.
+- Ledger rows by date range or loan: ledger_query(date_from=None, date_to=None, loan_no=None) returns the matching ledger.csv rows (dates inclusive, YYYY-MM-DD; loan_no a Loan_No or list); use it instead of loading the whole ledger.
+"""
+
+PLANNER_PROMPT = """
+You are a Loan Data Analyst at BrightCom Loans. You write ONE Python program that answers the user's question from the CSV datasets. You never explain, you only output code.
+
+RULES:
+- Output plain Python only: no markdown, no backticks, no comments, no prose.""" + CODE_RULES + DATASETS_PROMPT + """
+EXAMPLES:
+Question: How many active loans do we have?
+import pandas as pd; df = pd.read_csv('processed_data.csv'); int((df['Status']=='Active').sum())
+Question: Which loan managers have the most clients?
+import pandas as pd; df = pd.read_csv('processed_data.csv'); df.groupby('Managed_By')['Client_Code'].nunique().sort_values(ascending=False).head(5).to_dict()
+Question: How much was transacted on 2025-08-11?
+import pandas as pd; float(ledger_query('2025-08-11', '2025-08-11')['Total_Paid'].sum())
+"""
+
+ANSWER_PROMPT = """
+You are a friendly Loan Data Analyst at BrightCom Loans. You are given a question and the computed result. Write the final answer as self-contained static HTML wrapped in <div class="response-container">...</div>, styled inline with the brand colors Primary #F25D27, Success #82BF45, Dark #19593B, White #FFFFFF.
+Use the concrete values from the result, never placeholders. Output only the HTML.
+"""
+
+planner_llm = ProfiledOllama(
+    model=AI_CONFIG['MODEL_NAME'],
+    system=PLANNER_PROMPT,
+    stage='action',
+    data_profile=True
+)
+
+answer_llm = ProfiledOllama(
+    model=AI_CONFIG['MODEL_NAME'],
+    system=ANSWER_PROMPT,
+    stage='final'
+)
+
+
+def extract_program(text):
+    """Pull the Python program out of a planner completion"""
+    text = text.strip()
+    if 'Action Input:' in text:
+        text = text.split('Action Input:', 1)[1]
+    fenced = re.search(r'```(?:python)?\s*(.*?)```', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    # Keep from the first import onwards; planners sometimes lead with prose
+    import_match = re.search(r'^\s*(import\s.*)', text, re.DOTALL | re.MULTILINE)
+    if import_match:
+        text = import_match.group(1)
+    return text.strip()
+
+
+def _question_title(question, limit=60):
+    title = question.strip().rstrip('?')
+    return title if len(title) <= limit else title[:limit - 3] + '...'
+
+
+def _extract_html(text):
+    """Trim an answer completion down to its HTML"""
+    final_answer_match = re.search(r'Final Answer:\s*(.*)', text, re.DOTALL)
+    if final_answer_match:
+        text = final_answer_match.group(1)
+    text = re.sub(r'```(?:html)?', '', text)
+    html_start = text.find('<')
+    html_end = text.rfind('>')
+    if html_start < 0 or html_end <= html_start:
+        return None
+    return text[html_start:html_end + 1]
+
+
+def phrase_answer(question, observation, style=None):
+    """Phrase the final answer, with one LLM call or the HTML template"""
+    style = style or AI_CONFIG.get('PLAN_EXECUTE_ANSWER', 'llm')
+    observation = strip_annotations(observation)
+    if style == 'llm':
+        try:
+            completion = answer_llm.invoke(f"Question: {question}\nResult: {observation}\nFinal Answer:")
+            answer = _extract_html(completion)
+            if answer:
+                return answer, 1
+            logger.warning("Answer step returned no HTML, falling back to template")
+        except Exception as e:
+            logger.error(f"Answer step failed, falling back to template: {e}")
+        return render_result_html(_question_title(question), observation), 1
+    return render_result_html(_question_title(question), observation), 0
+
+
+def answer_from_program_cache(question, answer_style=None):
+    """
+    Answer a question by re-running the stored program for its template.
+    Returns the same result dict as plan_and_execute, or None on a miss.
+    """
+    started = time.time()
+    cached = program_cache.lookup(question)
+    if cached is None:
+        return None
+    template, program = cached
+    observation = python_calculator.run(program)
+    if is_tool_error(observation):
+        program_cache.evict(template, reason=observation)
+        return None
+    execute_time = time.time() - started
+    answer, answer_calls = phrase_answer(question, observation, answer_style)
+    total_time = time.time() - started
+    logger.info(f"Answered from program cache in {total_time:.2f}s with {answer_calls} LLM calls")
+    return {
+        'output': answer,
+        'program': program,
+        'observation': observation,
+        'llm_calls': answer_calls,
+        'repaired': False,
+        'failed': False,
+        'program_cache': 'hit',
+        'timings': {'plan': 0.0, 'execute': execute_time, 'answer': total_time - execute_time, 'total': total_time}
+    }
+
+
+def plan_and_execute(question, context="", answer_style=None, model=None, hints=""):
+    """
+    Run the plan-and-execute pipeline and return the answer with run statistics.
+    Follow-up questions (with conversation context) never use the program cache,
+    since their meaning depends on earlier turns. model overrides the planner model;
+    hints (resolved entity names) are added to the planner prompt.
+    """
+    if not context:
+        cached = answer_from_program_cache(question, answer_style)
+        if cached is not None:
+            return cached
+
+    stats = {'llm_calls': 0, 'repaired': False, 'failed': False, 'program_cache': 'miss', 'timings': {}}
+    started = time.time()
+
+    plan_prompt = f"{context}{hints}Question: {question}\n"
+    completion = planner_llm.invoke(plan_prompt, model=model)
+    stats['llm_calls'] += 1
+    program = extract_program(completion)
+    stats['timings']['plan'] = time.time() - started
+
+    step_started = time.time()
+    observation = python_calculator.run(program)
+    if is_tool_error(observation):
+        logger.warning(f"Plan-execute program failed, requesting one repair: {observation[:200]}")
+        repair_prompt = (
+            f"{plan_prompt}"
+            f"Your previous program:\n{program}\n"
+            f"failed with:\n{observation}\n"
+            "Write the corrected program.\n"
+        )
+        completion = planner_llm.invoke(repair_prompt, model=model)
+        stats['llm_calls'] += 1
+        stats['repaired'] = True
+        program = extract_program(completion)
+        observation = python_calculator.run(program)
+    stats['timings']['execute'] = time.time() - step_started
+
+    step_started = time.time()
+    if is_tool_error(observation):
+        logger.error(f"Plan-execute program failed after repair: {observation[:200]}")
+        stats['failed'] = True
+        answer = error_html(
+            "Analysis Error",
+            "I encountered an issue while analyzing the data. Please try rephrasing your question or ask about a different aspect of the loan portfolio."
+        )
+    else:
+        if not context:
+            program_cache.promote(question, program)
+        answer, answer_calls = phrase_answer(question, observation, answer_style)
+        stats['llm_calls'] += answer_calls
+    stats['timings']['answer'] = time.time() - step_started
+    stats['timings']['total'] = time.time() - started
+
+    logger.info(
+        f"Plan-execute finished in {stats['timings']['total']:.2f}s with "
+        f"{stats['llm_calls']} LLM calls (repaired: {stats['repaired']})"
+    )
+    return {
+        'output': answer,
+        'program': program,
+        'observation': observation,
+        **stats
+    }
+
+
+async def run_plan_execute(question, context="", hints=""):
+    """Process a question in plan-and-execute mode and return the HTML answer"""
+    return plan_and_execute(question, context=context, hints=hints)['output']
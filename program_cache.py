@@ -0,0 +1,244 @@
+"""
+Program cache for recurring question templates
+Stores verified question-template -> analysis-program pairs with parameter slots
+for manager, date and product, so a recurring question re-runs the stored program
+on current data instead of asking the LLM to write it again.
+"""
+
+import fcntl
+import json
+import logging
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+from config import PERFORMANCE_CONFIG
+from datasets import get_data_version, load_dataset
+
+logger = logging.getLogger(__name__)
+
+# Slot name -> placeholder used in templates and stored programs
+SLOTS = ('manager', 'date', 'product')
+PLACEHOLDERS = {slot: f"__{slot.upper()}__" for slot in SLOTS}
+
+DATE_PATTERN = re.compile(r'\b\d{4}-\d{2}-\d{2}\b')
+FILLER_PATTERN = re.compile(r'^(please |can you |could you |kindly )+')
+
+_entries = None
+_entries_mtime = None
+_lock = threading.Lock()
+_known_values = {'version': None, 'manager': {}, 'product': {}}
+
+
+def _cache_path():
+    return os.path.join(PERFORMANCE_CONFIG['CACHE_DIR'], 'program_cache.json')
+
+
+@contextmanager
+def _store_lock():
+    """Thread lock plus an flock on the store, so load-modify-save is atomic across workers"""
+    path = _cache_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with _lock, open(f"{path}.lock", 'a') as lock_file:
+        fcntl.flock(lock_file, fcntl.LOCK_EX)
+        try:
+            yield
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _load_entries(force=False):
+    """Load the store, re-reading it when another worker has written it (always when force)"""
+    global _entries, _entries_mtime
+    try:
+        mtime = os.stat(_cache_path()).st_mtime_ns
+    except OSError:
+        mtime = None
+    if force or _entries is None or (mtime is not None and mtime != _entries_mtime):
+        try:
+            with open(_cache_path(), encoding='utf-8') as f:
+                _entries = json.load(f)
+        except (OSError, ValueError):
+            _entries = {}
+        _entries_mtime = mtime
+    return _entries
+
+
+def _save_entries():
+    global _entries_mtime
+    path = _cache_path()
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(_entries, f, indent=1)
+    os.replace(tmp_path, path)
+    _entries_mtime = os.stat(path).st_mtime_ns
+
+
+def _slot_values():
+    """Managers and products known in the current data, keyed by lowercase mention"""
+    version = get_data_version()
+    if _known_values['version'] != version:
+        df = load_dataset('processed_data')
+        managers = {}
+        for name in df['Managed_By'].dropna().unique():
+            managers[name.lower()] = name
+        # First names resolve only when a single manager has them
+        first_names = {}
+        for name in managers.values():
+            first_names.setdefault(name.split()[0].lower(), []).append(name)
+        for first, names in first_names.items():
+            if len(names) == 1 and first not in managers:
+                managers[first] = names[0]
+        products = {p.lower(): p for p in df['Loan_Product_Type'].dropna().unique()}
+        _known_values.update({'version': version, 'manager': managers, 'product': products})
+    return _known_values
+
+
+def normalize_question(question):
+    """Lowercase, strip punctuation and filler so equivalent phrasings share a template"""
+    text = question.lower().strip()
+    text = re.sub(r'[^\w\s\-]', ' ', text)
+    text = re.sub(r'\s+', ' ', text).strip()
+    return FILLER_PATTERN.sub('', text)
+
+
+def extract_template(question):
+    """
+    Replace manager, date and product mentions with slot placeholders.
+    Returns (template, params) where params maps slot -> canonical value.
+    """
+    text = normalize_question(question)
+    params = {}
+
+    date_match = DATE_PATTERN.search(text)
+    if date_match:
+        params['date'] = date_match.group(0)
+        text = text.replace(params['date'], PLACEHOLDERS['date'])
+
+    known = _slot_values()
+    for slot in ('manager', 'product'):
+        # Longest mention first so "joseph mutunga" wins over "joseph"
+        for mention in sorted(known[slot], key=len, reverse=True):
+            if re.search(rf'\b{re.escape(mention)}\b', text):
+                params[slot] = known[slot][mention]
+                text = re.sub(rf'\b{re.escape(mention)}\b', PLACEHOLDERS[slot], text, count=1)
+                break
+
+    return text, params
+
+
+def _program_template(program, params):
+    for slot, value in params.items():
+        program = program.replace(value, PLACEHOLDERS[slot])
+    return program
+
+
+def _unfilled_slots(program, slots):
+    """Slots whose placeholder is missing from a templated program (the value was spelt differently in the code)"""
+    return [slot for slot in slots if PLACEHOLDERS[slot] not in program]
+
+
+def _render_program(program, params):
+    for slot, value in params.items():
+        program = program.replace(PLACEHOLDERS[slot], value)
+    return program
+
+
+def lookup(question):
+    """
+    Find a stored program for the question's template.
+    Returns (template, program) with slots filled in, or None.
+    """
+    if not PERFORMANCE_CONFIG['PROGRAM_CACHE_ENABLED']:
+        return None
+    template, params = extract_template(question)
+    with _lock:
+        entry = _load_entries().get(template)
+    if entry is None or set(entry['slots']) != set(params):
+        return None
+    if _unfilled_slots(entry['program'], entry['slots']):
+        # Stored before promote() checked its placeholders: it would answer for the original values
+        evict(template, "program does not use its slot placeholders")
+        return None
+    with _store_lock():
+        # Re-read under the flock so another worker's concurrent update is kept
+        entry = _load_entries(force=True).get(template)
+        if entry is None:
+            return None
+        entry['hits'] += 1
+        entry['last_used'] = time.time()
+        _save_entries()
+    logger.info(f"Program cache hit for template: {template}")
+    return template, _render_program(entry['program'], params)
+
+
+def promote(question, program):
+    """Store a program that just ran successfully for the question's template"""
+    if not PERFORMANCE_CONFIG['PROGRAM_CACHE_ENABLED']:
+        return
+    template, params = extract_template(question)
+    templated = _program_template(program, params)
+    unfilled = _unfilled_slots(templated, params)
+    if unfilled:
+        # e.g. "joseph" in the question but str.contains('Joseph') in the code: replaying the program
+        # for another manager would silently answer for Joseph
+        logger.info(f"Not caching program for template '{template}': {', '.join(unfilled)} not found in the code")
+        return
+    with _store_lock():
+        entries = _load_entries(force=True)
+        existing = entries.get(template)
+        entries[template] = {
+            'program': templated,
+            'slots': sorted(params),
+            'data_version': get_data_version(),
+            'hits': existing['hits'] if existing else 0,
+            'created': existing['created'] if existing else time.time(),
+            'last_used': time.time()
+        }
+        # Evict least recently used templates beyond the size limit
+        overflow = len(entries) - PERFORMANCE_CONFIG['PROGRAM_CACHE_SIZE']
+        if overflow > 0:
+            for stale in sorted(entries, key=lambda t: entries[t]['last_used'])[:overflow]:
+                del entries[stale]
+        _save_entries()
+    logger.info(f"Program cache promoted template: {template}")
+
+
+def evict(template, reason=""):
+    """Drop a template whose stored program no longer works"""
+    with _store_lock():
+        entries = _load_entries(force=True)
+        entry = entries.pop(template, None)
+        if entry is None:
+            return
+        data_changed = entry['data_version'] != get_data_version()
+        _save_entries()
+    logger.warning(
+        f"Program cache evicted template '{template}'"
+        f"{' after a data change' if data_changed else ''}: {reason[:200]}"
+    )
+
+
+def clear():
+    """Remove every stored program"""
+    global _entries
+    with _store_lock():
+        _entries = {}
+        _save_entries()
+
+
+def stats():
+    """Summary of stored templates for monitoring"""
+    with _lock:
+        entries = _load_entries()
+        return {
+            'templates': len(entries),
+            'hits': sum(e['hits'] for e in entries.values()),
+            'entries': [
+                {'template': t, 'slots': e['slots'], 'hits': e['hits'], 'data_version': e['data_version']}
+                for t, e in sorted(entries.items(), key=lambda kv: kv[1]['hits'], reverse=True)
+            ]
+        }
@@ -0,0 +1,264 @@
+"""
+Persistent query log and cache warming
+Every /chat request is recorded in a SQLite table (QUERY_LOG_DB): the
+normalized prompt, latency, agent iterations, how it was answered (answer
+cache, coalesced, canned, briefing, program cache, fast pool or full agent),
+tool-cache hits and misses, and the data version. Rows are queued and written
+in batches by a background thread, so logging never blocks a request.
+
+After each data refresh the most popular recent questions are replayed at
+background priority, so the answer and tool caches are warm before the first
+user of the day asks them.
+"""
+
+import asyncio
+import contextvars
+import logging
+import os
+import queue
+import sqlite3
+import threading
+import time
+
+import metrics
+from config import PERFORMANCE_CONFIG
+from datasets import get_data_version, on_refresh
+from program_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+COLUMNS = (
+    'ts', 'prompt', 'normalized', 'mode', 'has_history', 'route', 'outcome', 'status',
+    'iterations', 'tool_hits', 'tool_misses', 'latency', 'data_version'
+)
+
+# Details of the current request, filled in by the code that answers it
+_turn = contextvars.ContextVar('query_log_turn', default=None)
+
+_queue = queue.Queue(maxsize=PERFORMANCE_CONFIG['QUERY_LOG_QUEUE_SIZE'])
+_writer = {'thread': None, 'pid': None}
+_writer_lock = threading.Lock()
+
+
+def begin_turn():
+    """Start collecting details for a request; returns a token for end_turn"""
+    return _turn.set({'route': None, 'outcome': None, 'iterations': None, 'tool_hits': 0, 'tool_misses': 0})
+
+
+def end_turn(token):
+    """The details collected since begin_turn"""
+    details = _turn.get() or {}
+    _turn.reset(token)
+    return details
+
+
+def note(**fields):
+    """Attach details (route, outcome, iterations) to the current request, if one is being logged"""
+    details = _turn.get()
+    if details is not None:
+        details.update(fields)
+
+
+def note_tool(status):
+    """Count a python_calculator cache hit or miss for the current request"""
+    details = _turn.get()
+    if details is not None and status in ('hit', 'miss'):
+        details['tool_hits' if status == 'hit' else 'tool_misses'] += 1
+
+
+def _connect():
+    path = PERFORMANCE_CONFIG['QUERY_LOG_DB']
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS queries ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, ts REAL, prompt TEXT, normalized TEXT, mode TEXT, "
+        "has_history INTEGER, route TEXT, outcome TEXT, status TEXT, iterations INTEGER, "
+        "tool_hits INTEGER, tool_misses INTEGER, latency REAL, data_version TEXT)"
+    )
+    conn.execute("CREATE INDEX IF NOT EXISTS queries_ts ON queries (ts)")
+    conn.execute("CREATE INDEX IF NOT EXISTS queries_normalized ON queries (normalized)")
+    return conn
+
+
+def _write_loop():
+    """Drain the queue in batches until the process exits"""
+    conn = _connect()
+    last_prune = 0.0
+    while True:
+        batch = [_queue.get()]
+        while len(batch) < 500:
+            try:
+                batch.append(_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            with conn:
+                conn.executemany(
+                    f"INSERT INTO queries ({', '.join(COLUMNS)}) VALUES ({', '.join('?' for _ in COLUMNS)})",
+                    [tuple(row[c] for c in COLUMNS) for row in batch]
+                )
+                if time.time() - last_prune > 3600:
+                    conn.execute(
+                        "DELETE FROM queries WHERE ts < ?",
+                        (time.time() - PERFORMANCE_CONFIG['QUERY_LOG_RETENTION_SECONDS'],)
+                    )
+                    last_prune = time.time()
+        except sqlite3.Error as e:
+            logger.warning(f"Could not write {len(batch)} query log rows: {e}")
+        finally:
+            for _ in batch:
+                _queue.task_done()
+
+
+def _ensure_writer():
+    # Started lazily so each forked gunicorn worker gets its own thread
+    with _writer_lock:
+        if _writer['pid'] != os.getpid() or not _writer['thread'].is_alive():
+            _writer['thread'] = threading.Thread(target=_write_loop, name='query-log-writer', daemon=True)
+            _writer['thread'].start()
+            _writer['pid'] = os.getpid()
+
+
+def record(prompt, latency, mode=None, has_history=False, status='ok', **details):
+    """Queue a query log row; dropped (and counted) if the writer has fallen behind"""
+    if not PERFORMANCE_CONFIG['QUERY_LOG_ENABLED']:
+        return
+    row = {
+        'ts': time.time(),
+        'prompt': prompt[:1000],
+        'normalized': normalize_question(prompt)[:1000],
+        'mode': mode,
+        'has_history': int(bool(has_history)),
+        'route': details.get('route'),
+        'outcome': details.get('outcome'),
+        'status': status,
+        'iterations': details.get('iterations'),
+        'tool_hits': details.get('tool_hits', 0),
+        'tool_misses': details.get('tool_misses', 0),
+        'latency': round(latency, 3),
+        'data_version': get_data_version(),
+    }
+    _ensure_writer()
+    try:
+        _queue.put_nowait(row)
+    except queue.Full:
+        metrics.increment('query_log.dropped')
+
+
+def flush(timeout=5.0):
+    """Wait (up to timeout seconds) until queued rows are written"""
+    deadline = time.time() + timeout
+    while _queue.unfinished_tasks and time.time() < deadline:
+        time.sleep(0.05)
+
+
+def popular(limit=20, window_seconds=None, min_count=1):
+    """
+    Most asked standalone questions in the window, most frequent first. Each entry has the
+    latest phrasing, mode and route, the ask count and the average latency.
+    """
+    window_seconds = window_seconds or PERFORMANCE_CONFIG['QUERY_LOG_REPLAY_WINDOW_SECONDS']
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT normalized, COUNT(*) AS asks, AVG(latency) AS avg_latency, MAX(id) AS latest "
+            "FROM queries WHERE ts > ? AND has_history = 0 AND status = 'ok' "
+            "GROUP BY normalized HAVING COUNT(*) >= ? ORDER BY asks DESC, latest DESC LIMIT ?",
+            (time.time() - window_seconds, min_count, limit)
+        ).fetchall()
+        result = []
+        for normalized, asks, avg_latency, latest in rows:
+            prompt, mode = conn.execute("SELECT prompt, mode FROM queries WHERE id = ?", (latest,)).fetchone()
+            # Answer-cache hits and coalesced requests never reach the router
+            routed = conn.execute(
+                "SELECT route FROM queries WHERE normalized = ? AND route IS NOT NULL ORDER BY id DESC LIMIT 1",
+                (normalized,)
+            ).fetchone()
+            route = routed[0] if routed else None
+            result.append({
+                'prompt': prompt, 'normalized': normalized, 'mode': mode, 'route': route,
+                'asks': asks, 'avg_latency': round(avg_latency, 2)
+            })
+        return result
+    finally:
+        conn.close()
+
+
+def stats(window_seconds=86400):
+    """Request counts, latency and outcome breakdown over the window"""
+    conn = _connect()
+    try:
+        count, avg_latency, max_latency = conn.execute(
+            "SELECT COUNT(*), AVG(latency), MAX(latency) FROM queries WHERE ts > ?",
+            (time.time() - window_seconds,)
+        ).fetchone()
+        outcomes = conn.execute(
+            "SELECT COALESCE(outcome, route, 'unknown'), COUNT(*) FROM queries WHERE ts > ? GROUP BY 1",
+            (time.time() - window_seconds,)
+        ).fetchall()
+    finally:
+        conn.close()
+    return {
+        'window_seconds': window_seconds,
+        'requests': count,
+        'avg_latency': round(avg_latency, 2) if avg_latency is not None else None,
+        'max_latency': round(max_latency, 2) if max_latency is not None else None,
+        'outcomes': dict(outcomes),
+        'queued': _queue.qsize(),
+    }
+
+
+def replay_popular(version=None):
+    """
+    Re-ask the most popular recent questions so their answers (and the tool results
+    behind them) are cached for the current data version. Runs at background priority;
+    stops early if the data changes again or QUERY_LOG_REPLAY_MAX_SECONDS runs out.
+    Returns the number of questions answered.
+    """
+    import answer_cache
+    import scheduler
+    import singleflight
+    from utils_simple import promt_llm
+
+    version = version or get_data_version()
+    started = time.time()
+    candidates = [
+        q for q in popular(
+            PERFORMANCE_CONFIG['QUERY_LOG_REPLAY_TOP'], min_count=PERFORMANCE_CONFIG['QUERY_LOG_REPLAY_MIN_COUNT']
+        )
+        # Canned replies and briefings are instant anyway
+        if q['route'] not in ('canned', 'briefing')
+    ]
+    warmed = 0
+    for index, question in enumerate(candidates):
+        if get_data_version() != version:
+            logger.info("Data changed again, stopping query replay")
+            break
+        if time.time() - started > PERFORMANCE_CONFIG['QUERY_LOG_REPLAY_MAX_SECONDS']:
+            logger.info(f"Query replay budget used up after {warmed} questions")
+            break
+        key = singleflight.make_key(question['prompt'], question['mode'], [])
+        if answer_cache.get(key) is not None:
+            continue
+        token = scheduler.set_context('background', 'query-replay')
+        try:
+            response = asyncio.run(promt_llm(
+                query=question['prompt'], mode=question['mode'], session_id=f"replay-{version}-{index}"
+            ))
+            answer_cache.put(key, response)
+            warmed += 1
+            metrics.increment('query_log.replayed')
+        except Exception as e:
+            logger.warning(f"Replay of '{question['prompt'][:80]}' failed: {e}")
+        finally:
+            scheduler.reset_context(token)
+    logger.info(f"Replayed {warmed} popular questions for data version {version} in {time.time() - started:.1f}s")
+    return warmed
+
+
+@on_refresh
+def _refresh(version):
+    if PERFORMANCE_CONFIG['QUERY_LOG_ENABLED'] and PERFORMANCE_CONFIG['QUERY_LOG_REPLAY_TOP']:
+        replay_popular(version)
@@ -0,0 +1,124 @@
+"""
+Request router for the Brightcom Loan Assistant
+A rules classifier in front of the agents: greetings get a canned reply,
+due-today/arrears/collections questions are served from the precomputed
+manager briefings, single-metric lookups go to the fast model pool
+(plan-and-execute, no ReAct loop), and multi-step analytics go to the full
+agent. Pools and thresholds
+live in AI_CONFIG; every decision is counted in metrics.
+"""
+
+import html
+import logging
+import re
+
+import metrics
+from briefings import parse_request
+from config import AI_CONFIG, PERFORMANCE_CONFIG, UI_CONFIG
+from html_responses import card_html
+
+logger = logging.getLogger(__name__)
+
+GREETING_PATTERN = re.compile(
+    r"^\s*(hi|hello|hey|hallo|habari|jambo|good (morning|afternoon|evening)|how are you|"
+    r"thanks|thank you|asante|what can you do|who are you|help)\b",
+    re.IGNORECASE
+)
+GREETING_PHRASES = re.compile(
+    r"\b(hi|hello|hey|hallo|habari|jambo|good (morning|afternoon|evening)|how are you|"
+    r"thanks|thank you|asante|what can you do|who are you|help)\b",
+    re.IGNORECASE
+)
+# Words that may accompany a greeting without asking for anything
+GREETING_FILLER = {
+    'there', 'please', 'me', 'you', 'so', 'much', 'very', 'again', 'ok', 'okay', 'all', 'everyone',
+    'bot', 'assistant', 'friend', 'sir', 'madam', 'and', 'a', 'lot', 'doing', 'today', 'i', 'can', 'need',
+}
+THANKS_PATTERN = re.compile(r'\b(thanks|thank you|asante)\b', re.IGNORECASE)
+
+# Phrases of a single lookup or aggregate
+SIMPLE_PATTERN = re.compile(
+    r"\b(how many|how much|total|sum|count|number of|what is|what's|which|latest|last|"
+    r"average|mean|highest|lowest|most|show|list|when)\b",
+    re.IGNORECASE
+)
+
+# Each match adds one point of complexity
+COMPLEX_PATTERNS = [re.compile(p, re.IGNORECASE) for p in (
+    r'\b(compare|comparison|versus|vs\.?)\b',
+    r'\b(trends?|over time|growth|changes?|forecasts?|predict|projections?)\b',
+    r'\b(why|explain|analy[sz]e|insight|recommend)\b',
+    r'\b(breakdown|break down|distribution|correlat\w*)\b',
+    r'\b(each|per|by) (manager|product|week|month|client|day)\b',
+    r'\b(rank|ranking|top \d+|bottom \d+)\b',
+    r'\b(percentage|ratio|rate|share)\b',
+    r'\bbetween\b',
+)]
+
+
+def is_greeting(text):
+    """Greeting or small talk with nothing substantive after it ('help me find C00530' is not)"""
+    if not GREETING_PATTERN.match(text):
+        return False
+    rest = re.findall(r"[a-z0-9]+", GREETING_PHRASES.sub(' ', text.lower()))
+    return all(word in GREETING_FILLER for word in rest)
+
+
+def classify(question):
+    """Return (intent, complexity score) with intent 'greeting', 'briefing', 'simple' or 'complex'"""
+    text = question.strip()
+    words = len(text.split())
+    has_data_words = bool(SIMPLE_PATTERN.search(text)) or any(p.search(text) for p in COMPLEX_PATTERNS)
+
+    if is_greeting(text) and words <= AI_CONFIG['ROUTER_GREETING_MAX_WORDS'] and not has_data_words:
+        return 'greeting', 0
+
+    # Due-today, arrears and collections questions with nothing else asked (at most a manager) are precomputed
+    if PERFORMANCE_CONFIG['BRIEFINGS_ENABLED'] and parse_request(text) is not None:
+        return 'briefing', 0
+
+    score = sum(1 for p in COMPLEX_PATTERNS if p.search(text))
+    # Several clauses usually mean several computations
+    score += len(re.findall(r'\b(and|then|also)\b', text, re.IGNORECASE))
+    if words > AI_CONFIG['ROUTER_SIMPLE_MAX_WORDS']:
+        score += 1
+
+    if score < AI_CONFIG['ROUTER_COMPLEX_THRESHOLD'] and SIMPLE_PATTERN.search(text):
+        return 'simple', score
+    return 'complex', score
+
+
+def greeting_html(question):
+    """Canned reply for greetings and small talk"""
+    if THANKS_PATTERN.search(question):
+        return card_html("You're welcome!", "<p>Happy to help. Ask me anything else about the loan portfolio.</p>")
+    suggestions = ''.join(f"<li>{html.escape(s['query'])}</li>" for s in UI_CONFIG['SUGGESTIONS'][:4])
+    return card_html(
+        "Hello! I'm your BrightCom Loan Assistant",
+        "<p>I'm doing well, thanks for asking. I can analyze loans, payments, arrears and manager performance. Try asking:</p>"
+        f"<ul style=\"margin: 10px 0 0 20px;\">{suggestions}</ul>"
+    )
+
+
+def route(question):
+    """
+    Decide how to answer a question.
+    Returns a dict with 'route' ('canned', 'briefing', 'fast' or 'full'), 'intent', 'score' and the pool settings.
+    """
+    if not AI_CONFIG['ROUTER_ENABLED']:
+        return {'route': 'full', 'intent': None, 'score': None, **AI_CONFIG['MODEL_POOLS']['full']}
+
+    intent, score = classify(question)
+    if intent == 'greeting':
+        decision = {'route': 'canned', 'intent': intent, 'score': score}
+    elif intent == 'briefing':
+        # Falls back to the fast pool when no stored briefing answers it
+        decision = {'route': 'briefing', 'intent': intent, 'score': score, **AI_CONFIG['MODEL_POOLS']['fast']}
+    elif intent == 'simple':
+        decision = {'route': 'fast', 'intent': intent, 'score': score, **AI_CONFIG['MODEL_POOLS']['fast']}
+    else:
+        decision = {'route': 'full', 'intent': intent, 'score': score, **AI_CONFIG['MODEL_POOLS']['full']}
+
+    metrics.increment(f"router.{decision['route']}")
+    logger.info(f"Routed question to '{decision['route']}' (intent: {intent}, complexity: {score})")
+    return decision
@@ -0,0 +1,191 @@
+"""
+Priority scheduler for LLM calls and tool execution
+Work is tagged with a priority class (interactive, batch, background) and a
+client (session or IP). Every Ollama request and python_calculator run takes a
+slot from a shared ticket table, so the gunicorn workers and job_worker.py
+processes queue together. When a slot frees up it goes to:
+  1. the highest-priority class waiting (queued batch/background work is
+     overtaken by interactive work; waiters age up one class per
+     SCHEDULER_AGING_SECONDS so nothing starves), then
+  2. within a class, the client with the least recent usage per class weight
+     (weighted fair sharing), then
+  3. the earliest arrival.
+Wait times are reported per class in metrics.
+"""
+
+import contextvars
+import logging
+import os
+import sqlite3
+import time
+from contextlib import contextmanager
+
+import metrics
+from config import AI_CONFIG, PERFORMANCE_CONFIG
+
+logger = logging.getLogger(__name__)
+
+_context = contextvars.ContextVar('scheduler_context', default=('interactive', 'anonymous'))
+
+
+def set_context(priority_class, client=None):
+    """Tag the work done in this context; returns a token for reset_context"""
+    if priority_class not in PERFORMANCE_CONFIG['SCHEDULER_CLASSES']:
+        raise ValueError(f"Unknown priority class '{priority_class}'")
+    return _context.set((priority_class, client or 'anonymous'))
+
+
+def reset_context(token):
+    _context.reset(token)
+
+
+def current_context():
+    return _context.get()
+
+
+def capacity(resource):
+    """Concurrent slots for a resource"""
+    if resource == 'llm':
+        # Ollama runs one generation per model at a time by default; more would only queue inside it
+        return PERFORMANCE_CONFIG['SCHEDULER_LLM_SLOTS_PER_BACKEND'] * len(AI_CONFIG['OLLAMA_BACKENDS'])
+    return PERFORMANCE_CONFIG['SCHEDULER_TOOL_SLOTS'] or os.cpu_count() or 1
+
+
+def _connect():
+    path = PERFORMANCE_CONFIG['SCHEDULER_DB']
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=10, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS tickets ("
+        "id INTEGER PRIMARY KEY AUTOINCREMENT, resource TEXT, class TEXT, client TEXT, "
+        "priority INTEGER, weight REAL, state TEXT, pid INTEGER, arrived REAL, started REAL)"
+    )
+    conn.execute("CREATE TABLE IF NOT EXISTS usage (client TEXT PRIMARY KEY, usage REAL, updated REAL)")
+    return conn
+
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+def _reap(conn):
+    """Drop tickets left behind by processes that died holding or waiting for a slot"""
+    pids = [row[0] for row in conn.execute("SELECT DISTINCT pid FROM tickets")]
+    for pid in pids:
+        if pid != os.getpid() and not _pid_alive(pid):
+            conn.execute("DELETE FROM tickets WHERE pid = ?", (pid,))
+
+
+def _decayed(usage, updated, now):
+    return usage * 0.5 ** ((now - updated) / PERFORMANCE_CONFIG['SCHEDULER_USAGE_HALF_LIFE'])
+
+
+def _try_admit(conn, ticket_id, resource, now):
+    """Admit the ticket if a slot is free and it is first in line"""
+    conn.execute("BEGIN IMMEDIATE")
+    try:
+        _reap(conn)
+        running = conn.execute(
+            "SELECT COUNT(*) FROM tickets WHERE resource = ? AND state = 'running'", (resource,)
+        ).fetchone()[0]
+        if running >= capacity(resource):
+            conn.execute("COMMIT")
+            return False
+        waiting = conn.execute(
+            "SELECT t.id, t.priority, t.weight, t.arrived, u.usage, u.updated FROM tickets t "
+            "LEFT JOIN usage u ON u.client = t.client WHERE t.resource = ? AND t.state = 'waiting'",
+            (resource,)
+        ).fetchall()
+        aging = PERFORMANCE_CONFIG['SCHEDULER_AGING_SECONDS']
+
+        def order(row):
+            priority = max(row['priority'] - int((now - row['arrived']) / aging), 0)
+            usage = _decayed(row['usage'], row['updated'], now) if row['usage'] else 0.0
+            return (priority, usage / row['weight'], row['arrived'])
+
+        admitted = bool(waiting) and min(waiting, key=order)['id'] == ticket_id
+        if admitted:
+            conn.execute("UPDATE tickets SET state = 'running', started = ? WHERE id = ?", (now, ticket_id))
+        conn.execute("COMMIT")
+        return admitted
+    except sqlite3.Error:
+        conn.execute("ROLLBACK")
+        raise
+
+
+def _charge(conn, client, seconds, now):
+    """Add service time to a client's decayed usage"""
+    row = conn.execute("SELECT usage, updated FROM usage WHERE client = ?", (client,)).fetchone()
+    usage = _decayed(row['usage'], row['updated'], now) if row else 0.0
+    conn.execute("INSERT OR REPLACE INTO usage VALUES (?, ?, ?)", (client, usage + seconds, now))
+
+
+@contextmanager
+def slot(resource='llm'):
+    """Hold a scheduler slot for `resource` ('llm' or 'tool') for the duration of the block"""
+    if not PERFORMANCE_CONFIG['SCHEDULER_ENABLED']:
+        yield
+        return
+
+    priority_class, client = _context.get()
+    settings = PERFORMANCE_CONFIG['SCHEDULER_CLASSES'][priority_class]
+    conn = _connect()
+    arrived = time.time()
+    ticket_id = conn.execute(
+        "INSERT INTO tickets (resource, class, client, priority, weight, state, pid, arrived) "
+        "VALUES (?, ?, ?, ?, ?, 'waiting', ?, ?)",
+        (resource, priority_class, client, settings['priority'], settings['weight'], os.getpid(), arrived)
+    ).lastrowid
+    started = None
+    try:
+        while not _try_admit(conn, ticket_id, resource, time.time()):
+            time.sleep(PERFORMANCE_CONFIG['SCHEDULER_POLL_SECONDS'])
+        started = time.time()
+        waited = started - arrived
+        metrics.observe(f'scheduler.{priority_class}.{resource}_wait_seconds', waited)
+        if waited > 1:
+            logger.info(f"{priority_class} {resource} slot for {client} after waiting {waited:.2f}s")
+        yield
+    finally:
+        now = time.time()
+        conn.execute("DELETE FROM tickets WHERE id = ?", (ticket_id,))
+        if started is not None:
+            _charge(conn, client, now - started, now)
+        conn.close()
+
+
+def snapshot():
+    """Waiting/running tickets per resource and class, plus the busiest clients"""
+    conn = _connect()
+    try:
+        rows = conn.execute(
+            "SELECT resource, class, state, COUNT(*) AS n, MIN(arrived) AS oldest FROM tickets "
+            "GROUP BY resource, class, state"
+        ).fetchall()
+        usage = conn.execute("SELECT client, usage, updated FROM usage").fetchall()
+    finally:
+        conn.close()
+    now = time.time()
+    queues = {}
+    for row in rows:
+        entry = queues.setdefault(row['resource'], {}).setdefault(row['class'], {})
+        entry[row['state']] = row['n']
+        if row['state'] == 'waiting':
+            entry['longest_wait_seconds'] = round(now - row['oldest'], 2)
+    clients = sorted(
+        ((r['client'], round(_decayed(r['usage'], r['updated'], now), 2)) for r in usage),
+        key=lambda c: c[1], reverse=True
+    )
+    return {
+        'capacity': {'llm': capacity('llm'), 'tool': capacity('tool')},
+        'queues': queues,
+        'client_usage_seconds': dict(clients[:20])
+    }
@@ -0,0 +1,187 @@
+"""
+Single-flight request coalescing for /chat
+Identical questions (same normalized prompt, data version, mode and history)
+that arrive while one is already being answered attach to that run instead of
+starting their own agent run. Within a worker, callers wait on the leader's
+event; across gunicorn workers, the leader holds an flock on a per-key lock
+file under CACHE_DIR/singleflight and publishes its answer to a result file.
+"""
+
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+
+try:
+    import fcntl
+except ImportError:  # Windows: coalescing stays within one process
+    fcntl = None
+
+import metrics
+from config import AI_CONFIG, PERFORMANCE_CONFIG
+from datasets import get_data_version
+from program_cache import normalize_question
+
+logger = logging.getLogger(__name__)
+
+_flights = {}
+_lock = threading.Lock()
+
+
+class _Flight:
+    """An in-progress run that other callers in this process can wait on"""
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+
+
+def make_key(prompt, mode=None, history=None):
+    """Key of a chat request: questions with equal keys get the same answer"""
+    history_hash = hashlib.sha1(json.dumps(history or [], sort_keys=True).encode()).hexdigest()
+    raw = f"{normalize_question(prompt)}|{get_data_version()}|{mode or 'auto'}|{history_hash}"
+    return hashlib.sha1(raw.encode()).hexdigest()
+
+
+def _flight_dir():
+    return os.path.join(PERFORMANCE_CONFIG['CACHE_DIR'], 'singleflight')
+
+
+def _read_result(path, since):
+    """The published answer if it was written after `since`, else None"""
+    try:
+        if os.path.getmtime(path) < since:
+            return None
+        with open(path, encoding='utf-8') as f:
+            return json.load(f)['response']
+    except (OSError, ValueError, KeyError):
+        return None
+
+
+def _same_file(lock_file, path):
+    """Whether the open lock file is still the one at path (the sweep may have removed it)"""
+    try:
+        current = os.stat(path)
+    except FileNotFoundError:
+        return False
+    opened = os.fstat(lock_file.fileno())
+    return (opened.st_dev, opened.st_ino) == (current.st_dev, current.st_ino)
+
+
+def _remove_idle_lock(path):
+    """Delete a lock file only while holding its flock, so no leader is using it"""
+    with open(path, 'a') as lock_file:
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            return
+        try:
+            if _same_file(lock_file, path):
+                os.remove(path)
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+
+def _write_result(path, response):
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, 'w', encoding='utf-8') as f:
+        json.dump({'response': response, 'created': time.time()}, f)
+    os.replace(tmp, path)
+    # Drop results and lock files nobody can attach to anymore. Lock files are never written,
+    # so their mtime is their creation time: one in use may look old and is skipped by its flock
+    cutoff = time.time() - AI_CONFIG['REQUEST_TIMEOUT']
+    for name in os.listdir(_flight_dir()):
+        try:
+            full = os.path.join(_flight_dir(), name)
+            if os.path.getmtime(full) >= cutoff:
+                continue
+            if name.endswith('.lock'):
+                _remove_idle_lock(full)
+            else:
+                os.remove(full)
+        except OSError:
+            pass
+
+
+async def _run_across_workers(key, compute):
+    """Run compute() as the cross-worker leader for key, or wait for the current leader's answer"""
+    if fcntl is None:
+        return await compute(), False
+
+    os.makedirs(_flight_dir(), exist_ok=True)
+    lock_path = os.path.join(_flight_dir(), f"{key}.lock")
+    result_path = os.path.join(_flight_dir(), f"{key}.json")
+    arrived = time.time()
+    waited = False
+    lock_file = open(lock_path, 'a')
+    try:
+        while True:
+            try:
+                fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                # Another worker is answering this question
+                waited = True
+                if time.time() - arrived > AI_CONFIG['REQUEST_TIMEOUT']:
+                    logger.warning("Gave up waiting for the coalesced run, answering independently")
+                    return await compute(), False
+                await asyncio.sleep(PERFORMANCE_CONFIG['SINGLEFLIGHT_POLL_SECONDS'])
+                continue
+            if _same_file(lock_file, lock_path):
+                break
+            # An idle-lock sweep removed the file after it was opened: lock the one now at the path
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+            lock_file.close()
+            lock_file = open(lock_path, 'a')
+        try:
+            if waited:
+                response = _read_result(result_path, arrived)
+                if response is not None:
+                    return response, True
+                # The leader failed without publishing; this worker takes over
+            response = await compute()
+            try:
+                _write_result(result_path, response)
+            except OSError as e:
+                logger.warning(f"Could not publish coalesced result: {e}")
+            return response, False
+        finally:
+            fcntl.flock(lock_file, fcntl.LOCK_UN)
+    finally:
+        lock_file.close()
+
+
+async def coalesce(key, compute):
+    """
+    Answer a request once for all concurrent callers with the same key.
+    compute is a zero-argument coroutine function. Returns (response, coalesced).
+    """
+    if not PERFORMANCE_CONFIG['SINGLEFLIGHT_ENABLED']:
+        return await compute(), False
+
+    with _lock:
+        flight = _flights.get(key)
+        leader = flight is None
+        if leader:
+            flight = _flights[key] = _Flight()
+
+    if not leader:
+        metrics.increment('singleflight.coalesced')
+        await asyncio.to_thread(flight.done.wait, AI_CONFIG['REQUEST_TIMEOUT'])
+        if flight.result is not None:
+            return flight.result, True
+        return await compute(), False
+
+    try:
+        flight.result, coalesced = await _run_across_workers(key, compute)
+        if coalesced:
+            metrics.increment('singleflight.coalesced')
+        else:
+            metrics.increment('singleflight.leaders')
+        return flight.result, coalesced
+    finally:
+        flight.done.set()
+        with _lock:
+            _flights.pop(key, None)
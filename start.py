@@ -56,7 +56,8 @@ def check_data_file():
 def check_ollama():
     """Check if Ollama is running and accessible"""
     try:
-        response = requests.get("http://localhost:11434/api/tags", timeout=5)
+        from config import AI_CONFIG
+        response = requests.get(f"{AI_CONFIG['OLLAMA_BACKENDS'][0]}/api/tags", timeout=5)
         if response.status_code == 200:
             models = response.json().get('models', [])
             mistral_found = any('mistral' in model.get('name', '').lower() for model in models)
@@ -44,32 +44,28 @@ def check_prerequisites():
         logger.error("Gunicorn not installed. Install with: pip install gunicorn")
         return False
     
-    # Check if Ollama is running
-    try:
-        import requests
-        response = requests.get('http://localhost:11434/api/tags', timeout=5)
-        if response.status_code == 200:
-            logger.info("Ollama is running")
-        else:
-            logger.error("Ollama is not responding properly")
-            return False
-    except Exception as e:
-        logger.error(f"Ollama check failed: {e}")
+    # Check the configured Ollama backends; at least one must be up
+    import requests
+    from config import AI_CONFIG
+    available = 0
+    for url in AI_CONFIG['OLLAMA_BACKENDS']:
+        try:
+            response = requests.get(f"{url.rstrip('/')}/api/tags", timeout=5)
+            if response.status_code != 200:
+                logger.error(f"Ollama backend {url} is not responding properly")
+                continue
+            available += 1
+            models = response.json().get('models', [])
+            if any(AI_CONFIG['MODEL_NAME'] in model.get('name', '').lower() for model in models):
+                logger.info(f"Ollama backend {url} is running with {AI_CONFIG['MODEL_NAME']}")
+            else:
+                logger.warning(f"{AI_CONFIG['MODEL_NAME']} not found on {url}. Pull it with: ollama pull {AI_CONFIG['MODEL_NAME']}")
+        except Exception as e:
+            logger.error(f"Ollama check failed for {url}: {e}")
+    if not available:
+        logger.error("No Ollama backend is reachable")
         return False
     
-    # Check if Mistral model is available
-    try:
-        response = requests.get('http://localhost:11434/api/tags', timeout=5)
-        models = response.json().get('models', [])
-        mistral_available = any('mistral' in model.get('name', '').lower() for model in models)
-        
-        if mistral_available:
-            logger.info("Mistral model is available")
-        else:
-            logger.warning("Mistral model not found. You may need to pull it: ollama pull mistral")
-    except Exception as e:
-        logger.warning(f"Could not check Mistral model: {e}")
-    
     logger.info("All prerequisites checked")
     return True
 
@@ -103,6 +99,10 @@ def start_gunicorn():
         if process.poll() is None:
             logger.info(f"Gunicorn started successfully with PID: {process.pid}")
             logger.info("API is running at: http://localhost:5500")
+            
+            # Long-running /api/jobs questions run outside the web workers
+            job_worker = subprocess.Popen([sys.executable, 'job_worker.py'])
+            logger.info(f"Job worker started with PID: {job_worker.pid}")
             logger.info("Press Ctrl+C to stop")
             
             # Wait for the process
@@ -113,6 +113,9 @@ def start_gunicorn():
                 process.terminate()
                 process.wait()
                 logger.info("Server stopped")
+            finally:
+                job_worker.terminate()
+                job_worker.wait()
         else:
             stdout, stderr = process.communicate()
             logger.error(f"Gunicorn failed to start:")
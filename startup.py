@@ -0,0 +1,91 @@
+#!/usr/bin/env python3
+"""
+Startup stages for the gunicorn master
+app.py imports the agent stack lazily, so a bare worker answers /health at
+once but its first chat pays for LangChain, pandas and the CSVs. preload()
+does that work once in the master before it forks: workers start with the
+agent, the datasets and the per-version indexes already built (shared
+copy-on-write), and a recycled worker comes back just as fast.
+warm_up_in_subprocess() loads the model on every Ollama backend from a
+short-lived child process, so startup is not held up and the master stays
+single-threaded (a thread there would be forked, mid-request, into every
+worker). gunicorn_config.when_ready runs both.
+
+Usage: python startup.py --warm-up
+"""
+
+import argparse
+import gc
+import logging
+import os
+import subprocess
+import sys
+import time
+
+import ledger_store
+from config import LOGGING_CONFIG
+
+logger = logging.getLogger(__name__)
+
+
+def preload():
+    """Import the chat stack and build the datasets and indexes; returns the seconds each stage took"""
+    timings = {}
+
+    started = time.time()
+    import utils_simple  # noqa: F401 - LangChain, the tools and the agent
+    timings['agent'] = round(time.time() - started, 2)
+
+    started = time.time()
+    from datasets import DATASET_FILES, load_dataset
+    for name in DATASET_FILES:
+        if name == 'ledger' and ledger_store.enabled():
+            # Converts (or catches up) the store once instead of in every worker
+            ledger_store.get_store()
+        else:
+            load_dataset(name)
+    timings['datasets'] = round(time.time() - started, 2)
+
+    started = time.time()
+    import data_profile
+    import installment_calendar
+    import par_engine
+    from groupby_kernels import ENCODED_COLUMNS, encode
+    for dataset, columns in ENCODED_COLUMNS.items():
+        if dataset == 'ledger' and ledger_store.enabled():
+            continue
+        for column in columns:
+            encode(dataset, column)
+    installment_calendar.get_calendar()
+    par_engine.get_engine()
+    data_profile.get_profile()
+    timings['indexes'] = round(time.time() - started, 2)
+
+    # Keep the garbage collector in the workers from touching (and so copying) these objects
+    gc.freeze()
+    return timings
+
+
+def warm_up_in_subprocess():
+    """Start `python startup.py --warm-up` without waiting for it; returns the Popen"""
+    root = os.path.dirname(os.path.abspath(__file__))
+    return subprocess.Popen([sys.executable, os.path.join(root, 'startup.py'), '--warm-up'], cwd=root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--warm-up', action='store_true', help='load the model on every Ollama backend and exit')
+    args = parser.parse_args()
+    if not args.warm_up:
+        parser.print_help()
+        return
+
+    logging.basicConfig(level=getattr(logging, LOGGING_CONFIG['LEVEL']), format=LOGGING_CONFIG['FORMAT'])
+    from ollama_client import warm_up
+    for url, result in warm_up().items():
+        if isinstance(result, float):
+            logger.info(f"Model warm on {url} after {result}s")
+
+
+if __name__ == "__main__":
+    main()
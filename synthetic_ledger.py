@@ -0,0 +1,101 @@
+#!/usr/bin/env python3
+"""
+Synthetic ledger generator for the out-of-core ledger store
+Writes a ledger.csv-shaped file of N rows (10M by default) in posting-date order,
+chunk by chunk, so generating it needs no more memory than one chunk. With
+--store it then converts the file into a ledger store and times a few streamed
+queries, printing the peak RSS so it can be compared with pandas.read_csv of the
+same file (--pandas).
+
+Usage: python synthetic_ledger.py [--rows N] [--output PATH] [--store DIR] [--pandas]
+"""
+
+import argparse
+import os
+import resource
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+
+from config import PERFORMANCE_CONFIG
+
+PRODUCTS = ['BIASHARA4W', 'BIASHARA6W', 'INUKA 4WKS', 'INUKA6WKS', 'INUKA8WKS']
+COLUMNS = ['Posting_Date', 'Loan_No', 'Loan_Product_Type', 'Interest_Paid', 'Principle_Paid', 'Total_Paid']
+
+
+def peak_rss_mb():
+    # ru_maxrss is in kilobytes on Linux and bytes on macOS
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return peak / (1024 * 1024 if sys.platform == 'darwin' else 1024)
+
+
+def generate(path, rows, start='2015-01-01', chunk_rows=1000000, seed=0):
+    """Write rows ledger lines spread evenly over the days from start to today"""
+    rng = np.random.default_rng(seed)
+    first = np.datetime64(start, 'D')
+    days = max(int((np.datetime64('today', 'D') - first).astype(int)), 1)
+    loans = max(rows // 10, 1)
+    written = 0
+    while written < rows:
+        count = min(chunk_rows, rows - written)
+        # Posting dates rise with the row number, as in an append-only ledger
+        day = first + (np.arange(written, written + count) * days // rows).astype('timedelta64[D]')
+        loan = rng.integers(0, loans, count)
+        total = rng.choice([250, 500, 750, 1000, 1500, 2000], count).astype(float)
+        interest = (total * 0.3 / 1.3).round()
+        chunk = pd.DataFrame({
+            'Posting_Date': day.astype(str),
+            'Loan_No': np.char.add('S', loan.astype(str)),
+            'Loan_Product_Type': np.array(PRODUCTS)[loan % len(PRODUCTS)],
+            'Interest_Paid': interest,
+            'Principle_Paid': total - interest,
+            'Total_Paid': total,
+        }, columns=COLUMNS)
+        chunk.to_csv(path, mode='w' if written == 0 else 'a', header=written == 0, index=False)
+        written += count
+
+
+def timed(label, func):
+    started = time.time()
+    result = func()
+    print(f"{label:<44}{time.time() - started:>8.2f}s  peak RSS {peak_rss_mb():>7.0f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=10000000)
+    parser.add_argument('--output', default='cache/synthetic_ledger.csv')
+    parser.add_argument('--store', help='convert into a ledger store in this directory and query it')
+    parser.add_argument('--pandas', action='store_true', help='load the file with pandas.read_csv instead')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    if not os.path.exists(args.output):
+        timed(f"Generated {args.rows:,} rows", lambda: generate(args.output, args.rows, seed=args.seed))
+    print(f"{args.output}: {os.path.getsize(args.output) / 1e9:.2f} GB")
+
+    if args.pandas:
+        ledger = timed("pandas.read_csv", lambda: pd.read_csv(args.output))
+        timed("groupby month sum", lambda: ledger.groupby(ledger['Posting_Date'].str[:7])['Total_Paid'].sum())
+        return
+
+    if args.store:
+        import datasets
+        import ledger_store
+        PERFORMANCE_CONFIG.update({'LEDGER_OUT_OF_CORE': True, 'LEDGER_STORE_DIR': args.store})
+        datasets.DATASET_FILES['ledger'] = args.output
+        store = timed("Converted / synced store", ledger_store.get_store)
+        print(f"{store.rows:,} rows in {len(store.months)} month partitions")
+        last = store.months[-1]
+        timed("sum by month (all history)", lambda: store.aggregate('month', 'Total_Paid', 'sum'))
+        timed(f"sum by day ({last} only, pruned)", lambda: store.aggregate('Posting_Date', 'Total_Paid', 'sum', date_from=f"{last}-01"))
+        timed("per-loan paid to date (PAR input)", lambda: store.summarize('Loan_No', ['Total_Paid', 'Principle_Paid']))
+        timed("rows of one loan", lambda: store.frame(loan_nos='S42'))
+
+
+if __name__ == "__main__":
+    main()
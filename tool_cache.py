@@ -0,0 +1,242 @@
+"""
+Result cache for python_calculator
+Memoizes deterministic, read-only analysis snippets keyed on the canonicalized
+code plus the data version. A size-bounded in-memory LRU sits in front of an
+optional SQLite tier that survives worker restarts and is shared by all workers.
+"""
+
+import ast
+import builtins
+import hashlib
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+from config import AI_CONFIG, PERFORMANCE_CONFIG
+from datasets import dataset_name_for_path, get_data_version
+
+logger = logging.getLogger(__name__)
+
+# Modules a cacheable snippet may import
+SAFE_MODULES = {
+    'pandas', 'numpy', 'json', 'math', 'statistics', 'datetime',
+    'collections', 're', 'itertools', 'functools', 'operator'
+}
+
+# Names always available in the python_calculator namespace
+NAMESPACE_NAMES = {
+    'pd', 'np', 'datetime', 'timedelta', 'math', 'statistics', 'json',
+    'installments_due', 'expected_collections', 'par_report', 'loan_aging', 'group_agg',
+    'ledger_query'
+}
+
+# Attribute or function names that write data or depend on the clock / randomness
+UNSAFE_CALLS = {
+    'to_csv', 'to_excel', 'to_parquet', 'to_pickle', 'to_sql', 'to_feather', 'to_hdf',
+    'to_clipboard', 'write', 'writelines', 'remove', 'unlink', 'rmdir', 'mkdir', 'rename',
+    'system', 'popen', 'open', 'exec', 'eval', 'compile', 'input', '__import__',
+    'now', 'today', 'utcnow', 'time', 'random', 'rand', 'randn', 'randint', 'choice',
+    'shuffle', 'sample', 'uuid4', 'getenv', 'setattr', 'delattr', 'globals', 'locals'
+}
+UNSAFE_NAMES = {'random', 'os', 'sys', 'subprocess', 'time', 'uuid', 'shutil', 'socket'}
+# Strings pandas/numpy resolve with the clock: pd.Timestamp('today'), pd.to_datetime('now'), np.datetime64('today')
+CLOCK_STRINGS = {'now', 'today'}
+# Helpers whose 'today' is the data's export date, so the result only changes with the data version
+DATA_DATE_HELPERS = {'installments_due', 'expected_collections', 'par_report', 'loan_aging'}
+
+# Trailing "[cache: hit]"-style tags appended to tool observations
+ANNOTATION_PATTERN = re.compile(r'(\n\[[a-z_]+: [^\]\n]*\])+\s*$')
+
+_memory = OrderedDict()
+_lock = threading.Lock()
+_stats = {'memory_hits': 0, 'disk_hits': 0, 'misses': 0, 'skipped': 0, 'stores': 0}
+
+
+def annotate(observation, status):
+    """Append the cache outcome (hit, miss or skip) to a tool observation"""
+    return f"{observation}\n[cache: {status}]"
+
+
+def strip_annotations(observation):
+    """Remove trailing tool tags before parsing an observation"""
+    if not isinstance(observation, str):
+        return observation
+    return ANNOTATION_PATTERN.sub('', observation)
+
+
+def _is_cacheable(tree):
+    """
+    A snippet is cacheable when it only reads the known datasets, imports safe
+    modules, avoids clock/random/IO calls and uses no names it didn't define.
+    """
+    assigned = set(NAMESPACE_NAMES)
+    loaded = set()
+    data_dates = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Call) and getattr(node.func, 'id', None) in DATA_DATE_HELPERS:
+            data_dates.update(id(a) for a in node.args + [k.value for k in node.keywords])
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            modules = [node.module] if isinstance(node, ast.ImportFrom) else [a.name for a in node.names]
+            if any((m or '').split('.')[0] not in SAFE_MODULES for m in modules):
+                return False
+            assigned.update((a.asname or a.name).split('.')[0] for a in node.names)
+        elif isinstance(node, (ast.Global, ast.Nonlocal, ast.Delete)):
+            return False
+        elif isinstance(node, ast.Name):
+            if node.id in UNSAFE_NAMES:
+                return False
+            (assigned if isinstance(node.ctx, (ast.Store, ast.Del)) else loaded).add(node.id)
+        elif isinstance(node, ast.Attribute) and node.attr in UNSAFE_NAMES:
+            return False
+        elif isinstance(node, ast.arg):
+            assigned.add(node.arg)
+        elif (isinstance(node, ast.Constant) and isinstance(node.value, str)
+              and node.value.strip().lower() in CLOCK_STRINGS and id(node) not in data_dates):
+            return False
+        elif isinstance(node, (ast.FunctionDef, ast.Lambda, ast.ClassDef)):
+            if not isinstance(node, ast.Lambda):
+                assigned.add(node.name)
+        elif isinstance(node, ast.Call):
+            func = node.func
+            name = func.attr if isinstance(func, ast.Attribute) else getattr(func, 'id', None)
+            if name in UNSAFE_CALLS:
+                return False
+            if name and name.startswith('read_') and name != 'read_csv':
+                return False
+            if name == 'read_csv':
+                source = node.args[0] if node.args else None
+                if not (isinstance(source, ast.Constant) and dataset_name_for_path(source.value)):
+                    return False
+    # Names read but never defined come from earlier tool calls: not reproducible from the code alone
+    free_names = loaded - assigned - set(dir(builtins))
+    return not free_names
+
+
+def make_key(code):
+    """Cache key for a cleaned snippet, or None when it must not be cached"""
+    if not PERFORMANCE_CONFIG['TOOL_CACHE_ENABLED']:
+        return None
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return None
+    if not _is_cacheable(tree):
+        with _lock:
+            _stats['skipped'] += 1
+        return None
+    # ast.unparse normalizes whitespace, quoting and redundant parentheses
+    canonical = ast.unparse(tree) if hasattr(ast, 'unparse') else ast.dump(tree)
+    # Stored observations are already shaped, so the shaping limits are part of the key
+    shaping = f"{AI_CONFIG['OBSERVATION_TOKEN_BUDGET']}/{AI_CONFIG['OBSERVATION_MAX_ROWS']}"
+    return hashlib.sha256(f"{get_data_version()}|{shaping}|{canonical}".encode()).hexdigest()
+
+
+def _db_path():
+    return PERFORMANCE_CONFIG['TOOL_CACHE_DB']
+
+
+def _connect():
+    path = _db_path()
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=5)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute(
+        "CREATE TABLE IF NOT EXISTS tool_cache ("
+        "key TEXT PRIMARY KEY, data_version TEXT, result TEXT, created REAL, last_used REAL)"
+    )
+    return conn
+
+
+def _remember(key, result):
+    """Insert into the memory tier, evicting least recently used entries"""
+    _memory[key] = result
+    _memory.move_to_end(key)
+    while len(_memory) > PERFORMANCE_CONFIG['TOOL_CACHE_SIZE']:
+        _memory.popitem(last=False)
+
+
+def get(key):
+    """Return the cached result for a key, checking memory then disk"""
+    with _lock:
+        if key in _memory:
+            _memory.move_to_end(key)
+            _stats['memory_hits'] += 1
+            return _memory[key]
+    if _db_path():
+        try:
+            conn = _connect()
+            with conn:
+                row = conn.execute("SELECT result FROM tool_cache WHERE key = ?", (key,)).fetchone()
+                if row:
+                    conn.execute("UPDATE tool_cache SET last_used = ? WHERE key = ?", (time.time(), key))
+            conn.close()
+            if row:
+                with _lock:
+                    _remember(key, row[0])
+                    _stats['disk_hits'] += 1
+                return row[0]
+        except sqlite3.Error as e:
+            logger.warning(f"Tool cache disk lookup failed: {e}")
+    with _lock:
+        _stats['misses'] += 1
+    return None
+
+
+def put(key, result):
+    """Store a successful result in both tiers"""
+    if len(result) > PERFORMANCE_CONFIG['TOOL_CACHE_MAX_RESULT_CHARS']:
+        return
+    with _lock:
+        _remember(key, result)
+        _stats['stores'] += 1
+    if _db_path():
+        try:
+            now = time.time()
+            version = get_data_version()
+            conn = _connect()
+            with conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO tool_cache VALUES (?, ?, ?, ?, ?)",
+                    (key, version, result, now, now)
+                )
+                # Results for older data versions can never be hit again
+                conn.execute("DELETE FROM tool_cache WHERE data_version != ?", (version,))
+                conn.execute(
+                    "DELETE FROM tool_cache WHERE key NOT IN "
+                    "(SELECT key FROM tool_cache ORDER BY last_used DESC LIMIT ?)",
+                    (PERFORMANCE_CONFIG['TOOL_CACHE_DB_MAX_ROWS'],)
+                )
+            conn.close()
+        except sqlite3.Error as e:
+            logger.warning(f"Tool cache disk store failed: {e}")
+
+
+def clear():
+    """Empty both cache tiers"""
+    with _lock:
+        _memory.clear()
+    if _db_path() and os.path.exists(_db_path()):
+        conn = _connect()
+        with conn:
+            conn.execute("DELETE FROM tool_cache")
+        conn.close()
+
+
+def stats():
+    """Hit/miss counters and tier sizes for monitoring"""
+    with _lock:
+        result = dict(_stats, memory_entries=len(_memory))
+    result['disk_entries'] = 0
+    if _db_path() and os.path.exists(_db_path()):
+        try:
+            conn = _connect()
+            result['disk_entries'] = conn.execute("SELECT COUNT(*) FROM tool_cache").fetchone()[0]
+            conn.close()
+        except sqlite3.Error:
+            pass
+    return result
@@ -1,14 +1,34 @@
-from langchain_community.llms.ollama import Ollama
 from langchain.tools import Tool, tool
-from langchain.agents import initialize_agent, AgentExecutor, AgentType
+from langchain.agents import initialize_agent, AgentExecutor, AgentType, ZeroShotAgent
 from langchain.memory import ConversationBufferMemory
 from pandasql import sqldf
 import pandas as pd
 import re 
 import traceback
 import asyncio
+import copy
 import logging
+import uuid
 from config import AI_CONFIG, DATA_CONFIG, ERROR_MESSAGES, SUCCESS_MESSAGES
+import metrics
+import query_log
+import scheduler
+import tool_cache
+from datasets import dataset_name_for_path, load_dataset, plain_frame
+from kernel import close_turn, current_kernel, open_turn
+from observations import has_handle, shape_observation
+from agent_guard import build_guarded_executor, last_run_stats
+from generation import ProfiledOllama
+from html_responses import error_html
+from groupby_kernels import group_agg
+from briefings import answer_question
+from client_profiles import client_profile_tool
+from entity_index import entity_hints
+from installment_calendar import expected_collections, installments_due
+from ledger_store import ledger_query
+from par_engine import loan_aging, par_report
+from router import greeting_html, route
+from ollama_client import reset_session, set_session
 
 # Configure logging
 logger = logging.getLogger(__name__)
@@ -20,9 +40,11 @@ conversation_memory = ConversationBufferMemory(
     input_key="input"
 )
 
-# Initialize LLM with improved system prompt
-llm = Ollama(
+# Initialize LLM with improved system prompt; generation profiles switch between action and final-answer steps
+llm = ProfiledOllama(
     model=AI_CONFIG['MODEL_NAME'],
+    stage='react',
+    data_profile=True,
     system=
 """
 You are a friendly and professional Loan Data Analyst at BrightCom Loans. Your job is to answer user questions using the provided CSV datasets with rigorous mathematical reasoning. You write concise, deterministic Python code for computation and provide clear business HTML answers styled with BrightCom brand colors.
@@ -120,7 +142,7 @@ DATA SOURCES AND RELATIONSHIPS
 - processed_data.csv : denormalized loan/client snapshot with these columns:
   a. Managed_By(the name of the manager of the loan), 
   b. Loan_No(unique id for a loan), 
-  c. Loan_Product_Type(BIASHARA4W, BIASHARA6W, INUKA6WKS),
+  c. Loan_Product_Type(the loan product; the values are listed in the DATA PROFILE),
   d. Client_Code(unique id for a client.Use Client_Name to answer questions about the client),
   e. Client_Name(the name of the client of the loan),
   f. Issued_Date(the date the loan was issued),
@@ -143,7 +165,7 @@ DATA SOURCES AND RELATIONSHIPS
   w. Installments_Expected(the number of installments that should be completed by today),
 - loans.csv: 1 row per loan (Loan_No). Columns:
   a. Loan_No(Unique id for a loan),
-  b. Loan_Product_Type(BIASHARA4W, BIASHARA6W, INUKA6WKS),
+  b. Loan_Product_Type(the loan product),
   c. Client_Code(Unique id for a client),
   d. Issued_Date(the date the loan was issued),
   e. Approved_Amount(the amount of money approved for the loan),
@@ -154,13 +176,13 @@ DATA SOURCES AND RELATIONSHIPS
 - ledger.csv: many rows per loan by Posting_Date. Columns:
   a. Posting_Date(Date of payment),
   b. Loan_No(Unique id for a loan),
-  c. Loan_Product_Type(BIASHARA4W, BIASHARA6W, INUKA6WKS),
+  c. Loan_Product_Type(the loan product),
   d. Interest_Paid(the amount of interest paid),
   e. Principle_Paid(the amount of principle paid),
   f. Total_Paid(the total amount paid)
 - clients.csv: 1 row per client (Client_Code). Columns:
-  a. Client_Code(Unique id for a client.Use Name to answer questions about the client),
-  b. Name(Client's name),
+  a. Client_Code(Unique id for a client.Use Client_Name to answer questions about the client),
+  b. Client_Name(Client's name),
   c. Gender(Client's gender),
   d. Age(Client's age)
 
@@ -172,7 +194,12 @@ When to use which:
 - Use processed_data alone for counts, sums, rankings by Client_Code, Managed_By, Loan_Product_Type, Status, Arrears, etc.
 - Add ledger when you need daily/time-series payments or to recompute payment aggregates by date.
 - Add loans when you need loan-only details missing from processed_data (e.g., Recruiter) or to ensure unique loans.
-- Add clients when you need demographics (Name/Gender/Age) not present in processed_data.
+- Add clients when you need demographics (Client_Name/Gender/Age) not present in processed_data.
+- For questions about a single client (by code, name or phone), use the client_profile tool instead of joining the CSVs.
+- For installments due on a future or past date, never compute schedules from Issued_Date yourself. In python_calculator, installments_due('2025-08-15') (or a range: installments_due('2025-08-18', '2025-08-24'), 'today', 'tomorrow', 'friday', 'next week') returns a DataFrame with Due_Date, Loan_No, Client_Name, Managed_By, Installment_No, Installment_Amount and Outstanding. expected_collections('next week', by='manager') returns the scheduled and outstanding totals per day and per manager/product/status.
+- For portfolio at risk, days past due or aging questions, never replay the ledger yourself. In python_calculator, par_report('2025-08-11') (default 'today') returns PAR1/PAR7/PAR30 ratios and DPD buckets for the portfolio, 'by_manager' and 'by_product'. loan_aging('2025-08-11') returns a DataFrame of open loans with DPD, DPD_Bucket and Outstanding_Principal, most overdue first.
+- For a group-by total over a whole CSV, group_agg is faster than df.groupby: group_agg('Managed_By', 'Arrears', 'sum') equals df.groupby('Managed_By')['Arrears'].sum() on processed_data.csv (agg: sum, count, size, mean, min, max; by may be a list; dataset='ledger' for ledger.csv; where=df['Status']=='Active' restricts rows of the unfiltered frame).
+- For ledger transactions in a date range or for specific loans, ledger_query('2025-08-01', '2025-08-11', loan_no=None) returns just those ledger.csv rows (loan_no may be one Loan_No or a list); prefer it to loading the whole ledger, which is refused when ledger.csv is too large to load.
 
 BUSINESS OBJECTIVES & DECISION POLICY
 - You are analyzing a loan-issuing business. Primary goals:
@@ -208,9 +235,10 @@ PYTHON CODING GUIDELINES (concise):
   - Manager arrears totals:
     import pandas as pd; df = pd.read_csv('processed_data.csv'); df.groupby('Managed_By')['Arrears'].sum().to_dict()
   - Latest transaction (ledger):
-    import pandas as pd; lg = pd.read_csv('ledger.csv'); r = lg.sort_values('Posting_Date', ascending=False).iloc[0]; {"Loan_No": r['Loan_No'], "Loan_Product_Type": r['Loan_Product_Type'], "Interest_Paid": r['Interest_Paid'], "Principle_Paid": r['Principle_Paid'], "Total_Paid": r['Total_Paid'], "Posting_Date": str(r['Posting_Date']).split()[0]}
+    import pandas as pd; last = group_agg('Posting_Date', 'Total_Paid', 'size', dataset='ledger').index.max(); r = ledger_query(last, last).iloc[-1]; {"Loan_No": r['Loan_No'], "Loan_Product_Type": r['Loan_Product_Type'], "Interest_Paid": r['Interest_Paid'], "Principle_Paid": r['Principle_Paid'], "Total_Paid": r['Total_Paid'], "Posting_Date": str(r['Posting_Date']).split()[0]}
 
 Important output tip: When your result is a pandas Series/DataFrame, convert it to a compact JSON dict or list and print it, e.g. print(json.dumps(series.to_dict(), ensure_ascii=False)). Avoid printing raw pandas objects.
+Large results come back summarized (row count, head/tail sample, totals) with a "[handle: ...]" line; answer from the summary or aggregate further instead of printing everything.
 
 EDGE CASE HANDLING:
 If no results are found, the Final Answer should be:
@@ -261,16 +289,30 @@ def python_calculator(code: str):
       import pandas as pd; df = pd.read_csv('processed_data.csv'); d = df[df['Due_Today']>0][['Client_Code','Client_Name','Due_Today']].head(50); [{"Client_Code": r['Client_Code'], "Client_Name": r['Client_Name'], "Due_Today": float(r['Due_Today'])} for _, r in d.iterrows()]
     - Follow-up questions (use context):
       If context mentions "latest transaction on 2025-08-11" and question asks "How much on that date":
-      import pandas as pd; lg = pd.read_csv('ledger.csv'); lg[lg['Posting_Date']=='2025-08-11']['Total_Paid'].sum()
+      import pandas as pd; ledger_query('2025-08-11', '2025-08-11')['Total_Paid'].sum()
     - Manager performance analysis (avoid .fillna() on scalars):
       import pandas as pd; df = pd.read_csv('processed_data.csv'); mgr = 'Joseph Mutunga'; ontime = df[df['Managed_By']==mgr]['Total_Paid'].sum() / df[df['Managed_By']==mgr]['Expected_Before_Today'].sum() if df[df['Managed_By']==mgr]['Expected_Before_Today'].sum() > 0 else 0; {"ontime_ratio": ontime}
     - Manager arrears totals (correct groupby pattern):
       import pandas as pd; df = pd.read_csv('processed_data.csv'); df.groupby('Managed_By')['Arrears'].sum().to_dict()
     - Latest loan disbursement (use ledger.csv for transactions):
-      import pandas as pd; df = pd.read_csv('processed_data.csv'); lg = pd.read_csv('ledger.csv'); r = lg.sort_values('Posting_Date', ascending=False).iloc[0]; {"Manager": df[df['Loan_No']==r['Loan_No']]['Managed_By'].iloc[0], "Client": df[df['Loan_No']==r['Loan_No']]['Client_Name'].iloc[0], "Amount": float(r['Total_Paid'])}
+      import pandas as pd; df = pd.read_csv('processed_data.csv'); last = group_agg('Posting_Date', 'Total_Paid', 'size', dataset='ledger').index.max(); r = ledger_query(last, last).iloc[-1]; {"Manager": df[df['Loan_No']==r['Loan_No']]['Managed_By'].iloc[0], "Client": df[df['Loan_No']==r['Loan_No']]['Client_Name'].iloc[0], "Amount": float(r['Total_Paid'])}
     - Manager arrears analysis (group by manager correctly):
       import pandas as pd; df = pd.read_csv('processed_data.csv'); df.groupby('Managed_By')['Arrears'].abs().sum().to_dict()
     """
+    cache_state = {'status': 'skip'}
+    # Analysis snippets share the CPU with other requests by priority class
+    with scheduler.slot('tool'):
+        observation = _run_python_code(code, cache_state)
+    query_log.note_tool(cache_state['status'])
+    return tool_cache.annotate(observation, cache_state['status'])
+
+
+def _run_python_code(code, cache_state):
+    """
+    Clean and execute an analysis snippet for python_calculator.
+    Deterministic read-only snippets are served from / stored in the tool-result cache;
+    cache_state['status'] is set to 'hit', 'miss' or 'skip' (not cacheable).
+    """
     try:
         # Create a safe execution environment with all necessary libraries
         import numpy as np
@@ -288,8 +330,18 @@ def python_calculator(code: str):
             'timedelta': timedelta,
             'math': math,
             'statistics': statistics,
-            'json': json
+            'json': json,
+            # Plain text columns even with COMPACT_DATASETS, so the agent's pandas behaves as usual
+            '_load_dataset': lambda name: plain_frame(load_dataset(name), copy=True),
+            'installments_due': lambda *args, **kwargs: plain_frame(installments_due(*args, **kwargs)),
+            'expected_collections': expected_collections,
+            'par_report': lambda as_of='today': copy.deepcopy(par_report(as_of)),
+            'loan_aging': lambda *args, **kwargs: plain_frame(loan_aging(*args, **kwargs)),
+            'group_agg': group_agg,
+            'ledger_query': lambda *args, **kwargs: plain_frame(ledger_query(*args, **kwargs))
         }
+        base_names = set(local_namespace)
+        active_kernel = current_kernel()
         
         # Clean the code by removing markdown formatting and backticks
         cleaned_code = code.strip()
@@ -459,8 +511,9 @@ def python_calculator(code: str):
             return f"df.loc[{cond}, [{cols}]]"
         cleaned_code = re.sub(r"df\s*\[(.+?)\]\s*\[\[\s*(.+?)\s*\]\]", _to_loc, cleaned_code)
         
-        # Ensure the code starts with import
-        if not cleaned_code.lstrip().startswith('import'):
+        # Ensure the code starts with import (follow-up snippets may build on kernel variables instead)
+        kernel_has_state = active_kernel is not None and (active_kernel.namespace or active_kernel.pending)
+        if not cleaned_code.lstrip().startswith('import') and not kernel_has_state:
             logger.warning(f"Code doesn't start with import: {repr(cleaned_code)}")
             import_match = re.search(r'import\s+pandas\s+as\s+pd.*', cleaned_code)
             if import_match:
@@ -468,10 +521,32 @@ def python_calculator(code: str):
             else:
                 return "Error: Code must start with 'import pandas as pd'"
         
+        # Serve repeated deterministic snippets from the tool-result cache
+        cache_key = tool_cache.make_key(cleaned_code)
+        
+        # Serve known CSVs from the shared dataset cache instead of re-parsing them
+        def _dataset_read(m: re.Match) -> str:
+            name = dataset_name_for_path(m.group(2))
+            return f"_load_dataset('{name}')" if name else m.group(0)
+        cleaned_code = re.sub(r"pd\.read_csv\(\s*(['\"])([^'\"]+)\1\s*\)", _dataset_read, cleaned_code)
+        
+        if cache_key:
+            cached = tool_cache.get(cache_key)
+            # Entries stored before handle-bearing results were excluded may point at expired handles
+            if cached is not None and not has_handle(cached):
+                cache_state['status'] = 'hit'
+                if active_kernel is not None:
+                    # Bind its variables only if a later snippet needs them
+                    active_kernel.pending.append(cleaned_code)
+                return cached
+            cache_state['status'] = 'miss'
+        
         # Execute the cleaned code and capture the result
         import io
         from contextlib import redirect_stdout
         local_namespace["__builtins__"] = __builtins__
+        if active_kernel is not None:
+            active_kernel.bind(local_namespace)
         stdout_buffer = io.StringIO()
         
         # Split code into statements by semicolons or newlines
@@ -503,13 +578,22 @@ def python_calculator(code: str):
         if result is None:
             printed = stdout_buffer.getvalue().strip()
             result = printed if printed else "Code executed"
-        return str(result)
+        if active_kernel is not None:
+            active_kernel.absorb(local_namespace, base_names)
+        result = shape_observation(result)
+        # Handles expire long before a cached result would, so summaries that carry one are not cached
+        if cache_key and not has_handle(result):
+            tool_cache.put(cache_key, result)
+        return result
         
     except SyntaxError as e:
         error_msg = f"Syntax error in Python code: {str(e)}. Please check your code syntax."
         logger.error(f"Python calculator syntax error: {error_msg}")
         return error_msg
     except NameError as e:
+        # A variable may come from a cached snippet the kernel hasn't executed yet
+        if active_kernel is not None and active_kernel.replay_pending({name: local_namespace[name] for name in base_names}):
+            return _run_python_code(code, cache_state)
         error_msg = f"Name error: {str(e)}. Make sure to import required libraries and load data first."
         logger.error(f"Python calculator name error: {error_msg}")
         return error_msg
@@ -524,14 +608,19 @@ tools = [
         name="python_calculator",
         func=python_calculator,
         description="Use this tool for complex calculations, statistical analysis, or mathematical operations. Input should be valid Python code that returns a result. You can use pandas, numpy, math, statistics, and datetime libraries. Always import required libraries first."
+    ),
+    Tool(
+        name="client_profile",
+        func=client_profile_tool,
+        description="Use this tool for questions about one client. Input is a Client_Code (e.g. C00530), the client's name or mobile number. Returns the client's demographics, every loan with its status, payment history summary and current arrears as JSON."
     )
 ]
 
-# Create agent executor with memory
-agent = initialize_agent(
+# Create agent executor with memory; the loop guard stops runs that stop making progress
+agent = build_guarded_executor(
+    agent=ZeroShotAgent.from_llm_and_tools(llm=llm, tools=tools),  # More flexible format
     tools=tools,
-    llm=llm,
-    agent=AgentType.ZERO_SHOT_REACT_DESCRIPTION,  # More flexible format
+    tags=[AgentType.ZERO_SHOT_REACT_DESCRIPTION.value],
     verbose=True,
     handle_parsing_errors=True,
     max_iterations=AI_CONFIG['MAX_ITERATIONS'],  # More iterations for complex queries
@@ -540,13 +629,23 @@ agent = initialize_agent(
 )
 
 
-async def promt_llm(query, conversation_history=None):
+async def promt_llm(query, conversation_history=None, mode=None, session_id=None):
     """
     Process user query and return AI response.
+    mode selects the agent ('react', 'plan_execute' or 'json'); defaults to AI_CONFIG['AGENT_MODE'].
+    session_id lets tool calls reuse the session's kernel variables when KERNEL_SCOPE is 'session'.
+    Without an explicit mode the router picks a canned reply, the fast pool or the full agent.
     """
+    # Tool calls in this turn share one kernel namespace
+    kernel_token = open_turn(session_id)
+    # LLM calls of one conversation stay on one Ollama backend, so its KV cache is reused
+    ollama_token = set_session(session_id or uuid.uuid4().hex)
     try:
+        decision = route(query) if mode is None else {'route': 'full', 'mode': mode}
+        mode = decision.get('mode') or AI_CONFIG['AGENT_MODE']
+        query_log.note(route=decision['route'])
         if agent is None:
-            return "I'm having trouble initializing the AI system. Please restart the application."
+            return error_html("System Error", "I'm having trouble initializing the AI system. Please restart the application.")
         
         # Build context from conversation history
         context = ""
@@ -568,16 +667,81 @@ async def promt_llm(query, conversation_history=None):
         
         # Combine context with current query
         full_query = context + "Current question: " + query
+
+        if decision['route'] == 'canned':
+            result = greeting_html(query)
+            query_log.note(outcome='canned')
+            conversation_memory.save_context({"input": full_query}, {"output": result})
+            return result
+
+        if decision['route'] == 'briefing':
+            # Due-today lists, arrears and collections are precomputed per data version
+            result = answer_question(query) if not context else None
+            if result is not None:
+                query_log.note(outcome='briefing')
+                conversation_memory.save_context({"input": full_query}, {"output": result})
+                return result
+            decision['route'] = 'fast'
+
+        # Recurring question templates skip code generation entirely
+        if not context:
+            from plan_execute import answer_from_program_cache
+            cached = answer_from_program_cache(query)
+            if cached is not None:
+                query_log.note(outcome='program_cache')
+                conversation_memory.save_context({"input": full_query}, {"output": cached['output']})
+                return cached['output']
+
+        # Names as users write them ("joseph", "lucia mutave") mapped to exact column values
+        hints = entity_hints(query)
+        full_query = context + hints + "Current question: " + query
+
+        if decision['route'] == 'fast':
+            from plan_execute import plan_and_execute
+            try:
+                fast = plan_and_execute(
+                    query, context=context, answer_style=decision.get('answer_style'), model=decision.get('model'),
+                    hints=hints
+                )
+            except Exception as e:
+                fast = None
+                logger.warning(f"Fast pool failed: {e}")
+            if fast is not None and not fast['failed']:
+                query_log.note(outcome='fast')
+                conversation_memory.save_context({"input": full_query}, {"output": fast['output']})
+                return fast['output']
+            # The small model couldn't answer: hand the question to the full agent
+            metrics.increment('router.fast_fallbacks')
+            mode = AI_CONFIG['MODEL_POOLS']['full'].get('mode') or AI_CONFIG['AGENT_MODE']
+
+        if mode == 'plan_execute':
+            from plan_execute import run_plan_execute
+            result = await run_plan_execute(query, context=context, hints=hints)
+            query_log.note(outcome='plan_execute')
+            conversation_memory.save_context({"input": full_query}, {"output": result})
+            return result
+
+        if mode == 'json':
+            from json_agent import run_json_agent
+            result = await run_json_agent(query, context=context + hints)
+            if result is not None:
+                query_log.note(outcome='json')
+                conversation_memory.save_context({"input": full_query}, {"output": result})
+                return result
+            metrics.increment('json.fallbacks')
+            logger.warning("JSON protocol failed, falling back to the ReAct agent")
         
         try:
             response = agent.invoke({"input": full_query})
             result = response.get("output", "No response generated")
             intermediate = response.get("intermediate_steps")
+            query_log.note(outcome='agent', iterations=last_run_stats().get('iterations'))
         except Exception as agent_error:
             # Handle agent parsing errors specifically
             error_str = str(agent_error)
             if "Could not parse LLM output" in error_str or "Invalid Format" in error_str or "Missing 'Action:'" in error_str:
                 logger.warning(f"Agent parsing error: {agent_error}")
+                metrics.increment('react.fatal_parse_errors')
                 return f'<div class="response-container"><div style="background: linear-gradient(135deg, #F25D27 0%, #19593B 100%); color: white; padding: 20px; border-radius: 8px; margin: 10px 0; box-shadow: 0 4px 15px rgba(242, 93, 39, 0.3); border-left: 5px solid #19593B;"><h3 style="margin: 0 0 10px 0; font-size: 1.3rem; font-weight: 700;">Processing Error</h3><p style="margin: 0; line-height: 1.6; font-size: 1rem;">I encountered an issue processing your request. Please try rephrasing your question or ask about a different aspect of the loan portfolio.</p></div></div>'
             else:
                 logger.error(f"Agent execution error: {agent_error}")
@@ -592,6 +756,7 @@ async def promt_llm(query, conversation_history=None):
                         return None
                     # steps is typically a list of (AgentAction, observation)
                     for action, obs in reversed(steps):
+                        obs = tool_cache.strip_annotations(obs)
                         # prefer JSON-shaped observations
                         if isinstance(obs, str) and obs.strip().startswith('{') and obs.strip().endswith('}'):
                             import json
@@ -680,11 +845,15 @@ async def promt_llm(query, conversation_history=None):
             print(result)
             return result
         else:
-            return "I'm here to help with loan and financial data questions. What would you like to know about your loan portfolio?"
+            # The agent produced no text: an error card, so callers (jobs, answer cache) see a failure
+            return error_html("No Answer", "I'm here to help with loan and financial data questions. What would you like to know about your loan portfolio?")
                 
     except Exception as e:
         logger.error(f"Error in promt_llm: {str(e)}")
-        return "I'm having trouble processing your request. Please try again."
+        return error_html("Processing Error", "I'm having trouble processing your request. Please try again.")
+    finally:
+        close_turn(kernel_token)
+        reset_session(ollama_token)
 
 def clear_conversation_memory():
     """Clear the conversation memory"""